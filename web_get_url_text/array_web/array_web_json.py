@@ -1,5 +1,4 @@
 import requests
-from bs4 import BeautifulSoup
 import os
 import time
 import logging
@@ -7,15 +6,22 @@ from typing import Set, List, Optional, Dict
 import json
 import hashlib
 from collections import defaultdict
+from web_get_url_text.search_url.html_backends import extract_texts, resolve_backend
+
+# aタグを除いた見出し・本文のみを対象にする
+TEXT_TAGS = ('p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'div')
 
 class WebTextCrawler:
     def __init__(self, 
                  urls: List[str],
                  output_dir: str = "crawled_data",
-                 delay: float = 1.0):
+                 delay: float = 1.0,
+                 parser_backend: str = 'auto'):
         self.urls = urls
         self.output_dir = output_dir
         self.delay = delay
+        # テキスト抽出に使うHTMLパーサー（'auto'の場合は利用できる最速のもの）
+        self.parser_backend = resolve_backend(parser_backend, 'texts')
         
         self.visited_urls: Set[str] = set()
         self.text_hashes: Set[str] = set()
@@ -69,14 +75,8 @@ class WebTextCrawler:
         response.encoding = 'utf-8'
         response.raise_for_status()
         
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        for tag in soup(['script', 'style', 'nav', 'footer']):
-            tag.decompose()
-        
         texts = []
-        for element in soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'div']):
-            text = element.get_text().strip()
+        for text in extract_texts(response.text, self.parser_backend, tags=TEXT_TAGS):
             text = text.encode('utf-8', errors='ignore').decode('utf-8')
             if text:
                 text = ' '.join(text.split())
@@ -1,22 +1,25 @@
 import requests
-from bs4 import BeautifulSoup
 import os
 import json
 import time
 import logging
 from typing import List, Dict, Set
 from collections import defaultdict
+from web_get_url_text.search_url.html_backends import extract_texts, resolve_backend
 
 class WebTextCrawlerWithCookies:
     def __init__(self, 
                  urls: List[str], 
                  cookies: List[Dict[str, str]], 
                  output_dir: str = "crawled_data", 
-                 delay: float = 1.0):
+                 delay: float = 1.0,
+                 parser_backend: str = 'auto'):
         self.urls = urls
         self.cookies = cookies
         self.output_dir = output_dir
         self.delay = delay
+        # テキスト抽出に使うHTMLパーサー（'auto'の場合は利用できる最速のもの）
+        self.parser_backend = resolve_backend(parser_backend, 'texts')
         self.visited_urls: Set[str] = set()
         self.file_counter = 0
         
@@ -44,18 +47,7 @@ class WebTextCrawlerWithCookies:
         )
         response.raise_for_status()
         
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        for tag in soup(['script', 'style', 'nav', 'footer']):
-            tag.decompose()
-        
-        texts = []
-        for element in soup.find_all(['a', 'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'div']):
-            text = element.get_text().strip()
-            if text:
-                texts.append(text)
-                
-        return texts
+        return extract_texts(response.text, self.parser_backend)
 
     def save_text(self, url: str, texts: List[str]):
         """テキストを指定フォーマットでJSON形式で保存"""
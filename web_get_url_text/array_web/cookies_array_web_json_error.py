@@ -1,16 +1,32 @@
 import requests
-from bs4 import BeautifulSoup
 import os
+import re
 import json
 import time
 import logging
-from typing import List, Dict, Set
+from typing import List, Dict, Set, Optional
 from collections import defaultdict
 import concurrent.futures
 import threading
+from urllib.parse import urlsplit
 from requests.exceptions import Timeout, RequestException
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
+from web_get_url_text.search_url.url_canonical import URLCanonicalizer
+from web_get_url_text.search_url.host_scheduler import HostScheduler, HostQueue
+from web_get_url_text.file_array_web.revalidation_cache import RevalidationCache
+from web_get_url_text.file_array_web.incremental_store import IncrementalStore
+from web_get_url_text.search_url.html_backends import extract_texts, resolve_backend
+from web_get_url_text.search_url.fetch_guard import FetchGuard, ContentSkipped
+from web_get_url_text.search_url.adaptive_concurrency import AdaptiveConcurrency
+from web_get_url_text.search_url.crawl_metrics import CrawlMetrics
+from web_get_url_text.search_url.replay_transport import ResponseArchive, ReplaySession, record_session
+from web_get_url_text.search_url.dns_cache import get_dns_cache, take_lookup_seconds
+
+# save_textが書き出すファイル名
+DATA_FILE_PATTERN = re.compile(r'data(\d+)\.json')
+# ページ・robots.txtの取得に送るUser-Agent
+USER_AGENT = 'Custom Web Crawler'
 
 class WebTextCrawlerWithCookies:
     def __init__(self, 
@@ -20,9 +36,20 @@ class WebTextCrawlerWithCookies:
                  delay: float = 2.0,
                  timeout: int = 60,
                  max_workers: int = 2,
-                 max_retries: int = 5):
+                 max_retries: int = 5,
+                 canonicalizer: Optional[URLCanonicalizer] = None,
+                 scheduler: Optional[HostScheduler] = None,
+                 revalidation_cache: Optional[RevalidationCache] = None,
+                 parser_backend: str = 'auto',
+                 fetch_guard: Optional[FetchGuard] = None,
+                 concurrency: Optional[AdaptiveConcurrency] = None,
+                 metrics: Optional[CrawlMetrics] = None,
+                 incremental_store: Optional[IncrementalStore] = None,
+                 archive: Optional[ResponseArchive] = None,
+                 replay: bool = False):
         
-        self.urls = urls
+        self.canonicalizer = canonicalizer or URLCanonicalizer()
+        self.urls = self.dedup_urls(urls)
         self.cookies = cookies
         self.output_dir = output_dir
         self.delay = delay
@@ -30,10 +57,36 @@ class WebTextCrawlerWithCookies:
         self.max_workers = max_workers
         self.max_retries = max_retries
         self.visited_urls: Set[str] = set()
-        self.file_counter = 0
+        self.file_counter = self.next_file_number(output_dir)
         self.lock = threading.Lock()  # スレッドロックの初期化を__init__で行う
         self.error_stats = defaultdict(int)
-
+        # 取得したレスポンスを記録するアーカイブ（複数のクローラーで共有可能）。replay=Trueの場合はネットワークに
+        # 接続せず、アーカイブに記録したレスポンスからテキストを抽出する（リクエスト間隔・robots.txtは無視する）
+        if replay and archive is None:
+            raise ValueError("replay=Trueの場合はarchiveを指定してください")
+        self.archive = archive
+        self.replay = replay
+        if scheduler is None and replay:
+            scheduler = HostScheduler(default_delay=0, respect_robots=False, respect_retry_after=False)
+        # ホストごとのリクエスト間隔を管理するスケジューラ（複数のクローラーで共有可能）
+        self.scheduler = scheduler or HostScheduler(default_delay=delay, user_agent=USER_AGENT)
+        # 前回のクロール結果との比較用キャッシュ（変更のないページは解析・保存しない）
+        self.revalidation_cache = revalidation_cache
+        # 保存を終えるまで再検証用キャッシュへの記録を待つレスポンス（URL -> (レスポンス, 解析時間)）
+        self.pending_revalidation = {}
+        # テキスト抽出に使うHTMLパーサー（'auto'の場合は利用できる最速のもの）
+        self.parser_backend = resolve_backend(parser_backend, 'texts')
+        # HTML以外・巨大な本文をダウンロードせずに打ち切るフィルタ（複数のクローラーで共有可能）
+        self.fetch_guard = fetch_guard or FetchGuard()
+        # ホストごとの同時リクエスト数を応答に応じて調整するコントローラ（複数のクローラーで共有可能）
+        # 指定した場合はmax_concurrencyがスレッド数になり、max_workersは使わない
+        self.concurrency = concurrency
+        if concurrency is not None:
+            self.max_workers = concurrency.max_concurrency
+        # 取得数・バイト数・エラー数・応答時間を外部から読み出すメトリクス（複数のクローラーで共有可能）
+        self.metrics = metrics
+        # 前回抽出したテキストのハッシュ（テキストが変わらないページは保存しない。複数のクローラーで共有可能）
+        self.incremental_store = incremental_store
         
         logging.basicConfig(
             level=logging.INFO,
@@ -45,8 +98,19 @@ class WebTextCrawlerWithCookies:
         os.makedirs(output_dir, exist_ok=True)
         self.setup_session()
 
+    def dedup_urls(self, urls: List[str]) -> List[str]:
+        """URLを正規化し、表記ゆれによる重複を除去する（順序は維持）"""
+        unique_urls = {}
+        for url in urls:
+            unique_urls.setdefault(self.canonicalizer.key(url), self.canonicalizer(url))
+        return list(unique_urls.values())
+
     def setup_session(self):
         """セッションの設定とリトライ戦略の実装"""
+        if self.replay:
+            # アーカイブから再生する場合は接続・リトライの設定は不要
+            self.session = ReplaySession(self.archive)
+            return
         self.session = requests.Session()
         
         # リトライ戦略の設定
@@ -54,6 +118,8 @@ class WebTextCrawlerWithCookies:
             total=self.max_retries,
             backoff_factor=1,
             status_forcelist=[429, 500, 502, 503, 504],
+            # 最後のレスポンスを返させ、429/503のRetry-Afterをスケジューラに渡す
+            raise_on_status=False,
         )
         
         adapter = HTTPAdapter(max_retries=retry_strategy)
@@ -63,31 +129,47 @@ class WebTextCrawlerWithCookies:
         # クッキーの設定
         for cookie in self.cookies:
             self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'])
+        
+        if self.archive is not None:
+            record_session(self.session, self.archive)
 
-    def extract_text(self, url: str) -> List[str]:
-        """URLからテキストを抽出（タイムアウト付き）"""
+    def extract_text(self, url: str) -> Optional[List[str]]:
+        """URLからテキストを抽出（タイムアウト付き）。前回から変更がない場合はNoneを返す"""
         try:
-            response = self.session.get(
+            headers = {
+                'User-Agent': USER_AGENT,
+                'Accept-Charset': 'utf-8'
+            }
+            if self.revalidation_cache:
+                headers.update(self.revalidation_cache.conditional_headers(url))
+            take_lookup_seconds()
+            start = time.perf_counter()
+            response = self.fetch_guard.fetch(
+                self.session,
                 url,
-                headers={
-                    'User-Agent': 'Custom Web Crawler',
-                    'Accept-Charset': 'utf-8'
-                },
+                headers=headers,
                 timeout=self.timeout
             )
+            # DNSキャッシュを通した名前解決の時間（新しい接続を作らなかった場合はNone）
+            dns_seconds = take_lookup_seconds()
+            if self.metrics is not None:
+                self.metrics.observe('crawl_fetch_seconds', time.perf_counter() - start, host=urlsplit(url).netloc)
+                if dns_seconds is not None:
+                    self.metrics.observe('crawl_dns_seconds', dns_seconds, host=urlsplit(url).netloc)
+                self.metrics.inc('crawl_pages_total', status=str(response.status_code))
+                self.metrics.inc('crawl_bytes_total', len(response.content))
+            self.scheduler.observe(url, response.status_code, response.headers)
             response.raise_for_status()
+            if self.revalidation_cache and self.revalidation_cache.is_unchanged(url, response):
+                return None
             
-            soup = BeautifulSoup(response.text, 'html.parser')
+            parse_start = time.perf_counter()
+            texts = extract_texts(response.text, self.parser_backend)
             
-            for tag in soup(['script', 'style', 'nav', 'footer']):
-                tag.decompose()
-            
-            texts = []
-            for element in soup.find_all(['a', 'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'div']):
-                text = element.get_text().strip()
-                if text:
-                    texts.append(text)
-                    
+            if self.revalidation_cache:
+                # 保存を終えてから記録する（保存前に中断すると、次回は変更なしと判定されて保存されなくなるため）
+                with self.lock:
+                    self.pending_revalidation[url] = (response, time.perf_counter() - parse_start)
             return texts
             
         except Timeout:
@@ -97,6 +179,29 @@ class WebTextCrawlerWithCookies:
             self.logger.error(f"Request failed for {url}: {str(e)}")
             raise
 
+    @staticmethod
+    def next_file_number(output_dir: str) -> int:
+        """出力先にある data{N}.json の最大の番号+1を返す（中断した出力先で再開したときに前回のファイルを上書きしないため）"""
+        numbers = [-1]
+        if os.path.isdir(output_dir):
+            for name in os.listdir(output_dir):
+                match = DATA_FILE_PATTERN.fullmatch(name)
+                if match:
+                    numbers.append(int(match.group(1)))
+        return max(numbers) + 1
+
+    def record_revalidation(self, url: str):
+        """保存を終えたページのレスポンスを再検証用キャッシュに記録する"""
+        with self.lock:
+            pending = self.pending_revalidation.pop(url, None)
+        if pending is not None:
+            self.revalidation_cache.record(url, *pending)
+
+    def discard_revalidation(self, url: str):
+        """保存できなかったページのレスポンスを記録せずに捨てる（次回も変更ありとして取得・保存する）"""
+        with self.lock:
+            self.pending_revalidation.pop(url, None)
+
     def save_text(self, url: str, texts: List[str]):
         """テキストを指定フォーマットでJSON形式で保存（スレッドセーフ）"""
         with self.lock:  # ロックを使用して排他制御
@@ -131,12 +236,37 @@ class WebTextCrawlerWithCookies:
             self.logger.info(f"Processing: {url}")
             texts = self.extract_text(url)
             
-            if texts:
-                self.save_text(url, texts)
+            if texts is None:
+                # 前回から変更がないため保存しない
                 result['success'] = True
-                
-            time.sleep(self.delay)
+                result['unchanged'] = True
+                if self.incremental_store:
+                    self.incremental_store.touch(url)
+            elif texts:
+                status = None
+                if self.incremental_store:
+                    status, text_hash = self.incremental_store.check(url, texts)
+                if status == 'unchanged':
+                    # 抽出したテキストが前回と同じため保存しない
+                    result['unchanged'] = True
+                else:
+                    self.save_text(url, texts)
+                    if self.incremental_store:
+                        self.incremental_store.record(url, text_hash)
+                self.record_revalidation(url)
+                result['success'] = True
+            else:
+                # テキストのないページは保存するものがないため、そのまま記録する
+                self.record_revalidation(url)
             
+        except ContentSkipped as e:
+            # HTML以外・巨大な本文はエラーではなくスキップとして扱う
+            self.logger.info(f"Skipped {url}: {e.reason}")
+            result['success'] = True
+            result['skipped'] = e.reason
+            if self.metrics is not None:
+                self.metrics.inc('crawl_skipped_total', reason=e.reason)
+                
         except Timeout as e:
             error_msg = f"Timeout error for {url}: {str(e)}"
             self.logger.error(error_msg)
@@ -149,7 +279,11 @@ class WebTextCrawlerWithCookies:
             error_msg = f"Request error for {url}: {str(e)}"
             self.logger.error(error_msg)
             result['error'] = error_msg
-            result['error_type'] = f'http_{e.response.status_code}' if hasattr(e, 'response') else 'request_error'
+            if e.response is not None:
+                result['status'] = e.response.status_code
+                result['error_type'] = f'http_{e.response.status_code}'
+            else:
+                result['error_type'] = 'request_error'
             with self.lock:
                 self.error_stats[result['error_type']] += 1
                 
@@ -160,28 +294,51 @@ class WebTextCrawlerWithCookies:
             result['error_type'] = type(e).__name__
             with self.lock:
                 self.error_stats['unexpected'] += 1
-            
+        
+        # 保存まで終えられなかったページは記録しない
+        self.discard_revalidation(url)
+        if self.metrics is not None and result['error_type']:
+            self.metrics.inc('crawl_errors_total', type=result['error_type'])
         return result
 
+    def worker(self, host_queue: HostQueue) -> List[Dict]:
+        """送信可能になったホストのURLから順に取り出して処理する"""
+        results = []
+        while True:
+            url = host_queue.get()
+            if url is None:
+                return results
+            start = time.perf_counter()
+            try:
+                results.append(self.process_url(url))
+            except Exception as e:
+                self.logger.error(f"Unexpected error for {url}: {str(e)}")
+                results.append({
+                    'url': url,
+                    'success': False,
+                    'error': str(e),
+                    'error_type': type(e).__name__
+                })
+            # タイムアウト・接続エラー・429・5xxで同時リクエスト数を下げる
+            result = results[-1]
+            host_queue.done(url, time.perf_counter() - start, result.get('status'),
+                            error=result['error_type'] in ('timeout', 'request_error'))
+            if self.metrics is not None:
+                self.metrics.set('crawl_queue_depth', len(host_queue), crawler=os.path.basename(self.output_dir))
+
     def crawl(self):
+        # DNSキャッシュが有効な場合は、取得するURLのホストを先に解決しておく
+        dns_cache = get_dns_cache()
+        if dns_cache is not None and not self.replay:
+            dns_cache.prefetch({urlsplit(url).hostname for url in self.urls})
         results = []
+        host_queue = HostQueue(self.scheduler, self.urls, self.concurrency)
         
         with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            future_to_url = {executor.submit(self.process_url, url): url for url in self.urls}
+            futures = [executor.submit(self.worker, host_queue) for _ in range(self.max_workers)]
             
-            for future in concurrent.futures.as_completed(future_to_url):
-                url = future_to_url[future]
-                try:
-                    result = future.result()
-                    results.append(result)
-                except Exception as e:
-                    self.logger.error(f"Unexpected error for {url}: {str(e)}")
-                    results.append({
-                        'url': url,
-                        'success': False,
-                        'error': str(e),
-                        'error_type': type(e).__name__
-                    })
+            for future in concurrent.futures.as_completed(futures):
+                results.extend(future.result())
         
         # 詳細なクロール結果のサマリーを作成
         successful = sum(1 for r in results if r['success'])
@@ -189,6 +346,38 @@ class WebTextCrawlerWithCookies:
         self.logger.info("Error statistics:")
         for error_type, count in self.error_stats.items():
             self.logger.info(f"  {error_type}: {count}")
+        if self.concurrency is not None:
+            self.logger.info(f"Concurrency per host: {self.concurrency.format(max_hosts=10)}")
+        
+        guard_stats = self.fetch_guard.summary()
+        self.logger.info("Skipped content statistics:")
+        self.logger.info(f"  non-HTML content type: {guard_stats.get('skipped_content_type', 0)}")
+        self.logger.info(f"  too large: {guard_stats.get('skipped_too_large', 0)}")
+        self.logger.info(f"  bytes not downloaded: {guard_stats.get('skipped_bytes', 0):,}")
+        
+        if self.revalidation_cache:
+            summary = self.revalidation_cache.summary()
+            self.logger.info("Revalidation statistics:")
+            self.logger.info(f"  not modified (304): {int(summary.get('not_modified', 0))}")
+            self.logger.info(f"  unchanged content: {int(summary.get('unchanged_hash', 0))}")
+            self.logger.info(f"  bytes saved: {int(summary.get('bytes_saved', 0)):,}")
+            self.logger.info(f"  parse time saved: {summary.get('parse_seconds_saved', 0.0):.1f}s")
+        
+        if self.incremental_store:
+            summary = self.incremental_store.summary()
+            self.logger.info("Incremental statistics:")
+            self.logger.info(f"  new: {summary.get('new', 0)}")
+            self.logger.info(f"  changed: {summary.get('changed', 0)}")
+            self.logger.info(f"  unchanged: {summary.get('unchanged', 0)}")
+        
+        if self.archive is not None:
+            summary = self.archive.summary()
+            if self.replay:
+                self.logger.info("Replay statistics:")
+                self.logger.info(f"  served: {summary['hits']}")
+                self.logger.info(f"  not in archive: {summary['misses']}")
+            else:
+                self.logger.info(f"Archived responses: {summary['recorded']} ({self.archive.path})")
         
         return results
 
@@ -1,5 +1,4 @@
 import requests
-from bs4 import BeautifulSoup
 import os
 import time
 import logging
@@ -7,22 +6,38 @@ from typing import Set, List, Optional, Dict
 import json
 import hashlib
 from collections import defaultdict
+from web_get_url_text.search_url.url_canonical import URLCanonicalizer
+from web_get_url_text.search_url.host_scheduler import HostScheduler, HostQueue
+from web_get_url_text.search_url.html_backends import extract_texts, resolve_backend
+
+# aタグを除いた見出し・本文のみを対象にする
+TEXT_TAGS = ('p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'div')
+# ページ・robots.txtの取得に送るUser-Agent
+USER_AGENT = 'Custom Web Crawler'
 
 class WebTextCrawler:
     def __init__(self, 
                  urls: List[str],
                  cushion_urls: Optional[Dict[str, str]] = None,
                  output_dir: str = "crawled_data",
-                 delay: float = 1.0):
+                 delay: float = 1.0,
+                 canonicalizer: Optional[URLCanonicalizer] = None,
+                 scheduler: Optional[HostScheduler] = None,
+                 parser_backend: str = 'auto'):
         self.urls = urls
+        self.canonicalizer = canonicalizer or URLCanonicalizer()
         self.cushion_urls = cushion_urls or {}
         self.output_dir = output_dir
         self.delay = delay
+        # ホストごとのリクエスト間隔を管理するスケジューラ（複数のクローラーで共有可能）
+        self.scheduler = scheduler or HostScheduler(default_delay=delay, user_agent=USER_AGENT)
+        # テキスト抽出に使うHTMLパーサー（'auto'の場合は利用できる最速のもの）
+        self.parser_backend = resolve_backend(parser_backend, 'texts')
         self.session = requests.Session()
         self.file_counter = 0  # ファイル名用のカウンター
         
         self.headers = {
-            'User-Agent': 'Custom Web Crawler',
+            'User-Agent': USER_AGENT,
             'Accept-Charset': 'utf-8'
         }
         self.session.headers.update(self.headers)
@@ -73,11 +88,11 @@ class WebTextCrawler:
                 cushion_url = self.cushion_urls[url]
                 self.logger.info(f"Accessing cushion page: {cushion_url}")
                 
+                self.scheduler.acquire(cushion_url)
                 response = self.session.get(cushion_url)
+                self.scheduler.observe(cushion_url, response.status_code, response.headers)
                 response.raise_for_status()
                 
-                time.sleep(self.delay)
-                
             except Exception as e:
                 self.logger.error(f"Error handling cushion page for {url}: {str(e)}")
                 raise
@@ -86,17 +101,12 @@ class WebTextCrawler:
         self.handle_cushion_page(url)
         
         response = self.session.get(url)
+        self.scheduler.observe(url, response.status_code, response.headers)
         response.encoding = 'utf-8'
         response.raise_for_status()
         
-        soup = BeautifulSoup(response.text, 'html.parser')
-        
-        for tag in soup(['script', 'style', 'nav', 'footer']):
-            tag.decompose()
-        
         texts = []
-        for element in soup.find_all(['p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'div']):
-            text = element.get_text().strip()
+        for text in extract_texts(response.text, self.parser_backend, tags=TEXT_TAGS):
             text = text.encode('utf-8', errors='ignore').decode('utf-8')
             if text:
                 text = ' '.join(text.split())
@@ -140,7 +150,6 @@ class WebTextCrawler:
             if texts and not self.is_duplicate_content(url, texts):
                 return self.save_text(url, texts)
                 
-            time.sleep(self.delay)
             return False
                 
         except Exception as e:
@@ -150,11 +159,18 @@ class WebTextCrawler:
     def crawl(self):
         """URLリストの処理"""
         successful_urls = 0
-        for url in self.urls:
-            if url not in self.visited_urls:
+        # リクエスト可能になったホストのURLから順に処理する
+        host_queue = HostQueue(self.scheduler, self.urls)
+        while True:
+            url = host_queue.get()
+            if url is None:
+                break
+            # 訪問済み判定は正規化したURLで行う（cushion_urlsの参照には元のURLを使う）
+            url_key = self.canonicalizer.key(url)
+            if url_key not in self.visited_urls:
                 if self.process_url(url):
                     successful_urls += 1
-                self.visited_urls.add(url)
+                self.visited_urls.add(url_key)
             
         self.logger.info(f"Crawling completed. Successfully processed {successful_urls} out of {len(self.urls)} URLs.")
 
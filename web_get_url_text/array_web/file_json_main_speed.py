@@ -1,4 +1,5 @@
 from web_get_url_text.array_web.cookies_array_web_json_error import WebTextCrawlerWithCookies
+from web_get_url_text.search_url.adaptive_concurrency import AdaptiveConcurrency
 from summary_delete_speed import extract_text_fields
 import json
 import glob
@@ -21,7 +22,7 @@ def filter_pdf_urls(urls):
     """PDFのURLを除外する関数"""
     return [url for url in urls if not url.lower().endswith('.pdf')]
 
-def process_single_json(json_path, output_base_dir):
+def process_single_json(json_path, output_base_dir, concurrency=None):
     """単一のJSONファイルを処理する関数"""
     # ファイル名から拡張子を除いてサブフォルダ名として使用
     base_name = os.path.splitext(os.path.basename(json_path))[0]
@@ -57,7 +58,8 @@ def process_single_json(json_path, output_base_dir):
         delay=0,
         timeout=30,
         max_workers=32,
-        max_retries=4
+        max_retries=4,
+        concurrency=concurrency
     )
     
     crawler.crawl()
@@ -83,11 +85,14 @@ def process_all_json_files(input_directory: str, output_base_dir: str, num_proce
         print(f"警告: {input_directory} にJSONファイルが見つかりませんでした。")
         return
     
+    # ホストごとの同時リクエスト数（最大32）を応答に応じて調整し、全ファイルで引き継ぐ
+    concurrency = AdaptiveConcurrency(max_concurrency=32)
+    
     # 各JSONファイルを処理
     for json_file in json_files:
         print(f"{json_file} を処理中...")
         try:
-            process_single_json(json_file, output_base_dir)
+            process_single_json(json_file, output_base_dir, concurrency)
         except Exception as e:
             print(f"エラー: {json_file} の処理中に問題が発生しました: {str(e)}")
 
@@ -128,7 +133,7 @@ if __name__ == "__main__":
     try:
         if args.single:
             logging.info(f"Single file mode: {args.single}")
-            process_single_json(args.single, args.output, args.processes)
+            process_single_json(args.single, args.output, AdaptiveConcurrency(max_concurrency=32))
         else:
             logging.info(f"Batch processing mode: {args.input}")
             process_all_json_files(args.input, args.output, args.processes)
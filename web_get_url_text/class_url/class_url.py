@@ -2,15 +2,21 @@ import json
 from urllib.parse import urlparse
 from collections import defaultdict
 import os
+import sys
+# ディレクトリに入って直接実行した場合もweb_get_url_textパッケージを読み込めるよう、リポジトリのルートを追加する
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from web_get_url_text.search_url.url_canonical import URLCanonicalizer
 
-def process_urls_to_separate_files(input_json_path, output_dir):
+def process_urls_to_separate_files(input_json_path, output_dir, canonicalizer=None):
     """
     JSONファイルからURLを読み込み、2番目のパスごとに個別のJSONファイルを作成する
     
     Args:
         input_json_path (str): 入力JSONファイルのパス
         output_dir (str): 出力ディレクトリのパス
+        canonicalizer (URLCanonicalizer): URLの正規化に使うクラス（Noneの場合は既定の設定）
     """
+    canonicalizer = canonicalizer or URLCanonicalizer()
     try:
         # output_urlディレクトリが存在しない場合は作成
         if not os.path.exists(output_dir):
@@ -27,6 +33,12 @@ def process_urls_to_separate_files(input_json_path, output_dir):
         # 空白と引用符を削除
         urls = [url.strip().strip('"') for url in urls if url.strip()]
         
+        # 正規化して表記ゆれによる重複を除去（最初に出現した順を保持）
+        unique_urls = {}
+        for url in urls:
+            unique_urls.setdefault(canonicalizer.key(url), canonicalizer(url))
+        urls = list(unique_urls.values())
+        
         # パスでグループ化
         path_groups = defaultdict(list)
         
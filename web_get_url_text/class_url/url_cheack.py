@@ -1,21 +1,28 @@
 import json
 import glob
 import os
-from typing import List, Dict, Set
+import sys
+from typing import List, Dict, Optional
+# ディレクトリに入って直接実行した場合もweb_get_url_textパッケージを読み込めるよう、リポジトリのルートを追加する
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from web_get_url_text.search_url.url_canonical import URLCanonicalizer
 
-def merge_json_files(folder_path: str) -> tuple[List[str], int]:
+def merge_json_files(folder_path: str, canonicalizer: Optional[URLCanonicalizer] = None) -> tuple[List[str], int]:
     """
     指定されたフォルダ内のすべてのJSONファイルを読み込み、
     URLを1つのリストにまとめ、重複を除去します。
+    表記ゆれ（フラグメント、パラメータ順、トラッキング用パラメータなど）は正規化して同一URLとして扱います。
     
     Args:
         folder_path: JSONファイルが存在するフォルダのパス
+        canonicalizer: URLの正規化に使うURLCanonicalizer（Noneの場合は既定の設定）
     
     Returns:
         tuple: (重複除去後のURLリスト, 重複していたURL数)
     """
-    # すべてのURLを保存するセット
-    all_urls: Set[str] = set()
+    canonicalizer = canonicalizer or URLCanonicalizer()
+    # 重複判定キーから正規化済みURLへの対応（最初に見つかった表記を保持）
+    all_urls: Dict[str, str] = {}
     # 重複カウント用の一時的なリスト
     temp_urls: List[str] = []
     
@@ -38,8 +45,9 @@ def merge_json_files(folder_path: str) -> tuple[List[str], int]:
                 
                 # 一時リストに追加（重複カウント用）
                 temp_urls.extend(urls)
-                # セットに追加（重複除去）
-                all_urls.update(urls)
+                # 正規化したキーで重複除去
+                for url in urls:
+                    all_urls.setdefault(canonicalizer.key(url), canonicalizer(url))
         except Exception as e:
             print(f"ファイル {json_file} の処理中にエラーが発生しました: {str(e)}")
             continue
@@ -51,12 +59,12 @@ def merge_json_files(folder_path: str) -> tuple[List[str], int]:
         # 結果を新しいJSONファイルに保存
         output_file = os.path.join(folder_path, "merged_urls.json")
         with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(list(all_urls), f, ensure_ascii=False, indent=2)
+            json.dump(list(all_urls.values()), f, ensure_ascii=False, indent=2)
     except Exception as e:
         print(f"結果の保存中にエラーが発生しました: {str(e)}")
         raise
     
-    return list(all_urls), duplicates_count
+    return list(all_urls.values()), duplicates_count
 
 def main():
     folder_path = "./dmm_url" # カレントディレクトリを使用。必要に応じて変更してください。
@@ -1,15 +1,34 @@
 import requests
-from bs4 import BeautifulSoup
 import os
+import sys
+import re
 import json
 import time
 import logging
-from typing import List, Dict, Set
+from typing import List, Dict, Set, Optional
 from collections import defaultdict
 import threading
+from urllib.parse import urlsplit
 from requests.exceptions import Timeout, RequestException
 from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
+# ディレクトリに入って直接実行した場合もweb_get_url_textパッケージを読み込めるよう、リポジトリのルートを追加する
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from web_get_url_text.search_url.url_canonical import URLCanonicalizer
+from web_get_url_text.search_url.host_scheduler import HostScheduler, HostQueue
+from web_get_url_text.file_array_web.revalidation_cache import RevalidationCache
+from web_get_url_text.file_array_web.incremental_store import IncrementalStore
+from web_get_url_text.search_url.html_backends import extract_texts, resolve_backend
+from web_get_url_text.search_url.fetch_guard import FetchGuard, ContentSkipped
+from web_get_url_text.search_url.adaptive_concurrency import AdaptiveConcurrency
+from web_get_url_text.search_url.crawl_metrics import CrawlMetrics
+from web_get_url_text.search_url.replay_transport import ResponseArchive, ReplaySession, record_session
+from web_get_url_text.search_url.dns_cache import get_dns_cache, take_lookup_seconds
+
+# save_textが書き出すファイル名
+DATA_FILE_PATTERN = re.compile(r'data(\d+)\.json')
+# ページ・robots.txtの取得に送るUser-Agent
+USER_AGENT = 'Custom Web Crawler'
 from tqdm import tqdm
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import psutil
@@ -22,17 +41,56 @@ class WebTextCrawlerWithCookies:
                  output_dir: str = "crawled_data", 
                  timeout: int = 60,
                  max_workers: int = None,
-                 max_retries: int = 5):
+                 max_retries: int = 5,
+                 canonicalizer: Optional[URLCanonicalizer] = None,
+                 delay: float = 0.0,
+                 scheduler: Optional[HostScheduler] = None,
+                 revalidation_cache: Optional[RevalidationCache] = None,
+                 parser_backend: str = 'auto',
+                 fetch_guard: Optional[FetchGuard] = None,
+                 concurrency: Optional[AdaptiveConcurrency] = None,
+                 metrics: Optional[CrawlMetrics] = None,
+                 incremental_store: Optional[IncrementalStore] = None,
+                 archive: Optional[ResponseArchive] = None,
+                 replay: bool = False):
         
-        self.urls = urls
+        self.canonicalizer = canonicalizer or URLCanonicalizer()
+        self.urls = self.dedup_urls(urls)
         self.cookies = cookies
         self.output_dir = output_dir
         self.timeout = timeout
         self.max_workers = max_workers or psutil.cpu_count(logical=True)
         self.max_retries = max_retries
         self.visited_urls: Set[str] = set()
-        self.file_counter = 0
+        self.file_counter = self.next_file_number(output_dir)
         self.error_stats = defaultdict(int)
+        # 取得したレスポンスを記録するアーカイブ（複数のクローラーで共有可能）。replay=Trueの場合はネットワークに
+        # 接続せず、アーカイブに記録したレスポンスからテキストを抽出する（リクエスト間隔・robots.txtは無視する）
+        if replay and archive is None:
+            raise ValueError("replay=Trueの場合はarchiveを指定してください")
+        self.archive = archive
+        self.replay = replay
+        if scheduler is None and replay:
+            scheduler = HostScheduler(default_delay=0, respect_robots=False, respect_retry_after=False)
+        # ホストごとのリクエスト間隔とRetry-Afterを管理するスケジューラ（複数のクローラーで共有可能）
+        self.scheduler = scheduler or HostScheduler(default_delay=delay, user_agent=USER_AGENT)
+        # 前回のクロール結果との比較用キャッシュ（変更のないページは解析・保存しない）
+        self.revalidation_cache = revalidation_cache
+        # 保存を終えるまで再検証用キャッシュへの記録を待つレスポンス（URL -> (レスポンス, 解析時間)）
+        self.pending_revalidation = {}
+        # テキスト抽出に使うHTMLパーサー（'auto'の場合は利用できる最速のもの）
+        self.parser_backend = resolve_backend(parser_backend, 'texts')
+        # HTML以外・巨大な本文をダウンロードせずに打ち切るフィルタ（複数のクローラーで共有可能）
+        self.fetch_guard = fetch_guard or FetchGuard()
+        # ホストごとの同時リクエスト数を応答に応じて調整するコントローラ（複数のクローラーで共有可能）
+        # 指定した場合はmax_concurrencyがスレッド数になり、max_workersは使わない
+        self.concurrency = concurrency
+        if concurrency is not None:
+            self.max_workers = concurrency.max_concurrency
+        # 取得数・バイト数・エラー数・応答時間を外部から読み出すメトリクス（複数のクローラーで共有可能）
+        self.metrics = metrics
+        # 前回抽出したテキストのハッシュ（テキストが変わらないページは保存しない。複数のクローラーで共有可能）
+        self.incremental_store = incremental_store
         
         logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
         self.logger = logging.getLogger(__name__)
@@ -41,33 +99,88 @@ class WebTextCrawlerWithCookies:
         self.setup_session()
         self.lock = threading.Lock()
 
+    def dedup_urls(self, urls: List[str]) -> List[str]:
+        """URLを正規化し、表記ゆれによる重複を除去する（順序は維持）"""
+        unique_urls = {}
+        for url in urls:
+            unique_urls.setdefault(self.canonicalizer.key(url), self.canonicalizer(url))
+        return list(unique_urls.values())
+
     def setup_session(self):
+        if self.replay:
+            # アーカイブから再生する場合は接続・リトライの設定は不要
+            self.session = ReplaySession(self.archive)
+            return
         self.session = requests.Session()
         
-        retry_strategy = Retry(total=self.max_retries, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
+        retry_strategy = Retry(total=self.max_retries, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
         adapter = HTTPAdapter(max_retries=retry_strategy)
         self.session.mount("http://", adapter)
         self.session.mount("https://", adapter)
         
         for cookie in self.cookies:
             self.session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'])
+        
+        if self.archive is not None:
+            record_session(self.session, self.archive)
 
-    def extract_text(self, url: str) -> List[str]:
+    def extract_text(self, url: str) -> Optional[List[str]]:
+        """URLからテキストを抽出する。前回から変更がない場合はNoneを返す"""
         try:
-            response = self.session.get(url, headers={'User-Agent': 'Custom Web Crawler', 'Accept-Charset': 'utf-8'}, timeout=self.timeout)
+            headers = {'User-Agent': USER_AGENT, 'Accept-Charset': 'utf-8'}
+            if self.revalidation_cache:
+                headers.update(self.revalidation_cache.conditional_headers(url))
+            take_lookup_seconds()
+            start = time.perf_counter()
+            response = self.fetch_guard.fetch(self.session, url, headers=headers, timeout=self.timeout)
+            # DNSキャッシュを通した名前解決の時間（新しい接続を作らなかった場合はNone）
+            dns_seconds = take_lookup_seconds()
+            if self.metrics is not None:
+                self.metrics.observe('crawl_fetch_seconds', time.perf_counter() - start, host=urlsplit(url).netloc)
+                if dns_seconds is not None:
+                    self.metrics.observe('crawl_dns_seconds', dns_seconds, host=urlsplit(url).netloc)
+                self.metrics.inc('crawl_pages_total', status=str(response.status_code))
+                self.metrics.inc('crawl_bytes_total', len(response.content))
+            self.scheduler.observe(url, response.status_code, response.headers)
             response.raise_for_status()
+            if self.revalidation_cache and self.revalidation_cache.is_unchanged(url, response):
+                return None
             
-            soup = BeautifulSoup(response.text, 'html.parser')
-            for tag in soup(['script', 'style', 'nav', 'footer']):
-                tag.decompose()
-            
-            texts = [element.get_text().strip() for element in soup.find_all(['a', 'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'div']) if element.get_text().strip()]
+            parse_start = time.perf_counter()
+            texts = extract_texts(response.text, self.parser_backend)
+            if self.revalidation_cache:
+                # 保存を終えてから記録する（保存前に中断すると、次回は変更なしと判定されて保存されなくなるため）
+                with self.lock:
+                    self.pending_revalidation[url] = (response, time.perf_counter() - parse_start)
             return texts
             
         except (Timeout, RequestException) as e:
             self.logger.error(f"Error for {url}: {str(e)}")
             raise
 
+    @staticmethod
+    def next_file_number(output_dir: str) -> int:
+        """出力先にある data{N}.json の最大の番号+1を返す（中断した出力先で再開したときに前回のファイルを上書きしないため）"""
+        numbers = [-1]
+        if os.path.isdir(output_dir):
+            for name in os.listdir(output_dir):
+                match = DATA_FILE_PATTERN.fullmatch(name)
+                if match:
+                    numbers.append(int(match.group(1)))
+        return max(numbers) + 1
+
+    def record_revalidation(self, url: str):
+        """保存を終えたページのレスポンスを再検証用キャッシュに記録する"""
+        with self.lock:
+            pending = self.pending_revalidation.pop(url, None)
+        if pending is not None:
+            self.revalidation_cache.record(url, *pending)
+
+    def discard_revalidation(self, url: str):
+        """保存できなかったページのレスポンスを記録せずに捨てる（次回も変更ありとして取得・保存する）"""
+        with self.lock:
+            self.pending_revalidation.pop(url, None)
+
     def save_text(self, url: str, texts: List[str]):
         with self.lock:
             filename = f"data{self.file_counter}.json"
@@ -80,17 +193,97 @@ class WebTextCrawlerWithCookies:
     def process_url(self, url: str) -> Dict:
         try:
             texts = self.extract_text(url)
+            if texts is None:
+                if self.incremental_store:
+                    self.incremental_store.touch(url)
+                return {'url': url, 'success': True, 'unchanged': True}
             if texts:
+                if self.incremental_store:
+                    status, text_hash = self.incremental_store.check(url, texts)
+                    if status == 'unchanged':
+                        self.record_revalidation(url)
+                        return {'url': url, 'success': True, 'unchanged': True}
                 self.save_text(url, texts)
+                if self.incremental_store:
+                    self.incremental_store.record(url, text_hash)
+                self.record_revalidation(url)
                 return {'url': url, 'success': True}
+            # テキストのないページは保存するものがないため、そのまま記録する
+            self.record_revalidation(url)
+        except ContentSkipped as e:
+            if self.metrics is not None:
+                self.metrics.inc('crawl_skipped_total', reason=e.reason)
+            return {'url': url, 'success': True, 'skipped': e.reason}
         except (Timeout, RequestException) as e:
-            return {'url': url, 'success': False, 'error': str(e)}
+            status = e.response.status_code if getattr(e, 'response', None) is not None else None
+            if self.metrics is not None:
+                error_type = 'timeout' if isinstance(e, Timeout) else f'http_{status}' if status else 'request_error'
+                self.metrics.inc('crawl_errors_total', type=error_type)
+            return {'url': url, 'success': False, 'error': str(e), 'status': status}
+        finally:
+            self.discard_revalidation(url)
 
-    def crawl(self):
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            futures = {executor.submit(self.process_url, url): url for url in self.urls}
-            for future in tqdm(as_completed(futures), total=len(futures), desc="Crawling"):
-                result = future.result()
-                if not result['success']:
+    def worker(self, host_queue: HostQueue, pbar: tqdm):
+        """送信可能になったホストのURLから順に取り出して処理する"""
+        while True:
+            url = host_queue.get()
+            if url is None:
+                return
+            result = None
+            start = time.perf_counter()
+            try:
+                result = self.process_url(url)
+            finally:
+                failed = result is not None and not result['success']
+                # ステータスコードのない失敗はタイムアウト・接続エラー
+                host_queue.done(url, time.perf_counter() - start, result.get('status') if failed else None,
+                                error=failed and result.get('status') is None)
+            if result and not result['success']:
+                with self.lock:
                     self.error_stats[result['error']] += 1
-        self.logger.info(f"Crawling completed with error stats: {dict(self.error_stats)}")
\ No newline at end of file
+            if self.concurrency is not None:
+                pbar.set_postfix_str(f"concurrency {self.concurrency.format()}", refresh=False)
+            if self.metrics is not None:
+                self.metrics.set('crawl_queue_depth', len(host_queue), crawler=os.path.basename(self.output_dir))
+            pbar.update(1)
+
+    def crawl(self):
+        # DNSキャッシュが有効な場合は、取得するURLのホストを先に解決しておく
+        dns_cache = get_dns_cache()
+        if dns_cache is not None and not self.replay:
+            dns_cache.prefetch({urlsplit(url).hostname for url in self.urls})
+        host_queue = HostQueue(self.scheduler, self.urls, self.concurrency)
+        with tqdm(total=len(self.urls), desc="Crawling") as pbar:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(self.worker, host_queue, pbar) for _ in range(self.max_workers)]
+                for future in as_completed(futures):
+                    future.result()
+        self.logger.info(f"Crawling completed with error stats: {dict(self.error_stats)}")
+        if self.concurrency is not None:
+            self.logger.info(f"Concurrency per host: {self.concurrency.format(max_hosts=10)}")
+        guard_stats = self.fetch_guard.summary()
+        self.logger.info(
+            f"Skipped non-HTML/oversized: content-type={guard_stats.get('skipped_content_type', 0)}, "
+            f"too large={guard_stats.get('skipped_too_large', 0)}, "
+            f"bytes not downloaded={guard_stats.get('skipped_bytes', 0):,}"
+        )
+        if self.revalidation_cache:
+            summary = self.revalidation_cache.summary()
+            self.logger.info(
+                f"Revalidation: 304={int(summary.get('not_modified', 0))}, "
+                f"unchanged={int(summary.get('unchanged_hash', 0))}, "
+                f"bytes saved={int(summary.get('bytes_saved', 0)):,}, "
+                f"parse time saved={summary.get('parse_seconds_saved', 0.0):.1f}s"
+            )
+        if self.incremental_store:
+            summary = self.incremental_store.summary()
+            self.logger.info(
+                f"Incremental: new={summary.get('new', 0)}, changed={summary.get('changed', 0)}, "
+                f"unchanged={summary.get('unchanged', 0)}"
+            )
+        if self.archive is not None:
+            summary = self.archive.summary()
+            if self.replay:
+                self.logger.info(f"Replay: served={summary['hits']}, not in archive={summary['misses']}")
+            else:
+                self.logger.info(f"Archive: recorded={summary['recorded']} ({self.archive.path})")
\ No newline at end of file
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from web_get_url_text.search_url.url_canonical import URLCanonicalizer
+
+# IN句に渡すURLの数の上限（SQLiteの変数の上限より小さくする）
+LOOKUP_CHUNK = 500
+
+
+class IncrementalStore:
+    """
+    差分クロール用の文書ハッシュストア
+
+    正規化したURLごとに、抽出したテキストのリストのハッシュ・最後に取得した時刻・
+    最後に内容が変わった時刻を保存する。次回のクロールでは前回と同じテキストのページを
+    保存せず、新規・変更のあったページだけを差分の出力に書き出せる。
+    複数のクローラー・スレッドから共有して使う。
+    """
+
+    def __init__(self, path: str, canonicalizer: Optional[URLCanonicalizer] = None):
+        self.canonicalizer = canonicalizer or URLCanonicalizer()
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS documents (
+                key TEXT PRIMARY KEY,
+                text_hash TEXT NOT NULL,
+                crawled_at REAL NOT NULL,
+                changed_at REAL NOT NULL
+            )
+        ''')
+        self.conn.commit()
+        self.stats = defaultdict(int)
+
+    @staticmethod
+    def hash_texts(texts: List[str]) -> str:
+        return hashlib.sha256(json.dumps(texts, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def crawled_times(self, urls: Iterable[str]) -> Dict[str, float]:
+        """URLの正規化キーごとの最後に取得した時刻を返す（未取得のURLは含まない）"""
+        keys = list({self.canonicalizer.key(url) for url in urls})
+        result = {}
+        with self.lock:
+            for i in range(0, len(keys), LOOKUP_CHUNK):
+                chunk = keys[i:i + LOOKUP_CHUNK]
+                rows = self.conn.execute(
+                    f"SELECT key, crawled_at FROM documents WHERE key IN ({','.join('?' * len(chunk))})", chunk
+                )
+                result.update(rows)
+        return result
+
+    def order_by_age(self, urls: List[str]) -> List[str]:
+        """未取得のURLを先頭に、続けて最後に取得した時刻の古い順に並べ替える（同じ時刻の間は元の順序）"""
+        crawled_at = self.crawled_times(urls)
+        return sorted(urls, key=lambda url: crawled_at.get(self.canonicalizer.key(url), float('-inf')))
+
+    def check(self, url: str, texts: List[str]) -> Tuple[str, str]:
+        """
+        前回保存したテキストと比べ、('new' / 'changed' / 'unchanged', テキストのハッシュ)を返す
+
+        変更のないページは取得時刻だけを更新する。新規・変更のページは保存を終えてからrecord()を呼ぶ。
+        """
+        text_hash = self.hash_texts(texts)
+        key = self.canonicalizer.key(url)
+        with self.lock:
+            row = self.conn.execute('SELECT text_hash FROM documents WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            status = 'new'
+        elif row[0] == text_hash:
+            status = 'unchanged'
+            self.touch(url)
+        else:
+            status = 'changed'
+        with self.lock:
+            self.stats[status] += 1
+        return status, text_hash
+
+    def record(self, url: str, text_hash: str):
+        """新規・変更のあったページのハッシュと時刻を保存する"""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO documents (key, text_hash, crawled_at, changed_at) VALUES (?, ?, ?, ?)',
+                (self.canonicalizer.key(url), text_hash, now, now)
+            )
+
+    def touch(self, url: str):
+        """内容の変わらなかったページの取得時刻だけを更新する"""
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE documents SET crawled_at = ? WHERE key = ?',
+                              (time.time(), self.canonicalizer.key(url)))
+
+    def summary(self) -> Dict[str, int]:
+        """新規・変更・変更なしのページ数を返す"""
+        with self.lock:
+            return dict(self.stats)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
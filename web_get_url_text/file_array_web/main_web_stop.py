@@ -1,4 +1,11 @@
 from array_web_json import WebTextCrawlerWithCookies
+from web_get_url_text.file_array_web.revalidation_cache import RevalidationCache
+from web_get_url_text.file_array_web.incremental_store import IncrementalStore
+from web_get_url_text.search_url.fetch_guard import FetchGuard
+from web_get_url_text.search_url.adaptive_concurrency import AdaptiveConcurrency
+from web_get_url_text.search_url.crawl_metrics import CrawlMetrics
+from web_get_url_text.search_url.replay_transport import ResponseArchive
+from web_get_url_text.search_url.dns_cache import install_dns_cache
 import os
 import json
 import psutil
@@ -22,6 +29,9 @@ logging.basicConfig(
     ]
 )
 
+# 差分の出力を最後まで終えたディレクトリに置く印（ないディレクトリは中断した差分として再開時に使い続ける）
+DELTA_COMPLETE_MARKER = 'delta_complete'
+
 class CrawlerState:
     def __init__(self, input_directory, output_base_dir):
         self.input_directory = input_directory
@@ -69,6 +79,13 @@ class CrawlerState:
         self.completed_files.discard(file_path)
         self.save_state()
 
+def find_unfinished_delta(output_base_dir):
+    """前回中断した差分の出力先（完了の印がない最新のdelta_*ディレクトリ）を返す。なければNone"""
+    delta_dirs = sorted(d for d in glob.glob(os.path.join(output_base_dir, 'delta_*')) if os.path.isdir(d))
+    if delta_dirs and not os.path.exists(os.path.join(delta_dirs[-1], DELTA_COMPLETE_MARKER)):
+        return delta_dirs[-1]
+    return None
+
 def load_json(file_path):
     """JSONファイルを読み込む関数"""
     try:
@@ -78,7 +95,8 @@ def load_json(file_path):
         logging.error(f"JSONファイルの読み込みに失敗: {file_path}, エラー: {str(e)}")
         return []
 
-def process_single_json(json_path, output_base_dir):
+def process_single_json(json_path, output_base_dir, revalidation_cache=None, fetch_guard=None, concurrency=None,
+                        metrics=None, incremental_store=None, oldest_first=False, archive=None, replay=False):
     try:
         base_name = os.path.splitext(os.path.basename(json_path))[0]
         output_dir = os.path.join(output_base_dir, base_name)
@@ -97,6 +115,10 @@ def process_single_json(json_path, output_base_dir):
             logging.warning(f"処理可能なURLが見つかりません: {json_path}")
             return
 
+        if incremental_store is not None and oldest_first:
+            # 未取得のURL、前回の取得から時間のたったURLの順に取得する
+            filtered_urls = incremental_store.order_by_age(filtered_urls)
+
         cookies = [
             {'name': 'OptanonConsent', 
              'value': 'isGpcEnabled=0&datestamp=Fri+Oct+25+2024+22%3A19%3A15+GMT%2B0900+(%E6%97%A5%E6%9C%AC%E6%A8%99%E6%BA%96%E6%99%82)&version=6.23.0&isIABGlobal=false&hosts=&consentId=88957a0d-9fc8-4ddf-b6be-b107a12edb47&interactionCount=1&landingPath=NotLandingPage&groups=C0004%3A1%2CC0003%3A1%2CC0002%3A1%2CC0001%3A1&AwaitingReconsent=false',
@@ -110,10 +132,20 @@ def process_single_json(json_path, output_base_dir):
             output_dir=output_dir,
             timeout=5,
             max_workers=min(psutil.cpu_count(logical=True), 4),
-            max_retries=4
+            max_retries=4,
+            revalidation_cache=revalidation_cache,
+            fetch_guard=fetch_guard,
+            concurrency=concurrency,
+            metrics=metrics,
+            incremental_store=incremental_store,
+            archive=archive,
+            replay=replay
         )
         
         crawler.crawl()
+        if incremental_store is not None and not os.listdir(output_dir):
+            # 新規・変更のページがなかったファイルは差分の出力に残さない
+            os.rmdir(output_dir)
         logging.info(f"処理完了: {json_path}")
         return True
         
@@ -121,7 +153,11 @@ def process_single_json(json_path, output_base_dir):
         logging.error(f"ファイル処理中にエラーが発生: {json_path}, エラー: {str(e)}")
         raise
 
-def process_all_json_files(input_directory: str, output_base_dir: str, num_processes: int = None, resume: bool = True):
+def process_all_json_files(input_directory: str, output_base_dir: str, num_processes: int = None, resume: bool = True,
+                           revalidation_cache: RevalidationCache = None, fetch_guard: FetchGuard = None,
+                           concurrency: AdaptiveConcurrency = None, metrics: CrawlMetrics = None,
+                           incremental_store: IncrementalStore = None, oldest_first: bool = False,
+                           archive: ResponseArchive = None, replay: bool = False):
     if not os.path.exists(input_directory):
         raise FileNotFoundError(f"入力ディレクトリが見つかりません: {input_directory}")
     
@@ -134,6 +170,9 @@ def process_all_json_files(input_directory: str, output_base_dir: str, num_proce
 
     # 状態管理オブジェクトの初期化
     state = CrawlerState(input_directory, output_base_dir)
+    if metrics is not None:
+        metrics.register_callback('crawl_files_completed', lambda: len(state.completed_files), 'gauge', '完了したファイル数')
+        metrics.register_callback('crawl_files_failed', lambda: len(state.failed_files), 'gauge', '失敗したファイル数')
     
     # 処理するファイルの選択
     if resume:
@@ -154,7 +193,8 @@ def process_all_json_files(input_directory: str, output_base_dir: str, num_proce
     
     with ThreadPoolExecutor(max_workers=max_workers) as executor:
         future_to_file = {
-            executor.submit(process_single_json, json_file, output_base_dir): json_file 
+            executor.submit(process_single_json, json_file, output_base_dir, revalidation_cache, fetch_guard,
+                            concurrency, metrics, incremental_store, oldest_first, archive, replay): json_file 
             for json_file in files_to_process
         }
         
@@ -195,20 +235,101 @@ if __name__ == "__main__":
     parser.add_argument('--single', '-s', help='Process single JSON file path')
     parser.add_argument('--processes', '-p', type=int, default=psutil.cpu_count(logical=True), help='Number of processes to use')
     parser.add_argument('--no-resume', action='store_true', help='Do not resume from previous state')
+    parser.add_argument('--revalidation-cache', help='SQLite file for conditional GET; unchanged pages are skipped')
+    parser.add_argument('--max-content-mb', type=float, default=10, help='Abort downloads larger than this size (MB)')
+    parser.add_argument('--max-concurrency', type=int, default=16, help='Upper limit of adaptive concurrent requests per host')
+    parser.add_argument('--fixed-workers', action='store_true', help='Use a fixed number of worker threads instead of adaptive concurrency')
+    parser.add_argument('--metrics-port', type=int, help='Serve live metrics on this local port (/metrics for Prometheus, /metrics.json)')
+    parser.add_argument('--metrics-jsonl', help='Append a metrics snapshot to this JSONL file periodically')
+    parser.add_argument('--metrics-interval', type=float, default=60, help='Interval of the metrics JSONL dump (seconds)')
+    parser.add_argument('--incremental', help='SQLite file of extracted-text hashes; only new or changed pages are written to the delta directory')
+    parser.add_argument('--delta-dir', help='Output directory for new or changed pages with --incremental (default: the unfinished OUTPUT/delta_* directory when resuming, otherwise a new OUTPUT/delta_YYYYmmdd_HHMMSS)')
+    parser.add_argument('--oldest-first', action='store_true', help='With --incremental, fetch never-crawled URLs first, then the least recently crawled')
+    parser.add_argument('--archive', help='SQLite file to record fetched responses (headers and bodies) into')
+    parser.add_argument('--replay', action='store_true', help='Serve responses from --archive instead of the network (no delays, no robots.txt)')
+    parser.add_argument('--dns-cache-ttl', type=float, default=0, help='Seconds to keep resolved host addresses in a process-wide DNS cache (e.g. 300; 0 disables, the default)')
     
     args = parser.parse_args()
+    if args.replay and not args.archive:
+        parser.error('--replay requires --archive')
+    if args.replay and args.revalidation_cache:
+        # 再生時は条件付きGETのヘッダが使われず、すべてのページが変更なしと判定されてしまう
+        parser.error('--replay cannot be combined with --revalidation-cache')
     
     start_time = time.time()
+    revalidation_cache = RevalidationCache(args.revalidation_cache) if args.revalidation_cache else None
+    # 全ファイルのクローラーで共有し、スキップした件数・バイト数をまとめて集計する
+    fetch_guard = FetchGuard(max_bytes=int(args.max_content_mb * 1024 * 1024))
+    # ホストごとの同時リクエスト数も全ファイルで共有し、同じサイトへの負荷をまとめて調整する
+    concurrency = None if args.fixed_workers else AdaptiveConcurrency(max_concurrency=args.max_concurrency)
+    # 差分モードでは新規・変更のページだけを差分用のディレクトリに出力する（進捗ファイルもそこに保存される）
+    incremental_store = None
+    output_dir = args.output
+    if args.incremental:
+        incremental_store = IncrementalStore(args.incremental)
+        # 中断した差分があれば同じディレクトリで再開する。新しいディレクトリにすると、前回保存したページが
+        # 変更なしと判定されて差分が2つのディレクトリに分かれてしまう
+        output_dir = args.delta_dir
+        if output_dir is None and not args.no_resume and not args.single:
+            output_dir = find_unfinished_delta(args.output)
+            if output_dir is not None:
+                logging.info(f"中断した差分の出力先で再開します: {output_dir}")
+        if output_dir is None:
+            output_dir = os.path.join(args.output, f"delta_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+        logging.info(f"差分モード: 新規・変更のページを {output_dir} に出力します")
+    # 全ファイルのクローラーで共有し、レスポンスを1つのファイルに記録・再生する
+    archive = ResponseArchive(args.archive) if args.archive else None
+    if args.replay:
+        logging.info(f"再生モード: {args.archive} に記録したレスポンスからテキストを抽出します")
+    # 全クローラーのHTTPクライアントが名前解決の結果を共有する（再生時は接続しないため使わない）
+    dns_cache = install_dns_cache(ttl=args.dns_cache_ttl) if args.dns_cache_ttl > 0 and not args.replay else None
+    metrics = None
+    if args.metrics_port is not None or args.metrics_jsonl:
+        metrics = CrawlMetrics()
+        if args.metrics_port is not None:
+            port = metrics.serve(args.metrics_port)
+            logging.info(f"メトリクスを公開しています: http://127.0.0.1:{port}/metrics")
+        if args.metrics_jsonl:
+            metrics.start_dump(args.metrics_jsonl, args.metrics_interval)
+        if dns_cache is not None:
+            metrics.register_callback('crawl_dns_lookups_total', lambda: dns_cache.stats['lookups'], 'counter',
+                                      'DNSキャッシュへの名前解決の要求数')
+            metrics.register_callback('crawl_dns_cache_hits_total', lambda: dns_cache.stats['hits'], 'counter',
+                                      'DNSキャッシュに命中した名前解決の要求数')
+            metrics.describe('crawl_dns_seconds', '新しい接続の名前解決にかかった時間（秒）')
     
     try:
         if args.single:
-            process_single_json(args.single, args.output)
+            process_single_json(args.single, output_dir, revalidation_cache, fetch_guard, concurrency, metrics,
+                                incremental_store, args.oldest_first, archive, args.replay)
         else:
-            process_all_json_files(args.input, args.output, args.processes, not args.no_resume)
+            process_all_json_files(args.input, output_dir, args.processes, not args.no_resume, revalidation_cache,
+                                   fetch_guard, concurrency, metrics, incremental_store, args.oldest_first,
+                                   archive, args.replay)
             
+        guard_stats = fetch_guard.summary()
+        logging.info(f"HTML以外・サイズ超過でスキップ: {guard_stats.get('skipped_content_type', 0) + guard_stats.get('skipped_too_large', 0)}件 "
+                     f"(取得を省略した本文: {guard_stats.get('skipped_bytes', 0) / (1024 * 1024):,.1f}MB)")
+        if incremental_store is not None:
+            os.makedirs(output_dir, exist_ok=True)
+            open(os.path.join(output_dir, DELTA_COMPLETE_MARKER), 'w').close()
+            delta_stats = incremental_store.summary()
+            logging.info(f"差分: 新規 {delta_stats.get('new', 0)}件, 変更 {delta_stats.get('changed', 0)}件, "
+                         f"変更なし {delta_stats.get('unchanged', 0)}件 (出力先: {output_dir})")
+        if dns_cache is not None:
+            logging.info(f"名前解決: {dns_cache.format()}")
         elapsed_time = time.time() - start_time
         logging.info(f"\n総処理時間: {elapsed_time:.2f} 秒")
         
     except Exception as e:
         logging.error(f"Fatal error: {str(e)}")
-        sys.exit(1)
\ No newline at end of file
+        sys.exit(1)
+    finally:
+        if metrics is not None:
+            metrics.close()
+        if incremental_store is not None:
+            incremental_store.close()
+        if revalidation_cache is not None:
+            revalidation_cache.close()
+        if archive is not None:
+            archive.close()
\ No newline at end of file
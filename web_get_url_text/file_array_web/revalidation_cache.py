@@ -0,0 +1,129 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+from web_get_url_text.search_url.url_canonical import URLCanonicalizer
+
+
+class RevalidationCache:
+    """
+    再クロール用のレスポンスメタデータキャッシュ
+
+    正規化したURLごとにETag・Last-Modified・本文のハッシュを保存しておき、
+    次回のクロールでIf-None-Match / If-Modified-Since付きのリクエストを送る。
+    304または本文のハッシュが前回と同じ場合は、解析と保存を省略できる。
+    複数のクローラー・スレッドから共有して使う。
+    """
+
+    def __init__(self, path: str, canonicalizer: Optional[URLCanonicalizer] = None):
+        self.canonicalizer = canonicalizer or URLCanonicalizer()
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT NOT NULL,
+                content_length INTEGER NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+        ''')
+        self.conn.commit()
+        self.stats = defaultdict(float)
+
+    def lookup(self, url: str):
+        with self.lock:
+            return self.conn.execute(
+                'SELECT etag, last_modified, content_hash, content_length FROM responses WHERE key = ?',
+                (self.canonicalizer.key(url),)
+            ).fetchone()
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """前回のレスポンスに基づく条件付きリクエスト用ヘッダを返す"""
+        row = self.lookup(url)
+        if row is None:
+            return {}
+        etag, last_modified, _, _ = row
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        return headers
+
+    def is_unchanged(self, url: str, response) -> bool:
+        """
+        前回から内容が変わっていないかを判定する
+
+        304の場合と、200でも本文のハッシュが前回と同じ場合にTrueを返す。
+        """
+        row = self.lookup(url)
+        if row is None:
+            with self.lock:
+                self.stats['new'] += 1
+            return False
+        _, _, content_hash, content_length = row
+
+        if response.status_code == 304:
+            with self.lock:
+                self.stats['not_modified'] += 1
+                self.stats['bytes_saved'] += content_length
+                self.stats['parse_skipped'] += 1
+            self.touch(url, response)
+            return True
+
+        if response.status_code == 200 and self.hash_content(response.content) == content_hash:
+            with self.lock:
+                self.stats['unchanged_hash'] += 1
+                self.stats['parse_skipped'] += 1
+            self.touch(url, response)
+            return True
+
+        with self.lock:
+            self.stats['changed'] += 1
+        return False
+
+    @staticmethod
+    def hash_content(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    def touch(self, url: str, response):
+        """304/変更なしの場合、検証用ヘッダと取得時刻だけを更新する"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                'UPDATE responses SET etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified), '
+                'fetched_at = ? WHERE key = ?',
+                (response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                 time.time(), self.canonicalizer.key(url))
+            )
+
+    def record(self, url: str, response, parse_seconds: float = 0.0):
+        """解析まで終えたレスポンスのメタデータを保存する"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses '
+                '(key, etag, last_modified, content_hash, content_length, fetched_at) VALUES (?, ?, ?, ?, ?, ?)',
+                (self.canonicalizer.key(url), response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                 self.hash_content(response.content), len(response.content), time.time())
+            )
+            self.stats['parsed'] += 1
+            self.stats['parse_seconds'] += parse_seconds
+
+    def summary(self) -> Dict[str, float]:
+        """節約できた通信量と解析時間の集計を返す"""
+        with self.lock:
+            stats = dict(self.stats)
+        parsed = stats.get('parsed', 0)
+        average_parse = stats.get('parse_seconds', 0.0) / parsed if parsed else 0.0
+        stats['parse_seconds_saved'] = average_parse * stats.get('parse_skipped', 0)
+        return stats
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,162 @@
+import logging
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class HostLimit:
+    """1ホスト分の同時リクエスト数の上限と、応答時間の推定値"""
+
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.in_flight = 0
+        # 応答時間の指数移動平均と、混雑していないときの基準値（秒）
+        self.latency: Optional[float] = None
+        self.baseline: Optional[float] = None
+        self.last_decrease = 0.0
+
+
+class AdaptiveConcurrency:
+    """
+    ホストごとの同時リクエスト数をAIMD（加算増加・乗算減少）で調整するコントローラ
+
+    - 成功したリクエストの応答時間が基準値のlatency_tolerance倍以内なら、上限を
+      1ウィンドウ（上限と同じ数のリクエスト）あたりincreaseずつ増やす
+    - 応答が遅くなっている間は上限を据え置く
+    - タイムアウト・接続エラー・429・5xxを受けたら上限をdecrease_factor倍に下げる
+      （同時に失敗したリクエストで何度も下げないよう、平均応答時間（1往復）に1回まで）
+    複数のスレッド・クローラーから共有して使う。
+    """
+
+    def __init__(self,
+                 initial: int = 2,
+                 min_concurrency: int = 1,
+                 max_concurrency: int = 16,
+                 increase: float = 1.0,
+                 decrease_factor: float = 0.5,
+                 latency_tolerance: float = 2.0,
+                 ewma_alpha: float = 0.2,
+                 cooldown: Optional[float] = None):
+        """
+        Args:
+            initial: ホストごとの同時リクエスト数の初期値
+            min_concurrency: 同時リクエスト数の下限
+            max_concurrency: 同時リクエスト数の上限
+            increase: 1ウィンドウあたりの増加量
+            decrease_factor: 失敗時に上限に掛ける係数
+            latency_tolerance: 基準値の何倍までの応答時間を正常とみなすか
+            ewma_alpha: 応答時間の指数移動平均の係数
+            cooldown: 上限を続けて下げない時間（秒）。Noneの場合はそのホストの平均応答時間
+        """
+        self.initial = initial
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.ewma_alpha = ewma_alpha
+        self.cooldown = cooldown
+        self.hosts: Dict[str, HostLimit] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        return urlsplit(url).netloc.lower()
+
+    @staticmethod
+    def is_failure(status: Optional[int] = None, error: bool = False) -> bool:
+        """サーバーの過負荷を示す結果かどうか（タイムアウト・接続エラー・429・5xx）"""
+        return error or status == 429 or (status is not None and status >= 500)
+
+    def get_host(self, url: str) -> HostLimit:
+        host = self.host_of(url)
+        state = self.hosts.get(host)
+        if state is None:
+            initial = min(max(self.initial, self.min_concurrency), self.max_concurrency)
+            state = self.hosts[host] = HostLimit(float(initial))
+        return state
+
+    def has_capacity(self, url: str) -> bool:
+        """URLのホストに新しいリクエストを送れるかどうか"""
+        with self.lock:
+            state = self.get_host(url)
+            return state.in_flight < int(state.limit)
+
+    def try_acquire(self, url: str) -> bool:
+        """ホストの枠が空いていれば1つ確保してTrueを返す"""
+        with self.lock:
+            state = self.get_host(url)
+            if state.in_flight >= int(state.limit):
+                return False
+            state.in_flight += 1
+            return True
+
+    def release(self, url: str, latency: Optional[float] = None, status: Optional[int] = None, error: bool = False):
+        """
+        リクエストの完了を通知し、結果に応じてホストの上限を調整する
+
+        Args:
+            url: リクエストしたURL
+            latency: 応答時間（秒）
+            status: HTTPステータスコード（不明な場合はNone）
+            error: タイムアウト・接続エラーなどで応答を受け取れなかった場合はTrue
+        """
+        now = time.monotonic()
+        with self.lock:
+            state = self.get_host(url)
+            state.in_flight = max(0, state.in_flight - 1)
+            before = int(state.limit)
+
+            if self.is_failure(status, error):
+                cooldown = self.cooldown if self.cooldown is not None else (state.latency or 0.0)
+                if now - state.last_decrease >= cooldown:
+                    state.limit = max(float(self.min_concurrency), state.limit * self.decrease_factor)
+                    state.last_decrease = now
+                reason = f"status {status}" if status is not None else 'error'
+            else:
+                reason = 'healthy'
+                if latency is not None:
+                    state.latency = latency if state.latency is None else \
+                        state.latency + self.ewma_alpha * (latency - state.latency)
+                    # 基準値は最小の平均応答時間を基本に、サイト側の変化に合わせてゆっくり追従させる
+                    if state.baseline is None or state.latency < state.baseline:
+                        state.baseline = state.latency
+                    else:
+                        state.baseline += (state.latency - state.baseline) * 0.01
+                healthy = state.latency is None or state.latency <= state.baseline * self.latency_tolerance
+                if healthy:
+                    state.limit = min(float(self.max_concurrency), state.limit + self.increase / state.limit)
+
+            after = int(state.limit)
+        if after != before:
+            logger.info(f"Concurrency for {self.host_of(url)}: {before} -> {after} ({reason})")
+
+    def limit(self, url: str) -> int:
+        with self.lock:
+            return int(self.get_host(url).limit)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """ホストごとの処理中リクエスト数・上限・平均応答時間（ミリ秒）を返す"""
+        with self.lock:
+            return {
+                host: {
+                    'in_flight': state.in_flight,
+                    'limit': int(state.limit),
+                    'latency_ms': (state.latency or 0.0) * 1000,
+                }
+                for host, state in self.hosts.items()
+            }
+
+    def format(self, max_hosts: int = 3) -> str:
+        """進捗表示用の1行の表記を返す（処理中のリクエストが多いホストから順に）"""
+        summary = self.summary()
+        if not summary:
+            return '-'
+        hosts = sorted(summary.items(), key=lambda item: (-item[1]['in_flight'], item[0]))
+        text = ', '.join(f"{host} {values['in_flight']}/{values['limit']}" for host, values in hosts[:max_hosts])
+        if len(hosts) > max_hosts:
+            text += f" (+{len(hosts) - max_hosts} hosts)"
+        return text
@@ -0,0 +1,211 @@
+import asyncio
+import socket
+import time
+from urllib.parse import urlparse
+
+import aiohttp
+
+from search_all_url_cheack import URLScraper
+from url_frontier import MultiDomainFrontier
+from fetch_guard import ContentSkipped
+from http_pool import ConnectionMetrics
+from replay_transport import ReplayClientSession, RecordingClientSession
+
+
+class AsyncURLScraper(URLScraper):
+    def __init__(self, *args, concurrency=20, adaptive_concurrency=None, **kwargs):
+        """
+        asyncioで複数リクエストを同時に処理するURLスクレイパー
+
+        Args:
+            concurrency: 同時に処理するリクエスト数
+            adaptive_concurrency: AdaptiveConcurrencyを渡すと、同時リクエスト数をconcurrencyを上限に
+                応答時間とエラー（タイムアウト・429・5xx）に応じて増減させる
+            その他の引数はURLScraperと同じ
+        """
+        super().__init__(*args, **kwargs)
+        self.concurrency = concurrency
+        self.adaptive_concurrency = adaptive_concurrency
+        # ページの取得はaiohttpの接続プールで行うため、そちらの接続を集計する（再生時は接続しない）
+        self.connection_metrics = None if self.replay else ConnectionMetrics()
+        if self.dns_cache is not None:
+            # aiohttpはAI_ADDRCONFIGを付けて解決するため、同じフラグで開始URLのホストを先に解決しておく
+            self.dns_cache.prefetch((urlparse(url).hostname for url in self.seed_urls), flags=socket.AI_ADDRCONFIG)
+
+    def trace_config(self):
+        """aiohttpの新規接続・リクエストをconnection_metricsに記録する設定を作る（名前解決の時間は接続時間と分ける）"""
+        metrics = self.connection_metrics
+
+        async def on_request_start(session, context, params):
+            metrics.record_request()
+
+        async def on_connection_create_start(session, context, params):
+            context.connect_start = time.perf_counter()
+
+        async def on_dns_resolvehost_start(session, context, params):
+            context.dns_start = time.perf_counter()
+
+        async def on_dns_resolvehost_end(session, context, params):
+            context.dns_seconds = time.perf_counter() - context.dns_start
+
+        async def on_connection_create_end(session, context, params):
+            dns_seconds = getattr(context, 'dns_seconds', None)
+            metrics.record_connection(time.perf_counter() - context.connect_start - (dns_seconds or 0.0), dns_seconds)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_start.append(on_connection_create_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_dns_resolvehost_start.append(on_dns_resolvehost_start)
+        trace_config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+        return trace_config
+
+    async def fetch(self, session, url):
+        """1ページを取得してステータスコードと本文を返す"""
+        if self.replay:
+            # 再生時はrobots.txtを取得しないため、別スレッドを使わず投入順に処理する
+            wait = self.scheduler.reserve(url)
+        else:
+            # 初回はrobots.txtの取得が発生するため、イベントループを止めないよう別スレッドで予約する
+            wait = await asyncio.get_running_loop().run_in_executor(None, self.scheduler.reserve, url)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        guard = self.fetch_guard
+        if guard.head_check and guard.is_suspicious(url):
+            async with session.head(url, allow_redirects=True) as head:
+                if head.status < 400:
+                    reason = guard.skip_reason(head.headers.get('Content-Type'), head.headers.get('Content-Length'))
+                    if reason:
+                        raise guard.skipped(url, reason, head.headers.get('Content-Type'),
+                                            head.headers.get('Content-Length'), head=True)
+
+        start = time.perf_counter()
+        async with session.get(url) as response:
+            self.scheduler.observe(url, response.status, response.headers)
+            content_type = response.headers.get('Content-Type')
+            content_length = response.headers.get('Content-Length')
+            if response.status == 200:
+                reason = guard.skip_reason(content_type, content_length)
+                if reason:
+                    response.close()
+                    raise guard.skipped(url, reason, content_type, content_length)
+
+            # 本文は少しずつ読み、上限を超えたらその時点で打ち切る
+            body = bytearray()
+            async for chunk in response.content.iter_chunked(guard.chunk_size):
+                body.extend(chunk)
+                if guard.max_bytes is not None and len(body) > guard.max_bytes:
+                    response.close()
+                    raise guard.skipped(url, 'too_large', content_type, content_length, read_bytes=len(body))
+            guard.record_fetched(len(body))
+            if self.metrics is not None:
+                self.record_fetch(url, time.perf_counter() - start, response.status, len(body))
+            return response.status, body.decode(response.charset or 'utf-8', errors='replace')
+
+    def has_capacity(self):
+        """次に取り出すURLのホストに同時リクエストの空きがあるかどうか"""
+        if self.adaptive_concurrency is None:
+            return True
+        if isinstance(self.urls_to_visit, MultiDomainFrontier):
+            return self.urls_to_visit.has_capacity()
+        return self.adaptive_concurrency.has_capacity(self.urls_to_visit.peek())
+
+    async def collect_urls_async(self):
+        """同時実行数を保ちながら幅優先でURLを収集する"""
+        pending = {}
+
+        self.stats['start_time'] = time.time()
+        self.stats['last_progress_time'] = time.time()
+        self.stats['last_url_increase_time'] = time.time()
+
+        self.init_state()
+        self.print_start_banner()
+        print(f"同時リクエスト数: {self.concurrency}")
+
+        if self.replay:
+            client = ReplayClientSession(self.archive)
+        else:
+            timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+            # DNSキャッシュが有効な場合はaiohttp自身のキャッシュを使わず、プロセス全体のキャッシュに任せる
+            connector = aiohttp.TCPConnector(limit=self.concurrency, use_dns_cache=self.dns_cache is None)
+            # robots.txt・sitemapの取得（requestsのセッション）と同じUser-Agentを送る
+            client = aiohttp.ClientSession(timeout=timeout, connector=connector,
+                                           headers={'User-Agent': self.session.headers['User-Agent']},
+                                           trace_configs=[self.trace_config()])
+            if self.archive is not None:
+                client = RecordingClientSession(client, self.archive)
+        async with client as session:
+            while self.urls_to_visit or pending:
+                if self.max_pages and self.stats['processed_pages'] + len(pending) >= self.max_pages:
+                    if not pending:
+                        print("\n最大ページ数に到達しました。収集を終了します。")
+                        break
+                elif self.check_stall_condition():
+                    break
+                else:
+                    # 空きスロットにキューの先頭から順に投入する（幅優先・スコア順を維持）
+                    while self.urls_to_visit and len(pending) < self.concurrency:
+                        if self.max_pages and self.stats['processed_pages'] + len(pending) >= self.max_pages:
+                            break
+                        if not self.has_capacity():
+                            break
+                        current_url = self.pop_next_url()
+                        if current_url is None:
+                            continue
+                        # 処理中のURLを再度投入しないよう、取得前に訪問済みにしておく
+                        self.visited_urls.add(self.canonicalizer.key(current_url))
+                        if self.adaptive_concurrency is not None:
+                            self.adaptive_concurrency.try_acquire(current_url)
+                        task = asyncio.ensure_future(self.fetch(session, current_url))
+                        pending[task] = (current_url, self.current_depth, time.perf_counter())
+
+                if not pending:
+                    continue
+
+                done, _ = await asyncio.wait(
+                    pending.keys(), timeout=self.progress_interval,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+
+                # 完了したタスクは投入順に処理し、発見順をできるだけ逐次版に揃える
+                for task in [t for t in pending if t in done]:
+                    current_url, depth, started = pending.pop(task)
+                    status = None
+                    failed = False
+                    try:
+                        status, text = task.result()
+                        self.mark_visited(current_url)
+                        self.stats['processed_pages'] += 1
+                        if status >= 400:
+                            self.stats['http_error_count'] += 1
+                        if status == 200:
+                            self.handle_page(current_url, text, depth)
+                    except ContentSkipped as e:
+                        self.mark_skipped(current_url)
+                        if self.metrics is not None:
+                            self.metrics.inc('crawl_skipped_total', reason=e.reason)
+                    except Exception as e:
+                        failed = True
+                        self.stats['error_count'] += 1
+                        if self.metrics is not None:
+                            self.metrics.inc('crawl_errors_total', type=type(e).__name__)
+                        print(f"\nError processing {current_url}: {e}")
+                    finally:
+                        self.checkpoint()
+                        if self.adaptive_concurrency is not None:
+                            self.adaptive_concurrency.release(current_url, time.perf_counter() - started,
+                                                              status, error=failed)
+
+                self.print_progress()
+
+                if not pending and not self.urls_to_visit:
+                    print("\n訪問待ちのURLがなくなったため、収集を終了します。")
+                    break
+
+            for task in pending:
+                task.cancel()
+
+        self.finish_collection()
+
+    def collect_urls(self):
+        asyncio.run(self.collect_urls_async())
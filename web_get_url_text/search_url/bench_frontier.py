@@ -0,0 +1,58 @@
+import argparse
+import time
+
+from url_frontier import URLFrontier
+
+
+def make_url(i):
+    """ベンチマーク用のダミーURLを生成"""
+    return f"https://www.dlsite.com/maniax/work/=/product_id/RJ{i:08d}.html?i3_ref=list&i3_ord={i % 97}"
+
+
+def bench_list(size, sample):
+    """従来のlist実装: 重複チェック(in)とappend、pop(0)の1件あたりコスト（マイクロ秒）"""
+    queue = [make_url(i) for i in range(size)]
+    new_urls = [make_url(size + i) for i in range(sample)]
+
+    start = time.perf_counter()
+    for url in new_urls:
+        if url not in queue:
+            queue.append(url)
+    for _ in range(sample):
+        queue.pop(0)
+    return (time.perf_counter() - start) / sample * 1e6
+
+
+def bench_frontier(size, sample):
+    """URLFrontier: 重複チェック(in)とpush、popの1件あたりコスト（マイクロ秒）"""
+    queue = URLFrontier(make_url(i) for i in range(size))
+    new_urls = [make_url(size + i) for i in range(sample)]
+
+    start = time.perf_counter()
+    for url in new_urls:
+        if url not in queue:
+            queue.push(url)
+    for _ in range(sample):
+        queue.pop()
+    return (time.perf_counter() - start) / sample * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='URLキューの1リンクあたり処理コストの計測')
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000,3000000',
+                        help='キューに事前投入するURL数（カンマ区切り）')
+    parser.add_argument('--sample', type=int, default=1000, help='計測するリンク数')
+    parser.add_argument('--list-limit', type=int, default=100000,
+                        help='list実装を計測する最大サイズ（これ以上は時間がかかりすぎるため省略）')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    print(f"{'キュー長':>12} {'list (µs/link)':>16} {'URLFrontier (µs/link)':>22}")
+    for size in sizes:
+        list_cost = f"{bench_list(size, args.sample):.2f}" if size <= args.list_limit else '-'
+        frontier_cost = bench_frontier(size, args.sample)
+        print(f"{size:>12,} {list_cost:>16} {frontier_cost:>22.2f}")
+
+
+if __name__ == "__main__":
+    main()
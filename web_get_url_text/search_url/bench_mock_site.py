@@ -0,0 +1,318 @@
+import argparse
+import hashlib
+import http.server
+import json
+import multiprocessing
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import psutil
+
+# 計測できるスクレイパーの種類（search_url・search_all_urlは接続を使い回さない旧版）
+VARIANTS = ('sync', 'async', 'priority', 'partitioned', 'search_url', 'search_all_url')
+LATENCY_DISTRIBUTIONS = ('fixed', 'uniform', 'exponential', 'lognormal')
+
+
+class MockSite:
+    """
+    ベンチマーク用の合成サイト
+
+    /work/=/product_id/RJ{i}.html（i < size）の詳細ページと、それを並べた/list/{k}/の一覧ページからなる。
+    各ページの内容はパスから決まるため、何度取得しても同じリンクが返る。
+    error_rateの割合のリクエスト（トップページを除く）には500を返す。
+    trap_rateの割合のページには、無限に続くカレンダーとセッションID付きURL（URLトラップ）へのリンクを含める。
+    """
+
+    def __init__(self, size=2000, fanout=10, latency_ms=0.0, latency_dist='fixed', error_rate=0.0,
+                 trap_rate=0.0, seed=0):
+        self.size = size
+        self.fanout = fanout
+        self.latency_ms = latency_ms
+        self.latency_dist = latency_dist
+        self.error_rate = error_rate
+        self.trap_rate = trap_rate
+        self.seed = seed
+        self.list_pages = max(1, size // 20)
+
+    def rng(self, path):
+        digest = hashlib.blake2b(f"{self.seed}:{path}".encode(), digest_size=8).digest()
+        return random.Random(int.from_bytes(digest, 'big'))
+
+    def latency(self):
+        """1リクエストの応答遅延（秒）を分布に従って返す"""
+        mean = self.latency_ms / 1000
+        if mean <= 0 or self.latency_dist == 'fixed':
+            return max(0.0, mean)
+        if self.latency_dist == 'uniform':
+            return random.uniform(0, 2 * mean)
+        if self.latency_dist == 'exponential':
+            return random.expovariate(1 / mean)
+        # 中央値がmeanの0.8倍程度になる裾の長い分布
+        return random.lognormvariate(0, 0.7) * mean * 0.8
+
+    def work(self, i):
+        return f"/work/=/product_id/RJ{i:08d}.html"
+
+    def links(self, path):
+        """パスに対応するページのリンク一覧を返す（存在しないページはNone）"""
+        r = self.rng(path)
+        if path == '/':
+            return [f"/list/{k}/" for k in range(min(self.fanout, self.list_pages))]
+        if path.startswith('/list/'):
+            k = int(path.split('/')[2] or 0)
+            if k >= self.list_pages:
+                return None
+            links = [self.work((k * 20 + j) % self.size) for j in range(20)]
+            links.append(f"/list/{(k + 1) % self.list_pages}/")
+        elif path.startswith('/work/=/product_id/RJ'):
+            i = int(path[len('/work/=/product_id/RJ'):].split('.')[0])
+            if i >= self.size:
+                return None
+            links = [self.work(r.randrange(self.size)) for _ in range(self.fanout)]
+            links.append(f"/list/{i // 20}/")
+        elif path.startswith('/calendar/'):
+            # 翌月へのリンクが無限に続くトラップ
+            n = int(path.split('/')[2] or 0)
+            return [f"/calendar/{n + 1}/", f"/calendar/{n + 1}/?sid={r.randrange(10**9)}"]
+        else:
+            return None
+        if r.random() < self.trap_rate:
+            links.append(f"/calendar/{r.randrange(1000)}/")
+            links.append(f"{path}?sid={random.randrange(10**9)}")
+        return links
+
+    def render(self, path):
+        links = self.links(path)
+        if links is None:
+            return None
+        anchors = ''.join(f'<li><a href="{href}">link</a></li>' for href in links)
+        return (f'<!DOCTYPE html><html><head><title>{path}</title></head><body>'
+                f'<h1>{path}</h1><p>{"テキスト " * 50}</p><ul>{anchors}</ul></body></html>').encode('utf-8')
+
+
+def make_handler(site, injected_errors=None):
+    class MockSiteHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # 応答を1回の送信にまとめ、Nagleアルゴリズムによる遅延を避ける
+        wbufsize = 1 << 16
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_body(self, status, body=b'', content_type='text/html; charset=utf-8'):
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            time.sleep(site.latency())
+            path = self.path.split('?')[0].split('#')[0]
+            if path == '/robots.txt':
+                self.send_body(404)
+                return
+            # 開始ページが失敗すると収集が始まらないため、トップページには500を返さない
+            if path != '/' and random.random() < site.error_rate:
+                if injected_errors is not None:
+                    with injected_errors.get_lock():
+                        injected_errors.value += 1
+                self.send_body(500)
+                return
+            body = site.render(path)
+            if body is None:
+                self.send_body(404)
+                return
+            self.send_body(200, body)
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.end_headers()
+
+    return MockSiteHandler
+
+
+def serve(site, port, injected_errors=None):
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', port), make_handler(site, injected_errors))
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"モックサイトが起動しませんでした (port {port})")
+
+
+def build_scraper(variant, base_url, args):
+    """計測するスクレイパーを作成する（子プロセス内で呼ばれる）"""
+    kwargs = dict(delay_time=0, batch_size=10000, max_pages=args.max_pages, progress_interval=float('inf'),
+                  stall_time=None, parser_backend=args.parser)
+    if variant == 'search_url':
+        # 旧版はstall_time=Noneに対応しないため、実行中に停滞判定が起きない長さにする
+        from search_url import URLScraper
+        return URLScraper(base_url, variant, **dict(kwargs, stall_time=10**9))
+    if variant == 'search_all_url':
+        from search_all_url import URLScraper
+        return URLScraper(base_url, variant, **kwargs)
+    # 注入した500がリトライで隠れないよう、既定ではリトライしない（asyncはリトライしない）
+    kwargs['max_retries'] = args.max_retries
+    if variant == 'sync':
+        from search_all_url_cheack import URLScraper
+        return URLScraper(base_url, variant, **kwargs)
+    if variant == 'async':
+        from async_url_scraper import AsyncURLScraper
+        return AsyncURLScraper(base_url, variant, concurrency=args.concurrency, **kwargs)
+    if variant == 'priority':
+        from search_all_url_cheack import URLScraper
+        from url_scorer import URLScorer
+        return URLScraper(base_url, variant, scorer=URLScorer(), **kwargs)
+    if variant == 'partitioned':
+        from partitioned_url_scraper import PartitionedURLScraper
+        return PartitionedURLScraper(base_url, variant, num_workers=args.workers, **kwargs)
+    raise ValueError(f"不明なvariantです: {variant} (選択肢: {', '.join(VARIANTS)})")
+
+
+def run_child(variant, base_url, args):
+    """子プロセス側: スクレイパーを1回実行し、結果を最後の行にJSONで出力する"""
+    scraper = build_scraper(variant, base_url, args)
+    start = time.perf_counter()
+    scraper.run()
+    elapsed = time.perf_counter() - start
+    merged = json.loads(Path('data_url', f"{variant}_merged.json").read_text(encoding='utf-8'))
+    print('RESULT ' + json.dumps({'elapsed': elapsed, 'pages': scraper.stats['processed_pages'],
+                                  'urls': len(merged), 'errors': scraper.stats['error_count'],
+                                  'http_errors': scraper.stats['http_error_count']}))
+
+
+def measure(variant, base_url, args, injected_errors):
+    """
+    スクレイパーを別プロセスで実行し、プロセスツリー全体のピークRSSとCPU時間を計測する
+
+    partitionedのワーカープロセスも含めるため、0.05秒ごとに子孫プロセスのRSSを合計し、
+    終了したプロセスは最後に観測したCPU時間を使う。
+    合成サイトが返した500の数（injected_errors）は実行前に0に戻し、このvariantの分だけを数える。
+    """
+    command = [sys.executable, str(Path(__file__).resolve()), '--child', variant, '--base-url', base_url,
+               '--max-pages', str(args.max_pages), '--parser', args.parser,
+               '--concurrency', str(args.concurrency), '--workers', str(args.workers),
+               '--max-retries', str(args.max_retries)]
+    with injected_errors.get_lock():
+        injected_errors.value = 0
+    with tempfile.TemporaryDirectory() as workdir:
+        log_path = Path(workdir) / 'child.log'
+        with open(log_path, 'w', encoding='utf-8') as log:
+            started = time.perf_counter()
+            process = subprocess.Popen(command, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+            root = psutil.Process(process.pid)
+            peak_rss = 0
+            cpu_times = {}
+            while process.poll() is None:
+                try:
+                    tree = [root] + root.children(recursive=True)
+                except psutil.NoSuchProcess:
+                    break
+                rss = 0
+                for proc in tree:
+                    try:
+                        with proc.oneshot():
+                            rss += proc.memory_info().rss
+                            times = proc.cpu_times()
+                            cpu_times[proc.pid] = times.user + times.system
+                    except psutil.NoSuchProcess:
+                        pass
+                peak_rss = max(peak_rss, rss)
+                time.sleep(0.05)
+            wall = time.perf_counter() - started
+        output = log_path.read_text(encoding='utf-8', errors='replace')
+
+    results = [line for line in output.splitlines() if line.startswith('RESULT ')]
+    if process.returncode != 0 or not results:
+        print(output[-2000:])
+        raise RuntimeError(f"{variant}の実行に失敗しました (終了コード {process.returncode})")
+    result = json.loads(results[-1][len('RESULT '):])
+    result['peak_rss_mb'] = peak_rss / (1024 * 1024)
+    result['injected_errors'] = injected_errors.value
+    result['cpu_seconds'] = sum(cpu_times.values())
+    # CPU時間は起動・import分も含むため、使用率はプロセスの実行時間全体に対して求める
+    result['cpu_percent'] = result['cpu_seconds'] / wall * 100 if wall > 0 else 0.0
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='合成サイトに対するURL収集スクレイパーの処理速度・メモリ・CPUの計測')
+    parser.add_argument('--variants', default=','.join(VARIANTS), help=f"計測するスクレイパー（カンマ区切り: {', '.join(VARIANTS)}）")
+    parser.add_argument('--size', type=int, default=2000, help='詳細ページ数')
+    parser.add_argument('--fanout', type=int, default=10, help='詳細ページ1つあたりのリンク数')
+    parser.add_argument('--latency-ms', type=float, default=0, help='平均応答遅延（ミリ秒）')
+    parser.add_argument('--latency-dist', choices=LATENCY_DISTRIBUTIONS, default='fixed', help='応答遅延の分布')
+    parser.add_argument('--error-rate', type=float, default=0, help='500を返すリクエストの割合')
+    parser.add_argument('--trap-rate', type=float, default=0, help='URLトラップへのリンクを含むページの割合')
+    parser.add_argument('--seed', type=int, default=0, help='サイト生成の乱数シード')
+    parser.add_argument('--max-pages', type=int, default=1000, help='1回の実行で取得する最大ページ数')
+    parser.add_argument('--parser', default='auto', help='リンク抽出のHTMLパーサー')
+    parser.add_argument('--concurrency', type=int, default=20, help='asyncの同時リクエスト数')
+    parser.add_argument('--workers', type=int, default=2, help='partitionedのワーカープロセス数')
+    parser.add_argument('--max-retries', type=int, default=0,
+                        help='sync・priority・partitionedのリトライ回数（0以外では注入した500の一部がリトライで隠れる）')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.base_url, args)
+        return
+
+    variants = [name.strip() for name in args.variants.split(',') if name.strip()]
+    for name in variants:
+        if name not in VARIANTS:
+            parser.error(f"不明なvariantです: {name} (選択肢: {', '.join(VARIANTS)})")
+
+    site = MockSite(size=args.size, fanout=args.fanout, latency_ms=args.latency_ms, latency_dist=args.latency_dist,
+                    error_rate=args.error_rate, trap_rate=args.trap_rate, seed=args.seed)
+    port = free_port()
+    injected_errors = multiprocessing.Value('q', 0)
+    server = multiprocessing.Process(target=serve, args=(site, port, injected_errors), daemon=True)
+    server.start()
+    try:
+        wait_for_port(port)
+        base_url = f"http://127.0.0.1:{port}/"
+        print(f"合成サイト: {base_url} (詳細ページ {args.size:,}, リンク数 {args.fanout}, "
+              f"遅延 {args.latency_ms}ms/{args.latency_dist}, エラー率 {args.error_rate}, トラップ率 {args.trap_rate})")
+        print(f"最大ページ数: {args.max_pages:,}, HTMLパーサー: {args.parser}, リトライ回数: {args.max_retries}")
+        # 500注入: 合成サイトが返した500の数、エラー応答: スクレイパーが受け取った4xx/5xxの数、エラー: 例外の数
+        print(f"\n{'variant':<15} {'ページ数':>8} {'URL数':>8} {'500注入':>7} {'エラー応答':>8} {'エラー':>6} {'秒':>7} "
+              f"{'ページ/秒':>10} {'URL/秒':>10} {'ピークRSS(MB)':>14} {'CPU秒':>7} {'CPU使用率':>9}")
+        for variant in variants:
+            result = measure(variant, base_url, args, injected_errors)
+            elapsed = result['elapsed']
+            print(f"{variant:<15} {result['pages']:>8,} {result['urls']:>8,} {result['injected_errors']:>7,} "
+                  f"{result['http_errors']:>8,} {result['errors']:>6,} {elapsed:>7.2f} "
+                  f"{result['pages'] / elapsed:>10,.1f} {result['urls'] / elapsed:>10,.1f} "
+                  f"{result['peak_rss_mb']:>14,.1f} {result['cpu_seconds']:>7.2f} "
+                  f"{result['cpu_percent']:>8.0f}%")
+            sys.stdout.flush()
+    finally:
+        server.terminate()
+        server.join()
+
+
+if __name__ == "__main__":
+    main()
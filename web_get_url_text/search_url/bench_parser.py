@@ -0,0 +1,74 @@
+import argparse
+import random
+import time
+from pathlib import Path
+
+from html_backends import LINK_BACKENDS, TEXT_BACKENDS, available_backends
+
+
+def make_page(i):
+    """ベンチマーク用のダミーページを生成"""
+    r = random.Random(i)
+    items = ''.join(
+        f'<div class="item"><h3><a href="/work/=/product_id/RJ{r.randrange(10**8):08d}.html?i3_ref=list">作品{j}</a></h3>'
+        f'<p>説明文 {"テキスト " * r.randrange(5, 30)}</p><span>&yen;{r.randrange(100, 5000)}</span></div>'
+        for j in range(80)
+    )
+    return (f'<!DOCTYPE html><html><head><title>page {i}</title><style>.a{{color:red}}</style>'
+            f'<script>var x = "<a href=\'/no\'>";</script></head><body>'
+            f'<nav><a href="/">top</a><a href="/genre/">genre</a></nav>{items}'
+            f'<footer><a href="/about">about</a></footer></body></html>')
+
+
+def load_pages(paths, limit):
+    """保存したHTMLファイル（ディレクトリ指定時は配下の*.html, *.htm）を読み込む"""
+    pages = []
+    for path in map(Path, paths):
+        files = sorted(p for p in path.rglob('*') if p.suffix in ('.html', '.htm')) if path.is_dir() else [path]
+        for file in files:
+            pages.append(file.read_text(encoding='utf-8', errors='replace'))
+            if limit and len(pages) >= limit:
+                return pages
+    return pages
+
+
+def bench(func, pages, repeat):
+    """ページ/秒と最後の結果を返す"""
+    results = None
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = [func(html) for html in pages]
+    elapsed = time.perf_counter() - start
+    return len(pages) * repeat / elapsed, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HTMLパーサーのバックエンドごとの処理速度（ページ/秒）の計測')
+    parser.add_argument('paths', nargs='*', help='保存したHTMLファイルまたはディレクトリ（省略時はダミーページを生成）')
+    parser.add_argument('--generate', type=int, default=200, help='生成するダミーページ数（paths省略時）')
+    parser.add_argument('--limit', type=int, default=0, help='読み込む最大ページ数（0は無制限）')
+    parser.add_argument('--repeat', type=int, default=3, help='繰り返し回数')
+    args = parser.parse_args()
+
+    pages = load_pages(args.paths, args.limit) if args.paths else [make_page(i) for i in range(args.generate)]
+    if not pages:
+        print("ページがありません。")
+        return
+    total_mb = sum(len(html.encode('utf-8')) for html in pages) / (1024 * 1024)
+    print(f"ページ数: {len(pages):,} ({total_mb:.1f}MB), 繰り返し: {args.repeat}回")
+
+    for task, backends in (('links', LINK_BACKENDS), ('texts', TEXT_BACKENDS)):
+        # bs4（従来の処理）の結果と一致したページの割合も表示する
+        _, baseline = bench(backends['bs4'], pages, 1)
+        print(f"\n[{task}]")
+        print(f"{'バックエンド':<12} {'ページ/秒':>12} {'bs4比':>8} {'bs4と一致':>10}")
+        base_rate = None
+        for name in reversed(available_backends(task)):
+            rate, results = bench(backends[name], pages, args.repeat)
+            base_rate = base_rate or rate
+            same = sum(a == b for a, b in zip(results, baseline)) / len(pages) * 100
+            print(f"{name:<12} {rate:>12,.1f} {rate / base_rate:>7.1f}x {same:>9.1f}%")
+
+
+if __name__ == "__main__":
+    main()
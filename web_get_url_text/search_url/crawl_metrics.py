@@ -0,0 +1,224 @@
+import bisect
+import http.server
+import json
+import threading
+import time
+from pathlib import Path
+
+# 応答時間のヒストグラムの区切り（秒）
+DEFAULT_LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def label_key(labels):
+    """ラベルの辞書を、集計のキーに使える並び順の決まったタプルにする"""
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def format_labels(key, extra=()):
+    pairs = [*key, *extra]
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Histogram:
+    """区切りごとの件数と合計値を持つヒストグラム（1系列分）"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """Prometheus形式の累積件数（最後は+Inf）を返す"""
+        total = 0
+        result = []
+        for le, count in zip([*self.buckets, float('inf')], self.counts):
+            total += count
+            result.append((le, total))
+        return result
+
+
+class CrawlMetrics:
+    """
+    収集処理のメトリクス（カウンタ、ゲージ、ヒストグラム）を集計する
+
+    記録はロック1回と辞書の更新だけで済ませ、取得処理を遅くしない。
+    キュー長など読み出し時に計算できる値はregister_callbackで登録しておき、
+    snapshot()やPrometheus形式の出力のときにだけ計算する。
+    serve()でローカルポートに /metrics（Prometheusのテキスト形式）と /metrics.json を公開し、
+    start_dump()で一定間隔ごとにJSONLファイルへ書き出す。複数のスレッド・クローラーから共有して使う。
+    """
+
+    def __init__(self, latency_buckets=DEFAULT_LATENCY_BUCKETS):
+        self.latency_buckets = tuple(sorted(latency_buckets))
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.callbacks = {}
+        self.help = {}
+        self.server = None
+        self.dump_thread = None
+        self.dump_stop = threading.Event()
+
+    def inc(self, name, value=1, **labels):
+        """カウンタを増やす"""
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """ゲージの値を設定する"""
+        with self.lock:
+            self.gauges[(name, label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        """ヒストグラムに値（応答時間など）を記録する"""
+        key = (name, label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.latency_buckets)
+            histogram.observe(value)
+
+    def register_callback(self, name, func, kind='gauge', help=None):
+        """
+        読み出し時に値を計算するメトリクスを登録する
+
+        Args:
+            name: メトリクス名
+            func: 値を返す関数（例外を出した場合はその回の出力から除く）
+            kind: 'gauge'または'counter'
+            help: Prometheus形式の出力に付ける説明
+        """
+        self.callbacks[name] = (kind, func)
+        if help:
+            self.help[name] = help
+
+    def describe(self, name, help):
+        self.help[name] = help
+
+    def collect(self):
+        """(種類, 名前, ラベル, 値)の一覧と、ヒストグラムの一覧を返す"""
+        with self.lock:
+            values = [('counter', name, key, value) for (name, key), value in self.counters.items()]
+            values += [('gauge', name, key, value) for (name, key), value in self.gauges.items()]
+            histograms = [(name, key, histogram.cumulative(), histogram.sum, histogram.count)
+                          for (name, key), histogram in self.histograms.items()]
+        for name, (kind, func) in list(self.callbacks.items()):
+            try:
+                values.append((kind, name, (), func()))
+            except Exception:
+                continue
+        return values, histograms
+
+    def snapshot(self):
+        """現在の値をJSONに変換できる辞書で返す"""
+        values, histograms = self.collect()
+        result = {'timestamp': time.time(), 'counters': {}, 'gauges': {}, 'histograms': {}}
+        for kind, name, key, value in values:
+            result['counters' if kind == 'counter' else 'gauges'].setdefault(name, []).append(
+                {'labels': dict(key), 'value': value})
+        for name, key, buckets, total, count in histograms:
+            result['histograms'].setdefault(name, []).append({
+                'labels': dict(key),
+                'count': count,
+                'sum': total,
+                'buckets': [['+Inf' if le == float('inf') else le, cumulative] for le, cumulative in buckets],
+            })
+        return result
+
+    def to_prometheus(self):
+        """Prometheusのテキスト形式（version 0.0.4）で返す"""
+        values, histograms = self.collect()
+        lines = []
+        seen = set()
+
+        def header(name, kind):
+            if name in seen:
+                return
+            seen.add(name)
+            if name in self.help:
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for kind, name, key, value in sorted(values, key=lambda item: (item[1], item[2])):
+            header(name, kind)
+            lines.append(f"{name}{format_labels(key)} {value}")
+        for name, key, buckets, total, count in sorted(histograms, key=lambda item: (item[0], item[1])):
+            header(name, 'histogram')
+            for le, cumulative in buckets:
+                le_text = '+Inf' if le == float('inf') else repr(le)
+                lines.append(f"{name}_bucket{format_labels(key, (('le', le_text),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(key)} {total}")
+            lines.append(f"{name}_count{format_labels(key)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """/metrics（Prometheus形式）と/metrics.json（JSON）を返すHTTPサーバーをバックグラウンドで起動する"""
+        metrics = self
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path in ('/', '/metrics'):
+                    body = metrics.to_prometheus().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif path == '/metrics.json':
+                    body = json.dumps(metrics.snapshot(), ensure_ascii=False).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server.server_address[1]
+
+    def start_dump(self, path, interval=60):
+        """interval秒ごとにsnapshot()を1行のJSONとしてpathに追記するスレッドを起動する"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        def run():
+            while not self.dump_stop.wait(interval):
+                self.dump(path)
+            # 終了時の値も残しておく
+            self.dump(path)
+
+        self.dump_thread = threading.Thread(target=run, daemon=True)
+        self.dump_thread.start()
+
+    def dump(self, path):
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(self.snapshot(), ensure_ascii=False) + '\n')
+
+    def close(self):
+        """HTTPサーバーとJSONLの書き出しを停止する（最後の値を書き出してから終了する）"""
+        if self.dump_thread is not None:
+            self.dump_stop.set()
+            self.dump_thread.join()
+            self.dump_thread = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,281 @@
+import ipaddress
+import socket
+import threading
+import time
+from collections import Counter, OrderedDict
+
+try:
+    # use_record_ttl=Trueの場合にレコードのTTLを問い合わせる（pip install dnspython）
+    import dns.resolver as dns_resolver
+except ImportError:
+    dns_resolver = None
+
+# 置き換える前のsocket.getaddrinfo
+_original_getaddrinfo = socket.getaddrinfo
+_installed = None
+# スレッドごとの、キャッシュを通した名前解決にかかった時間（接続時間からDNSの時間を分けるために使う）
+_thread_state = threading.local()
+# キャッシュせずにそのまま解決するフラグ（数値アドレスの指定・待ち受け用など）
+BYPASS_FLAGS = socket.AI_NUMERICHOST | socket.AI_PASSIVE | socket.AI_CANONNAME
+
+
+def take_lookup_seconds():
+    """このスレッドでキャッシュを通して名前解決にかかった秒数を返してリセットする（解決していなければNone）"""
+    seconds = getattr(_thread_state, 'seconds', None)
+    _thread_state.seconds = None
+    return seconds
+
+
+def is_ip_address(host):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+def with_port(results, port):
+    """ポートなしで解決した結果のアドレスに、要求されたポートを入れる"""
+    return [(family, type_, proto, canonname, (sockaddr[0], port, *sockaddr[2:]))
+            for family, type_, proto, canonname, sockaddr in results]
+
+
+class DNSEntry:
+    __slots__ = ('results', 'error', 'resolved_at', 'expires_at', 'refreshing')
+
+    def __init__(self, results, error, resolved_at, ttl):
+        self.results = results
+        self.error = error
+        self.resolved_at = resolved_at
+        self.expires_at = resolved_at + ttl
+        self.refreshing = False
+
+
+class DNSCache:
+    """
+    プロセス全体で共有する名前解決（getaddrinfo）のキャッシュ
+
+    install()でsocket.getaddrinfoを置き換えるため、requests（urllib3）・urllib・aiohttpの
+    既定のリゾルバーなど、同じプロセスのすべてのHTTPクライアントがこのキャッシュを使う。
+    - 結果はttl秒保持する（use_record_ttl=Trueでdnspythonがあれば、レコードのTTLをmin_ttl〜max_ttlに収めた値）
+    - 期限まで残りprefetch_before秒を切った結果が使われると、裏で解決し直して差し替える（先読み）
+    - 同じホストの解決が同時に来た場合は1回だけ解決し、他は結果を待つ
+    - 解決できなかったホストはnegative_ttl秒のあいだ同じエラーを返す（一時的な失敗は保持しない）
+    ポートを除いた(ホスト, ソケットの種類, プロトコル, フラグ)ごとに、アドレスファミリーを問わず解決して保持し、
+    要求されたファミリーで絞り込んでポートを入れて返す。フラグはAI_ADDRCONFIG（aiohttpが指定する）などで
+    返るアドレスが変わるため、キーに含めて解決時にも同じ値を渡す。AI_V4MAPPEDは要求されたファミリーで解決する。
+    """
+
+    def __init__(self, ttl=300, min_ttl=30, max_ttl=3600, negative_ttl=30, prefetch_before=None,
+                 use_record_ttl=False, max_entries=10000, timeout=5):
+        """
+        Args:
+            ttl: 結果を保持する秒数（レコードのTTLを使わない場合・取得できない場合）
+            min_ttl: レコードのTTLを使う場合の最短の保持時間（秒）
+            max_ttl: レコードのTTLを使う場合の最長の保持時間（秒）
+            negative_ttl: 解決できなかったホストのエラーを保持する秒数
+            prefetch_before: 期限まで残りこの秒数を切った結果が使われたら先読みする（Noneの場合は保持時間の1/5）
+            use_record_ttl: dnspythonがある場合にレコードのTTLを使うかどうか（解決のたびにAレコードを
+                別に問い合わせるため、未解決・期限切れの名前解決がその分遅くなる）
+            max_entries: 保持するホスト数の上限（超えたら古いものから捨てる）
+            timeout: レコードのTTLを問い合わせるときのタイムアウト（秒）
+        """
+        self.ttl = ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.prefetch_before = prefetch_before
+        self.use_record_ttl = use_record_ttl and dns_resolver is not None
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.stats = Counter()
+        self.lookup_seconds = 0.0
+
+    def getaddrinfo(self, host, port, family=0, type=0, proto=0, flags=0):
+        """socket.getaddrinfoと同じ引数・戻り値で、キャッシュした結果を返す"""
+        if isinstance(host, bytes):
+            host = host.decode('idna')
+        if isinstance(port, str) and port.isdigit():
+            port = int(port)
+        if not host or flags & BYPASS_FLAGS or (port is not None and not isinstance(port, int)) or \
+                is_ip_address(host):
+            return _original_getaddrinfo(host, port, family, type, proto, flags)
+
+        start = time.perf_counter()
+        try:
+            entry = self.lookup(self.key_of(host, family, type, proto, flags))
+        finally:
+            _thread_state.seconds = (getattr(_thread_state, 'seconds', None) or 0.0) + time.perf_counter() - start
+        if entry.error is not None:
+            raise entry.error
+        results = entry.results
+        if family:
+            results = [result for result in results if result[0] == family]
+            if not results:
+                raise socket.gaierror(socket.EAI_ADDRFAMILY if hasattr(socket, 'EAI_ADDRFAMILY') else socket.EAI_NONAME,
+                                      'Address family for hostname not supported')
+        return with_port(results, port or 0)
+
+    @staticmethod
+    def key_of(host, family, type, proto, flags):
+        """キャッシュのキー（ホスト, 解決するファミリー, ソケットの種類, プロトコル, フラグ）を返す"""
+        return host.lower().rstrip('.'), family if flags & socket.AI_V4MAPPED else 0, type, proto, flags
+
+    def lookup(self, key, prefetch=False):
+        """
+        キャッシュの結果を返す。期限切れ・未解決の場合は解決する（同じキーの解決中はその結果を待つ）
+
+        prefetch=Trueの場合は先読みとして数え、呼び出し回数・命中率には含めない。
+        """
+        while True:
+            now = time.monotonic()
+            with self.lock:
+                entry = self.entries.get(key)
+                if entry is not None and entry.expires_at > now:
+                    if prefetch:
+                        return entry
+                    self.stats['lookups'] += 1
+                    self.stats['hits'] += 1
+                    if not entry.refreshing and entry.error is None and \
+                            entry.expires_at - now < self.prefetch_window(entry):
+                        entry.refreshing = True
+                        self.stats['prefetches'] += 1
+                        threading.Thread(target=self.refresh, args=(key, entry), daemon=True).start()
+                    return entry
+                waiter = self.inflight.get(key)
+                if waiter is None:
+                    waiter = self.inflight[key] = threading.Event()
+                    if prefetch:
+                        self.stats['prefetches'] += 1
+                    else:
+                        self.stats['lookups'] += 1
+                        self.stats['misses'] += 1
+                    break
+            waiter.wait()
+
+        try:
+            return self.refresh(key)
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+            waiter.set()
+
+    def prefetch_window(self, entry):
+        if self.prefetch_before is not None:
+            return self.prefetch_before
+        return max(1.0, (entry.expires_at - entry.resolved_at) / 5)
+
+    def refresh(self, key, previous=None):
+        """
+        キーを解決し直してキャッシュに入れる
+
+        previous（期限前の先読みで置き換える結果）がある場合、解決に失敗しても期限まではそちらを使い続ける。
+        """
+        host, family, type_, proto, flags = key
+        start = time.perf_counter()
+        try:
+            results = _original_getaddrinfo(host, None, family, type_, proto, flags)
+            error = None
+            ttl = self.record_ttl(host)
+        except socket.gaierror as e:
+            results, error = None, e
+            # 一時的な失敗（EAI_AGAIN）は保持せず、次の要求で解決し直す
+            ttl = 0 if e.errno == socket.EAI_AGAIN else self.negative_ttl
+        elapsed = time.perf_counter() - start
+        entry = DNSEntry(results, error, time.monotonic(), ttl)
+        with self.lock:
+            self.lookup_seconds += elapsed
+            self.stats['resolves'] += 1
+            if error is not None:
+                self.stats['errors'] += 1
+                if previous is not None:
+                    return previous
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def record_ttl(self, host):
+        """保持する秒数（use_record_ttl=Trueでdnspythonがあれば、AレコードのTTL）"""
+        if not self.use_record_ttl:
+            return self.ttl
+        try:
+            answer = dns_resolver.resolve(host, 'A', lifetime=self.timeout)
+            return min(self.max_ttl, max(self.min_ttl, answer.rrset.ttl))
+        except Exception:
+            # /etc/hostsにだけあるホストなどはDNSに問い合わせられないため、設定の値を使う
+            return self.ttl
+
+    def prefetch(self, hosts, type=socket.SOCK_STREAM, flags=0):
+        """
+        ホストをバックグラウンドで解決しておく（開始URLのホストなど、これから接続するもの）
+
+        flagsは接続するクライアントがgetaddrinfoに渡す値にする（requests・urllibは0、aiohttpはAI_ADDRCONFIG）。
+        """
+        keys = [self.key_of(host, 0, type, 0, flags) for host in hosts if host and not is_ip_address(host)]
+        with self.lock:
+            keys = [key for key in dict.fromkeys(keys) if key not in self.entries and key not in self.inflight]
+        if not keys:
+            return
+
+        def run():
+            for key in keys:
+                self.lookup(key, prefetch=True)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def summary(self):
+        with self.lock:
+            lookups = self.stats['lookups']
+            hits = self.stats['hits']
+            resolved = self.stats['resolves']
+            return {
+                'lookups': lookups,
+                'hits': hits,
+                'misses': self.stats['misses'],
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'prefetches': self.stats['prefetches'],
+                'errors': self.stats['errors'],
+                'hosts': len(self.entries),
+                'avg_resolve_ms': self.lookup_seconds / resolved * 1000 if resolved else 0.0,
+            }
+
+    def format(self):
+        """print_progress用の1行の表記を返す"""
+        summary = self.summary()
+        return (f"{summary['lookups']:,}回 (キャッシュ命中率 {summary['hit_rate'] * 100:.1f}%, "
+                f"解決 {summary['misses']:,}回・平均{summary['avg_resolve_ms']:.1f}ms, "
+                f"先読み {summary['prefetches']:,}回, ホスト数 {summary['hosts']:,})")
+
+    def install(self):
+        """socket.getaddrinfoをこのキャッシュに置き換える"""
+        socket.getaddrinfo = self.getaddrinfo
+        return self
+
+
+def install_dns_cache(**kwargs):
+    """
+    プロセス全体のDNSキャッシュを有効にして返す（既に有効な場合はそのキャッシュを返す）
+
+    引数はDNSCacheと同じ（2回目以降の呼び出しでは使わない）。
+    """
+    global _installed
+    if _installed is None:
+        _installed = DNSCache(**kwargs).install()
+    return _installed
+
+
+def get_dns_cache():
+    """有効なDNSキャッシュを返す（有効にしていなければNone）"""
+    return _installed
+
+
+def uninstall_dns_cache():
+    """socket.getaddrinfoを元に戻す"""
+    global _installed
+    socket.getaddrinfo = _original_getaddrinfo
+    _installed = None
@@ -0,0 +1,142 @@
+import os
+import threading
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+
+# 本文を取得するContent-Type（これ以外はダウンロードせずに打ち切る）
+DEFAULT_ALLOWED_TYPES = ('text/html', 'application/xhtml+xml', 'text/plain')
+
+# HTML以外である可能性が高い拡張子（HEADで事前に確認する）
+SUSPICIOUS_EXTENSIONS = (
+    '.pdf', '.zip', '.rar', '.7z', '.gz', '.tar', '.exe', '.dmg', '.apk', '.iso',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.svg', '.ico',
+    '.mp3', '.wav', '.ogg', '.m4a', '.mp4', '.m4v', '.mov', '.avi', '.wmv', '.webm', '.flv', '.mkv',
+    '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx',
+    '.css', '.js', '.woff', '.woff2', '.ttf',
+)
+
+
+class ContentSkipped(Exception):
+    """Content-Typeやサイズの条件に合わず、本文の取得を打ち切ったことを表す例外"""
+
+    def __init__(self, url, reason, content_type=None, content_length=None):
+        self.url = url
+        self.reason = reason
+        self.content_type = content_type
+        self.content_length = content_length
+        super().__init__(f"{reason}: {url} (Content-Type: {content_type}, Content-Length: {content_length})")
+
+
+def parse_content_length(value):
+    try:
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class FetchGuard:
+    """
+    HTML以外の本文や巨大な本文をダウンロードしないためのフィルタ
+
+    stream=Trueで取得してヘッダのContent-Type・Content-Lengthを先に確認し、
+    対象外であれば本文を読まずに接続を閉じる。Content-Lengthがない場合も
+    読み込み中にmax_bytesを超えた時点で打ち切る。拡張子から画像・動画などが
+    疑われるURLは、GETの前にHEADで確認する。複数スレッドから共有して使う。
+    """
+
+    def __init__(self, max_bytes=10 * 1024 * 1024, allowed_types=DEFAULT_ALLOWED_TYPES,
+                 head_check=True, head_extensions=SUSPICIOUS_EXTENSIONS, chunk_size=64 * 1024):
+        """
+        Args:
+            max_bytes: 取得する本文の最大バイト数（Noneの場合は制限しない）
+            allowed_types: 本文を取得するContent-Type（Noneの場合は制限しない）
+            head_check: 拡張子がhead_extensionsに含まれるURLをHEADで事前に確認するかどうか
+            head_extensions: HEADで事前に確認する拡張子
+            chunk_size: 本文を読み込む単位（バイト）
+        """
+        self.max_bytes = max_bytes
+        self.allowed_types = tuple(t.lower() for t in allowed_types) if allowed_types else None
+        self.head_check = head_check
+        self.head_extensions = tuple(ext.lower() for ext in head_extensions)
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        self.stats = defaultdict(int)
+
+    def is_suspicious(self, url):
+        """拡張子からHTML以外の可能性が高いURLかどうかを判定する"""
+        extension = os.path.splitext(urlsplit(url).path)[1].lower()
+        return extension in self.head_extensions
+
+    def skip_reason(self, content_type, content_length):
+        """ヘッダの値から本文を取得すべきでない理由を返す（取得してよい場合はNone）"""
+        if self.allowed_types is not None and content_type:
+            mime_type = content_type.split(';', 1)[0].strip().lower()
+            if mime_type not in self.allowed_types:
+                return 'content_type'
+        length = parse_content_length(content_length)
+        if self.max_bytes is not None and length is not None and length > self.max_bytes:
+            return 'too_large'
+        return None
+
+    def skipped(self, url, reason, content_type=None, content_length=None, read_bytes=0, head=False):
+        """打ち切りを統計に記録し、送出するContentSkippedを返す"""
+        length = parse_content_length(content_length)
+        with self.lock:
+            self.stats[f'skipped_{reason}'] += 1
+            if head:
+                self.stats['skipped_by_head'] += 1
+            # ダウンロードせずに済んだバイト数（サイズが分からない場合は数えない）
+            if length is not None:
+                self.stats['skipped_bytes'] += max(0, length - read_bytes)
+            self.stats['aborted_bytes'] += read_bytes
+        return ContentSkipped(url, reason, content_type, length)
+
+    def fetch(self, session, url, **kwargs):
+        """
+        条件を確認しながらGETし、本文を読み込んだレスポンスを返す
+
+        sessionはrequests.Sessionまたはrequestsモジュール。
+        対象外の場合は接続を閉じてContentSkippedを送出する。
+        """
+        if self.head_check and self.is_suspicious(url):
+            head_kwargs = {key: value for key, value in kwargs.items() if key in ('headers', 'timeout')}
+            head = session.head(url, allow_redirects=True, **head_kwargs)
+            head.close()
+            if head.status_code < 400:
+                reason = self.skip_reason(head.headers.get('Content-Type'), head.headers.get('Content-Length'))
+                if reason:
+                    raise self.skipped(url, reason, head.headers.get('Content-Type'),
+                                       head.headers.get('Content-Length'), head=True)
+
+        response = session.get(url, stream=True, **kwargs)
+        content_type = response.headers.get('Content-Type')
+        content_length = response.headers.get('Content-Length')
+        if response.status_code == 200:
+            reason = self.skip_reason(content_type, content_length)
+            if reason:
+                response.close()
+                raise self.skipped(url, reason, content_type, content_length)
+
+        chunks = []
+        read_bytes = 0
+        for chunk in response.iter_content(self.chunk_size):
+            chunks.append(chunk)
+            read_bytes += len(chunk)
+            if self.max_bytes is not None and read_bytes > self.max_bytes:
+                response.close()
+                raise self.skipped(url, 'too_large', content_type, content_length, read_bytes=read_bytes)
+        # 読み込んだ本文をレスポンスに戻し、.text/.contentを通常どおり使えるようにする
+        response._content = b''.join(chunks)
+        response._content_consumed = True
+        self.record_fetched(read_bytes)
+        return response
+
+    def record_fetched(self, read_bytes):
+        with self.lock:
+            self.stats['fetched'] += 1
+            self.stats['fetched_bytes'] += read_bytes
+
+    def summary(self):
+        with self.lock:
+            return dict(self.stats)
@@ -0,0 +1,139 @@
+import json
+import sqlite3
+from pathlib import Path
+
+
+class FrontierStore:
+    """
+    URL収集の状態（訪問待ちキュー、訪問済みURL、発見済みURL、統計情報）を
+    SQLite（WALモード）に逐次保存し、中断後に続きから再開できるようにする
+
+    変更はメモリ上にためておき、checkpoint()の呼び出しがcheckpoint_interval回に
+    達するごとに1トランザクションでまとめて書き込む。
+    """
+
+    def __init__(self, path, checkpoint_interval=1):
+        """
+        Args:
+            path: SQLiteファイルのパス
+            checkpoint_interval: 何ページ処理するごとにディスクへ書き込むか
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.checkpoint_interval = max(1, checkpoint_interval)
+        self.pages_since_flush = 0
+
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS queue (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL UNIQUE,
+                depth INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS visited (
+                key TEXT PRIMARY KEY
+            );
+            CREATE TABLE IF NOT EXISTS discovered (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                saved INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS stats (
+                name TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        ''')
+        self.conn.commit()
+
+        self.pending_queue = []
+        self.pending_dequeue = []
+        self.pending_visited = []
+        self.pending_discovered = []
+        self.pending_saved = []
+        self.pending_stats = None
+
+    def has_state(self):
+        """前回の実行で保存された状態があるかどうか"""
+        row = self.conn.execute('SELECT EXISTS(SELECT 1 FROM visited)').fetchone()
+        return bool(row[0])
+
+    def load_queue(self):
+        """訪問待ちURLを(URL, 深さ)の組で追加順に返す"""
+        for url, depth in self.conn.execute('SELECT url, depth FROM queue ORDER BY seq'):
+            yield url, depth
+
+    def load_visited(self):
+        """訪問済みURLのキーを返す"""
+        for (key,) in self.conn.execute('SELECT key FROM visited'):
+            yield key
+
+    def load_discovered(self):
+        """発見済みURLのキーを返す"""
+        for (key,) in self.conn.execute('SELECT key FROM discovered'):
+            yield key
+
+    def load_unsaved(self):
+        """発見済みだがバッチファイルにまだ書き出していないURLを返す"""
+        rows = self.conn.execute('SELECT url FROM discovered WHERE saved = 0 ORDER BY rowid')
+        return [url for (url,) in rows]
+
+    def load_stats(self):
+        """保存された統計情報を辞書で返す"""
+        return {name: json.loads(value) for name, value in self.conn.execute('SELECT name, value FROM stats')}
+
+    def enqueue(self, url, depth=0):
+        self.pending_queue.append((url, depth))
+
+    def dequeue(self, url):
+        self.pending_dequeue.append((url,))
+
+    def add_visited(self, key):
+        self.pending_visited.append((key,))
+
+    def add_discovered(self, key, url):
+        self.pending_discovered.append((key, url))
+
+    def mark_saved(self, keys):
+        """バッチファイルに書き出したURLを記録する"""
+        self.pending_saved.extend((key,) for key in keys)
+
+    def checkpoint(self, stats, force=False):
+        """1ページ分の処理が終わったことを通知し、必要に応じてディスクへ書き込む"""
+        self.pending_stats = stats
+        self.pages_since_flush += 1
+        if force or self.pages_since_flush >= self.checkpoint_interval:
+            self.flush()
+
+    def flush(self):
+        """ためておいた変更を1トランザクションで書き込む"""
+        with self.conn:
+            if self.pending_queue:
+                self.conn.executemany('INSERT OR IGNORE INTO queue (url, depth) VALUES (?, ?)', self.pending_queue)
+            if self.pending_dequeue:
+                self.conn.executemany('DELETE FROM queue WHERE url = ?', self.pending_dequeue)
+            if self.pending_visited:
+                self.conn.executemany('INSERT OR IGNORE INTO visited (key) VALUES (?)', self.pending_visited)
+            if self.pending_discovered:
+                self.conn.executemany('INSERT OR IGNORE INTO discovered (key, url) VALUES (?, ?)',
+                                      self.pending_discovered)
+            if self.pending_saved:
+                self.conn.executemany('UPDATE discovered SET saved = 1 WHERE key = ?', self.pending_saved)
+            if self.pending_stats is not None:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO stats (name, value) VALUES (?, ?)',
+                    [(name, json.dumps(value)) for name, value in self.pending_stats.items()]
+                )
+
+        self.pending_queue = []
+        self.pending_dequeue = []
+        self.pending_visited = []
+        self.pending_discovered = []
+        self.pending_saved = []
+        self.pending_stats = None
+        self.pages_since_flush = 0
+
+    def close(self):
+        self.flush()
+        self.conn.close()
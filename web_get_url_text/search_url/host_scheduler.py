@@ -0,0 +1,246 @@
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+from urllib.robotparser import RobotFileParser
+
+
+class TokenBucket:
+    """
+    ホストごとのトークンバケット（GCRA方式）
+
+    delay秒ごとに1トークン補充され、最大burst個までためておける。
+    """
+
+    def __init__(self, delay: float, burst: int = 1):
+        self.delay = delay
+        self.burst = max(1, burst)
+        # 理論上の次回到着時刻。ここからバースト分さかのぼった時刻以降なら送信できる
+        self.tat = time.monotonic()
+        self.blocked_until = 0.0
+
+    def ready_at(self, now: float) -> float:
+        return max(now, self.tat - self.delay * (self.burst - 1), self.blocked_until)
+
+    def reserve(self, now: float) -> float:
+        """トークンを1つ予約し、使えるようになる時刻を返す"""
+        start = self.ready_at(now)
+        self.tat = max(self.tat, start) + self.delay
+        return start
+
+
+class HostScheduler:
+    """
+    ホストごとのトークンバケットでリクエスト間隔を制御するスケジューラ
+
+    - ホストごとに異なる間隔を設定できる（host_delays）
+    - robots.txtのCrawl-delayが設定値より長い場合はそちらに従う
+    - 429/503のRetry-Afterを受け取ったホストは指定時間まで停止する
+    複数のスレッド・クローラーから共有して使う。
+    """
+
+    def __init__(self,
+                 default_delay: float = 1.0,
+                 burst: int = 1,
+                 host_delays: Optional[Dict[str, float]] = None,
+                 respect_robots: bool = True,
+                 user_agent: str = '*',
+                 robots_timeout: float = 10,
+                 default_retry_after: float = 60,
+                 respect_retry_after: bool = True):
+        """
+        Args:
+            default_delay: ホストあたりのリクエスト間隔（秒）
+            burst: 間隔を空けずに連続で送れるリクエスト数
+            host_delays: ホスト名ごとのリクエスト間隔（秒）
+            respect_robots: robots.txtのCrawl-delayに従うかどうか
+            user_agent: robots.txtの取得・判定に使うUser-Agent（ページの取得と同じ値にする。'*'の場合はヘッダを送らない）
+            robots_timeout: robots.txt取得のタイムアウト（秒）
+            default_retry_after: Retry-Afterがない429/503を受けたときの停止時間（秒）
+            respect_retry_after: 429/503を受けたホストを停止するかどうか（記録済みのレスポンスを再生する場合はFalse）
+        """
+        self.default_delay = default_delay
+        self.burst = burst
+        self.host_delays = {host.lower(): delay for host, delay in (host_delays or {}).items()}
+        self.respect_robots = respect_robots
+        self.user_agent = user_agent
+        self.robots_timeout = robots_timeout
+        self.default_retry_after = default_retry_after
+        self.respect_retry_after = respect_retry_after
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.lock = threading.Lock()
+        self.robots_locks: Dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def host_of(url: str) -> str:
+        return urlsplit(url).netloc.lower()
+
+    def fetch_crawl_delay(self, url: str) -> Optional[float]:
+        """robots.txtからCrawl-delayを取得する（取得できない場合はNone）"""
+        parts = urlsplit(url)
+        robots_url = f"{parts.scheme}://{parts.netloc}/robots.txt"
+        try:
+            headers = {} if self.user_agent == '*' else {'User-Agent': self.user_agent}
+            request = Request(robots_url, headers=headers)
+            with urlopen(request, timeout=self.robots_timeout) as response:
+                lines = response.read().decode('utf-8', errors='replace').splitlines()
+        except Exception:
+            return None
+        parser = RobotFileParser()
+        parser.parse(lines)
+        delay = parser.crawl_delay(self.user_agent)
+        return float(delay) if delay is not None else None
+
+    def get_bucket(self, url: str) -> TokenBucket:
+        """ホストのバケットを返す。初回はrobots.txtを確認して作成する"""
+        host = self.host_of(url)
+        bucket = self.buckets.get(host)
+        if bucket is not None:
+            return bucket
+
+        with self.lock:
+            robots_lock = self.robots_locks.setdefault(host, threading.Lock())
+        # robots.txtの取得中も他ホストのスケジューリングは止めない
+        with robots_lock:
+            bucket = self.buckets.get(host)
+            if bucket is not None:
+                return bucket
+            delay = self.host_delays.get(host, self.default_delay)
+            if self.respect_robots:
+                crawl_delay = self.fetch_crawl_delay(url)
+                if crawl_delay is not None and crawl_delay > delay:
+                    delay = crawl_delay
+            bucket = TokenBucket(delay, self.burst)
+            with self.lock:
+                self.buckets[host] = bucket
+            return bucket
+
+    def wait_time(self, url: str) -> float:
+        """ホストにリクエストを送れるまでの待ち時間（秒）"""
+        bucket = self.get_bucket(url)
+        now = time.monotonic()
+        with self.lock:
+            return bucket.ready_at(now) - now
+
+    def host_wait_time(self, host: str) -> float:
+        """ホスト名でリクエストを送れるまでの待ち時間を返す（初回のホストはrobots.txtを取得せず0を返す）"""
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            return 0.0
+        now = time.monotonic()
+        with self.lock:
+            return bucket.ready_at(now) - now
+
+    def reserve(self, url: str) -> float:
+        """リクエスト枠を予約し、送信までに待つべき秒数を返す（待機はしない）"""
+        bucket = self.get_bucket(url)
+        now = time.monotonic()
+        with self.lock:
+            return max(0.0, bucket.reserve(now) - now)
+
+    def acquire(self, url: str) -> float:
+        """リクエストを送れるまで待機し、待った秒数を返す"""
+        wait = self.reserve(url)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def observe(self, url: str, status_code: int, headers=None):
+        """レスポンスを受け取り、429/503の場合はRetry-Afterに従ってホストを停止する"""
+        if status_code not in (429, 503) or not self.respect_retry_after:
+            return
+        retry_after = self.parse_retry_after((headers or {}).get('Retry-After'))
+        if retry_after is None:
+            retry_after = self.default_retry_after
+        bucket = self.get_bucket(url)
+        with self.lock:
+            bucket.blocked_until = max(bucket.blocked_until, time.monotonic() + retry_after)
+
+    @staticmethod
+    def parse_retry_after(value) -> Optional[float]:
+        """Retry-Afterヘッダ（秒数またはHTTP日付）を秒数に変換する"""
+        if not value:
+            return None
+        value = str(value).strip()
+        if value.isdigit():
+            return float(value)
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, retry_at.timestamp() - time.time())
+
+
+class HostQueue:
+    """
+    ホストごとにURLを振り分け、リクエストを送れる状態になったホストから順に取り出すキュー
+
+    ワーカーはget()を呼ぶだけで、待ち時間が最も短いホストのURLを受け取れる。
+    スレッドが特定ホストの待機で眠り続けることがないため、スループットは
+    スレッド数ではなくホスト数に比例する。
+
+    concurrency（AdaptiveConcurrency）を渡すと、ホストごとの同時リクエスト数が上限に
+    達しているホストは取り出しの対象から外す。処理が終わったURLはdone()で通知する。
+    """
+
+    def __init__(self, scheduler: HostScheduler, urls: Iterable[str] = (), concurrency=None):
+        self.scheduler = scheduler
+        self.concurrency = concurrency
+        self.queues: Dict[str, deque] = {}
+        self.condition = threading.Condition()
+        for url in urls:
+            self.put(url)
+
+    def put(self, url: str):
+        # robots.txtの取得はロックの外で先に済ませておく
+        self.scheduler.get_bucket(url)
+        host = self.scheduler.host_of(url)
+        with self.condition:
+            self.queues.setdefault(host, deque()).append(url)
+            self.condition.notify()
+
+    def __len__(self):
+        with self.condition:
+            return sum(len(queue) for queue in self.queues.values())
+
+    def get(self) -> Optional[str]:
+        """次に送れるURLを返す（必要なら送信可能になるまで待つ）。キューが空ならNoneを返す"""
+        with self.condition:
+            while True:
+                if not self.queues:
+                    return None
+                candidates = [
+                    (host, self.scheduler.wait_time(queue[0])) for host, queue in self.queues.items()
+                    if self.concurrency is None or self.concurrency.has_capacity(queue[0])
+                ]
+                if not candidates:
+                    # 全ホストが同時リクエスト数の上限に達しているため、done()の通知を待つ
+                    self.condition.wait(timeout=1.0)
+                    continue
+                host, wait = min(candidates, key=lambda item: item[1])
+                if wait <= 0:
+                    queue = self.queues[host]
+                    url = queue.popleft()
+                    if not queue:
+                        del self.queues[host]
+                    if self.concurrency is not None:
+                        self.concurrency.try_acquire(url)
+                    wait = self.scheduler.reserve(url)
+                    break
+                self.condition.wait(timeout=wait)
+
+        # 他のクローラーと枠を取り合った場合のみここで待つ
+        if wait > 0:
+            time.sleep(wait)
+        return url
+
+    def done(self, url: str, latency: Optional[float] = None, status: Optional[int] = None, error: bool = False):
+        """get()で取り出したURLの処理が終わったことを通知し、同時リクエスト数の枠を返す"""
+        if self.concurrency is None:
+            return
+        self.concurrency.release(url, latency, status, error)
+        with self.condition:
+            self.condition.notify_all()
@@ -0,0 +1,172 @@
+from html.parser import HTMLParser
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as SelectolaxParser
+except ImportError:
+    try:
+        # lexborを含まない古いselectolax
+        from selectolax.parser import HTMLParser as SelectolaxParser
+    except ImportError:
+        SelectolaxParser = None
+
+
+# テキスト抽出の対象タグと、抽出前に取り除くタグ（各クローラーの従来の処理と同じ）
+TEXT_TAGS = ('a', 'p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'div')
+REMOVE_TAGS = ('script', 'style', 'nav', 'footer')
+
+
+class HrefTokenizer(HTMLParser):
+    """木を作らず、<a href>の開始タグだけを拾う標準ライブラリのトークナイザ"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.hrefs = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            for name, value in attrs:
+                if name == 'href' and value is not None:
+                    self.hrefs.append(value)
+                    break
+
+
+def links_bs4(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    return [link['href'] for link in soup.find_all('a', href=True)]
+
+
+def links_strainer(html):
+    soup = BeautifulSoup(html, 'html.parser', parse_only=SoupStrainer('a', href=True))
+    return [link['href'] for link in soup.find_all('a', href=True)]
+
+
+def links_tokenizer(html):
+    tokenizer = HrefTokenizer()
+    tokenizer.feed(html)
+    tokenizer.close()
+    return tokenizer.hrefs
+
+
+def lxml_document(html):
+    try:
+        return lxml.html.document_fromstring(html)
+    except ValueError:
+        # XML宣言でencodingを指定した文字列はlxmlが受け付けないため、バイト列で渡す
+        return lxml.html.document_fromstring(html.encode('utf-8'))
+
+
+def links_lxml(html):
+    if not html.strip():
+        return []
+    return [link.get('href') for link in lxml_document(html).iter('a') if link.get('href') is not None]
+
+
+def links_selectolax(html):
+    tree = SelectolaxParser(html)
+    return [link.attributes['href'] for link in tree.css('a[href]') if link.attributes['href'] is not None]
+
+
+def texts_bs4(html, tags=TEXT_TAGS, remove_tags=REMOVE_TAGS):
+    soup = BeautifulSoup(html, 'html.parser')
+    for tag in soup(list(remove_tags)):
+        tag.decompose()
+    texts = []
+    for element in soup.find_all(list(tags)):
+        text = element.get_text().strip()
+        if text:
+            texts.append(text)
+    return texts
+
+
+def texts_lxml(html, tags=TEXT_TAGS, remove_tags=REMOVE_TAGS):
+    if not html.strip():
+        return []
+    root = lxml_document(html)
+    for element in list(root.iter(*remove_tags)):
+        # drop_treeは後ろに続くテキストを残すため、decompose()と同じ結果になる
+        element.drop_tree()
+    texts = []
+    for element in root.iter(*tags):
+        text = element.text_content().strip()
+        if text:
+            texts.append(text)
+    return texts
+
+
+def texts_selectolax(html, tags=TEXT_TAGS, remove_tags=REMOVE_TAGS):
+    tree = SelectolaxParser(html)
+    tree.strip_tags(list(remove_tags))
+    texts = []
+    for element in tree.css(', '.join(tags)):
+        text = element.text(deep=True).strip()
+        if text:
+            texts.append(text)
+    return texts
+
+
+# 速い順に並べたバックエンド。'auto'の場合はインストールされている中で先頭のものを使う
+LINK_BACKENDS = {
+    'selectolax': links_selectolax,
+    'lxml': links_lxml,
+    'tokenizer': links_tokenizer,
+    'strainer': links_strainer,
+    'bs4': links_bs4,
+}
+
+TEXT_BACKENDS = {
+    'selectolax': texts_selectolax,
+    'lxml': texts_lxml,
+    'bs4': texts_bs4,
+}
+
+
+def is_available(backend):
+    if backend == 'selectolax':
+        return SelectolaxParser is not None
+    if backend == 'lxml':
+        return lxml is not None
+    return True
+
+
+def available_backends(task='links'):
+    """利用できるバックエンド名を速い順に返す（task: 'links'または'texts'）"""
+    backends = LINK_BACKENDS if task == 'links' else TEXT_BACKENDS
+    return [name for name in backends if is_available(name)]
+
+
+def resolve_backend(backend='auto', task='links'):
+    """
+    バックエンド名を実際に使うものに解決する
+
+    'auto'の場合はインストールされている中で最も速いものを選ぶ。
+    指定したバックエンドのパッケージがない場合はImportErrorを送出する。
+    """
+    backends = LINK_BACKENDS if task == 'links' else TEXT_BACKENDS
+    if backend == 'auto':
+        return available_backends(task)[0]
+    if backend not in backends:
+        raise ValueError(f"不明なパーサーのバックエンドです: {backend} (選択肢: auto, {', '.join(backends)})")
+    if not is_available(backend):
+        raise ImportError(f"パーサーのバックエンド'{backend}'を使うには{backend}パッケージが必要です: pip install {backend}")
+    return backend
+
+
+def extract_links(html, backend='auto'):
+    """HTMLから<a>タグのhref属性を出現順に返す（URLは相対パスのまま）"""
+    return LINK_BACKENDS[resolve_backend(backend, 'links')](html)
+
+
+def extract_texts(html, backend='auto', tags=TEXT_TAGS, remove_tags=REMOVE_TAGS):
+    """
+    HTMLからremove_tagsを取り除いた上で、tagsに含まれる各要素のテキストを出現順に返す
+
+    入れ子になった要素はそれぞれ配下のテキスト全体を返す（BeautifulSoupのget_text()と同じ）。
+    """
+    return TEXT_BACKENDS[resolve_backend(backend, 'texts')](html, tags, remove_tags)
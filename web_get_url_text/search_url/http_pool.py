@@ -0,0 +1,150 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from dns_cache import take_lookup_seconds
+
+
+class ConnectionMetrics:
+    """
+    リクエスト数・新規接続数・接続確立にかかった時間を集計する（スレッドセーフ）
+
+    名前解決の時間が分かる接続（DNSキャッシュ・aiohttpのトレース）は、DNSの時間を接続時間から分けて集計する。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.connect_seconds = 0.0
+        self.dns_lookups = 0
+        self.dns_seconds = 0.0
+
+    def record_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def record_connection(self, seconds, dns_seconds=None):
+        """新規接続を記録する。dns_secondsを渡した場合、secondsはDNSの時間を除いた接続時間とする"""
+        with self.lock:
+            self.new_connections += 1
+            self.connect_seconds += seconds
+            if dns_seconds is not None:
+                self.dns_lookups += 1
+                self.dns_seconds += dns_seconds
+
+    def summary(self):
+        with self.lock:
+            requests_count = self.requests
+            new_connections = self.new_connections
+            connect_seconds = self.connect_seconds
+            dns_lookups = self.dns_lookups
+            dns_seconds = self.dns_seconds
+        reused = max(0, requests_count - new_connections)
+        return {
+            'requests': requests_count,
+            'new_connections': new_connections,
+            'reused': reused,
+            'reuse_rate': reused / requests_count if requests_count else 0.0,
+            'avg_connect_ms': connect_seconds / new_connections * 1000 if new_connections else 0.0,
+            'dns_lookups': dns_lookups,
+            'avg_dns_ms': dns_seconds / dns_lookups * 1000 if dns_lookups else 0.0,
+        }
+
+    def format(self):
+        """print_progress用の1行の表記を返す"""
+        summary = self.summary()
+        dns = f", 平均DNS解決 {summary['avg_dns_ms']:.1f}ms" if summary['dns_lookups'] else ''
+        return (f"新規{summary['new_connections']:,}回 / 再利用{summary['reused']:,}回 "
+                f"(再利用率 {summary['reuse_rate'] * 100:.1f}%, 平均接続時間 {summary['avg_connect_ms']:.1f}ms{dns})")
+
+
+def metered_pool_classes(metrics):
+    """
+    接続の確立（TCP・TLSハンドシェイク）ごとにmetricsへ記録するコネクションプールのクラスを作る
+
+    DNSキャッシュが有効な場合、接続中の名前解決の時間を接続時間から分けて記録する。
+    """
+
+    def record(start):
+        dns_seconds = take_lookup_seconds()
+        metrics.record_connection(time.perf_counter() - start - (dns_seconds or 0.0), dns_seconds)
+
+    class MeteredHTTPConnection(HTTPConnection):
+        def connect(self):
+            take_lookup_seconds()
+            start = time.perf_counter()
+            super().connect()
+            record(start)
+
+    class MeteredHTTPSConnection(HTTPSConnection):
+        def connect(self):
+            take_lookup_seconds()
+            start = time.perf_counter()
+            super().connect()
+            record(start)
+
+    class MeteredHTTPConnectionPool(HTTPConnectionPool):
+        ConnectionCls = MeteredHTTPConnection
+
+    class MeteredHTTPSConnectionPool(HTTPSConnectionPool):
+        ConnectionCls = MeteredHTTPSConnection
+
+    return {'http': MeteredHTTPConnectionPool, 'https': MeteredHTTPSConnectionPool}
+
+
+class MeteredHTTPAdapter(HTTPAdapter):
+    """接続数・リクエスト数を記録するHTTPAdapter"""
+
+    def __init__(self, metrics, *args, **kwargs):
+        self.metrics = metrics
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = metered_pool_classes(self.metrics)
+
+    def send(self, request, *args, **kwargs):
+        self.metrics.record_request()
+        return super().send(request, *args, **kwargs)
+
+
+class PooledSession(requests.Session):
+    """
+    接続プールとリトライを設定したrequests.Session
+
+    同じホストへの接続をkeep-aliveで使い回し、ページごとのTCP・TLSハンドシェイクを省く。
+    リトライ戦略はWebTextCrawlerWithCookies.setup_sessionと同じ。
+    新規接続数・再利用数・接続時間はmetricsで確認できる。
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, max_retries=5, backoff_factor=1,
+                 user_agent=None):
+        """
+        Args:
+            pool_connections: 接続プールを保持するホスト数
+            pool_maxsize: 1ホストあたりに保持する接続数（同時リクエスト数以上にする）
+            max_retries: 失敗時のリトライ回数
+            backoff_factor: リトライ間隔の係数（秒）
+            user_agent: User-Agentヘッダ（Noneの場合はrequestsの既定値）
+        """
+        super().__init__()
+        self.metrics = ConnectionMetrics()
+        retry_strategy = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=[429, 500, 502, 503, 504],
+            # 最後のレスポンスを返させ、429/503のRetry-Afterをスケジューラに渡す
+            raise_on_status=False
+        )
+        adapter = MeteredHTTPAdapter(self.metrics, pool_connections=pool_connections,
+                                     pool_maxsize=pool_maxsize, max_retries=retry_strategy)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        if user_agent:
+            self.headers['User-Agent'] = user_agent
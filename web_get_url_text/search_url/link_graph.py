@@ -0,0 +1,309 @@
+import argparse
+import json
+import mmap
+import re
+import struct
+from array import array
+from pathlib import Path
+
+# CSRファイルの先頭: マジック, ノード数, エッジ数
+CSR_MAGIC = b'LGCSR001'
+CSR_HEADER = struct.Struct('<8sQQ')
+# エッジファイルは(リンク元ID, リンク先ID)のuint32の組を並べたもの
+EDGE_TYPECODE = 'I'
+EDGE_BYTES = array(EDGE_TYPECODE).itemsize * 2
+
+
+def graph_paths(prefix):
+    """グラフを構成するファイル（URL一覧, エッジ一覧, CSR）のパスを返す"""
+    prefix = Path(prefix)
+    return (prefix.with_name(prefix.name + '.urls'),
+            prefix.with_name(prefix.name + '.edges'),
+            prefix.with_name(prefix.name + '.csr'))
+
+
+class LinkGraphRecorder:
+    """
+    取得したページからのリンク（ページ→リンク先）を整数IDのエッジとして記録する
+
+    URLは最初に見つかった順に0からIDを振り、{prefix}.urlsに1行1URLで追記する。
+    エッジは(リンク元ID, リンク先ID)のuint32の組として{prefix}.edgesに追記する。
+    close()の後、build_csr()でリンク元ごとにまとめたCSR形式のファイルを作る。
+    """
+
+    def __init__(self, prefix, canonicalizer=None, flush_edges=100_000):
+        """
+        Args:
+            prefix: 出力ファイルのパスの接頭辞（例: data_url/kosen_graph）
+            canonicalizer: URLの同一判定に使うURLCanonicalizer（Noneの場合は文字列のまま比べる）
+            flush_edges: ファイルに書き出すまでメモリにためるエッジ数
+        """
+        self.prefix = Path(prefix)
+        self.urls_path, self.edges_path, self.csr_path = graph_paths(prefix)
+        self.canonicalizer = canonicalizer
+        self.flush_edges = flush_edges
+        self.ids = {}
+        self.pending_urls = []
+        self.pending_edges = array(EDGE_TYPECODE)
+        self.num_edges = 0
+        self.urls_file = None
+        self.edges_file = None
+
+    def open(self, append=False):
+        """出力ファイルを開く。append=Trueの場合は前回のURLのIDを読み込んで続きから記録する"""
+        self.prefix.parent.mkdir(parents=True, exist_ok=True)
+        if append and self.urls_path.exists() and self.edges_path.exists():
+            with open(self.urls_path, encoding='utf-8') as f:
+                for line in f:
+                    url = line.rstrip('\n')
+                    self.ids[self.key(url)] = len(self.ids)
+            self.num_edges = self.edges_path.stat().st_size // EDGE_BYTES
+            mode = 'a'
+        else:
+            mode = 'w'
+        self.urls_file = open(self.urls_path, mode, encoding='utf-8')
+        self.edges_file = open(self.edges_path, mode + 'b')
+
+    def key(self, url):
+        return self.canonicalizer.key(url) if self.canonicalizer is not None else url
+
+    def node_id(self, url):
+        key = self.key(url)
+        node = self.ids.get(key)
+        if node is None:
+            node = self.ids[key] = len(self.ids)
+            self.pending_urls.append(url)
+        return node
+
+    def record(self, source_url, target_urls):
+        """1ページ分のリンクを記録する（同じリンク先は1本にまとめ、自分自身へのリンクは除く）"""
+        if self.edges_file is None:
+            self.open()
+        source = self.node_id(source_url)
+        targets = {self.node_id(url) for url in target_urls}
+        targets.discard(source)
+        for target in targets:
+            self.pending_edges.append(source)
+            self.pending_edges.append(target)
+        self.num_edges += len(targets)
+        if len(self.pending_edges) >= self.flush_edges * 2:
+            self.flush()
+
+    def flush(self):
+        if self.edges_file is None:
+            return
+        # URLを先に書き出し、エッジファイルに出てくるIDが必ずURL一覧にあるようにする
+        if self.pending_urls:
+            self.urls_file.write(''.join(url + '\n' for url in self.pending_urls))
+            self.urls_file.flush()
+            self.pending_urls = []
+        if self.pending_edges:
+            self.pending_edges.tofile(self.edges_file)
+            self.edges_file.flush()
+            self.pending_edges = array(EDGE_TYPECODE)
+
+    def close(self):
+        self.flush()
+        if self.edges_file is not None:
+            self.urls_file.close()
+            self.edges_file.close()
+            self.urls_file = self.edges_file = None
+
+    @property
+    def num_nodes(self):
+        return len(self.ids)
+
+
+def build_csr(prefix, chunk_edges=1_000_000):
+    """
+    エッジファイルからCSR形式のファイル（{prefix}.csr）を作り、(ノード数, エッジ数)を返す
+
+    CSRファイルはヘッダの後に、ノードごとのリンク先の開始位置（uint64 × ノード数+1）と
+    リンク先ID（uint32 × エッジ数）を並べたもの。エッジファイルを2回読む計数ソートで作るため、
+    メモリはノード数とエッジ数に比例する配列1つずつで済む。
+    """
+    urls_path, edges_path, csr_path = graph_paths(prefix)
+    with open(urls_path, encoding='utf-8') as f:
+        num_nodes = sum(1 for _ in f)
+    num_edges = edges_path.stat().st_size // EDGE_BYTES
+
+    def iter_chunks():
+        with open(edges_path, 'rb') as f:
+            while True:
+                chunk = array(EDGE_TYPECODE)
+                try:
+                    chunk.fromfile(f, chunk_edges * 2)
+                except EOFError:
+                    pass
+                if not chunk:
+                    return
+                yield chunk
+
+    offsets = array('Q', bytes(8 * (num_nodes + 1)))
+    for chunk in iter_chunks():
+        for source in chunk[0::2]:
+            offsets[source + 1] += 1
+    for node in range(num_nodes):
+        offsets[node + 1] += offsets[node]
+
+    targets = array(EDGE_TYPECODE, bytes(array(EDGE_TYPECODE).itemsize * num_edges))
+    position = array('Q', offsets[:-1])
+    for chunk in iter_chunks():
+        for source, target in zip(chunk[0::2], chunk[1::2]):
+            targets[position[source]] = target
+            position[source] += 1
+
+    with open(csr_path, 'wb') as f:
+        f.write(CSR_HEADER.pack(CSR_MAGIC, num_nodes, num_edges))
+        offsets.tofile(f)
+        targets.tofile(f)
+    return num_nodes, num_edges
+
+
+class LinkGraph:
+    """
+    CSR形式のリンクグラフをメモリマップで読むリーダー
+
+    ファイル全体を読み込まず、リンク先の配列をmmapしたまま参照する。
+    """
+
+    def __init__(self, prefix):
+        urls_path, _, csr_path = graph_paths(prefix)
+        self.urls_path = urls_path
+        self.file = open(csr_path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.num_nodes, self.num_edges = CSR_HEADER.unpack_from(self.map, 0)
+        if magic != CSR_MAGIC:
+            raise ValueError(f"CSRファイルではありません: {csr_path}")
+        self.view = memoryview(self.map)
+        start = CSR_HEADER.size
+        end = start + 8 * (self.num_nodes + 1)
+        self.offsets = self.view[start:end].cast('Q')
+        self.targets = self.view[end:end + array(EDGE_TYPECODE).itemsize * self.num_edges].cast(EDGE_TYPECODE)
+        self._urls = None
+
+    @property
+    def urls(self):
+        """ID順のURLの一覧（初回に読み込む）"""
+        if self._urls is None:
+            with open(self.urls_path, encoding='utf-8') as f:
+                self._urls = [line.rstrip('\n') for line in f][:self.num_nodes]
+        return self._urls
+
+    def neighbors(self, node):
+        """ノードのリンク先IDを返す"""
+        return self.targets[self.offsets[node]:self.offsets[node + 1]]
+
+    def out_degree(self, node):
+        return self.offsets[node + 1] - self.offsets[node]
+
+    def in_degree(self):
+        """ノードごとの被リンク数を返す"""
+        degrees = array('I', bytes(4 * self.num_nodes))
+        for target in self.targets:
+            degrees[target] += 1
+        return degrees
+
+    def pagerank(self, damping=0.85, iterations=30, tolerance=1e-6):
+        """
+        PageRankを計算する（合計が1になる値の配列）
+
+        リンクのないページの値は全ページに均等に配る。1回の反復で全エッジを1回ずつたどり、
+        値の変化量の合計がtolerance未満になったら打ち切る。
+        """
+        n = self.num_nodes
+        if n == 0:
+            return array('d')
+        rank = array('d', [1.0 / n]) * n
+        offsets = self.offsets
+        targets = self.targets
+        for _ in range(iterations):
+            contribution = array('d', bytes(8 * n))
+            dangling = 0.0
+            for node in range(n):
+                start, end = offsets[node], offsets[node + 1]
+                if start == end:
+                    dangling += rank[node]
+                    continue
+                share = rank[node] / (end - start)
+                for target in targets[start:end]:
+                    contribution[target] += share
+            base = (1.0 - damping) / n + damping * dangling / n
+            new_rank = array('d', (base + damping * value for value in contribution))
+            delta = sum(abs(a - b) for a, b in zip(new_rank, rank))
+            rank = new_rank
+            if delta < tolerance:
+                break
+        return rank
+
+    def scores(self, method='pagerank'):
+        """'pagerank'または'indegree'のスコアを配列で返す"""
+        if method == 'indegree':
+            return self.in_degree()
+        if method == 'pagerank':
+            return self.pagerank()
+        raise ValueError(f"不明なmethodです: {method} (選択肢: pagerank, indegree)")
+
+    def ranked(self, method='pagerank', pattern=None):
+        """スコアの高い順に(URL, スコア)を返す（patternを指定した場合は一致するURLのみ）"""
+        scores = self.scores(method)
+        regex = re.compile(pattern) if pattern else None
+        urls = self.urls
+        nodes = sorted(range(self.num_nodes), key=lambda node: -scores[node])
+        return [(urls[node], scores[node]) for node in nodes if regex is None or regex.search(urls[node])]
+
+    def link_scores(self, method='pagerank'):
+        """
+        URLScorerのlink_scoresに渡す、URLごとの相対スコア（全ページの平均が1）を返す
+        """
+        scores = self.scores(method)
+        mean = sum(scores) / self.num_nodes if self.num_nodes else 0
+        if not mean:
+            return {}
+        return {url: scores[node] / mean for node, url in enumerate(self.urls) if scores[node]}
+
+    def close(self):
+        self.offsets.release()
+        self.targets.release()
+        self.view.release()
+        self.map.close()
+        self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='URL収集時に記録したリンクグラフのCSR変換・集計・取得順の出力')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='エッジファイルからCSRファイルを作る')
+    build.add_argument('prefix', help='グラフのファイルの接頭辞（例: data_url/kosen_graph）')
+
+    rank = subparsers.add_parser('rank', help='被リンク数・PageRankの高い順のURLをJSONに出力する（テキスト収集の取得順に使う）')
+    rank.add_argument('prefix', help='グラフのファイルの接頭辞（例: data_url/kosen_graph）')
+    rank.add_argument('--method', choices=('pagerank', 'indegree'), default='pagerank', help='スコアの種類')
+    rank.add_argument('--pattern', help='出力するURLの正規表現（例: /work/=/product_id/）')
+    rank.add_argument('--top', type=int, help='出力するURL数の上限')
+    rank.add_argument('--output', '-o', help='出力するJSONファイル（省略時は上位を表示のみ）')
+    rank.add_argument('--build', action='store_true', help='先にCSRファイルを作り直す')
+    args = parser.parse_args()
+
+    if args.command == 'build' or args.build:
+        num_nodes, num_edges = build_csr(args.prefix)
+        print(f"CSRファイルを作成しました: {graph_paths(args.prefix)[2]} (ノード数 {num_nodes:,}, エッジ数 {num_edges:,})")
+    if args.command == 'build':
+        return
+
+    graph = LinkGraph(args.prefix)
+    try:
+        ranked = graph.ranked(args.method, args.pattern)[:args.top]
+    finally:
+        graph.close()
+    for url, score in ranked[:10]:
+        print(f"{score:.6g}\t{url}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump([url for url, _ in ranked], f, ensure_ascii=False, indent=2)
+        print(f"{len(ranked):,}個のURLを保存しました: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,147 @@
 #from search_url import URLScraper
 #from search_all_url import URLScraper
 from search_all_url_cheack import URLScraper
+from url_scorer import URLScorer
+from adaptive_concurrency import AdaptiveConcurrency
+from crawl_metrics import CrawlMetrics
+from near_duplicate import NearDuplicateDetector
+from trap_detector import TrapDetector
+from link_graph import LinkGraph, LinkGraphRecorder
 
 def main():
     # スクレイピングの設定
     base_url = "https://www.numazu-ct.ac.jp/"
+    seed_urls = []  # base_url以外の開始URL（別のドメインも可。例: ["https://www.dlsite.com/", "https://www.dmm.co.jp/"]）
+    allowed_domains = None  # リンクをたどるドメイン（サブドメインを含む。例: ["dlsite.com", "dmm.co.jp"]）。Noneの場合は開始URLのドメインのみ
     file_name = "kosen"
     delay_time = 0.05
     batch_size = 200
     max_pages = None  # None for unlimited, or set a number like 1000
     progress_interval = 10  # 進捗表示の間隔（秒）
     stall_time = 60  # URL増加が止まってから終了するまでの時間（秒）
+    state_file = None  # 中断後に再開するための状態ファイル（例: "data_url/kosen_state.db"）
+    visited_backend = 'exact'  # URL集合の実装: 'exact', 'fingerprint'(省メモリ), 'bloom'(最小メモリ・誤判定あり)
+    discovery_mode = 'links'  # URLの発見方法: 'links', 'sitemap'(sitemapのみ), 'sitemap+links'(sitemapにない区画だけリンクをたどる)
+    parser_backend = 'auto'  # リンク抽出のHTMLパーサー: 'auto', 'selectolax', 'lxml', 'tokenizer', 'strainer', 'bs4'
+    priority_crawl = False  # Trueで深さ・URLパターン・収穫量のスコア順に取得（詳細ページを優先）
+    link_scores_from = None  # priority_crawl=Trueの場合に、前回記録したリンクグラフ（例: "data_url/kosen_graph"）のPageRankの高いページを優先
+    record_link_graph = False  # Trueでページ間のリンクを data_url/{file_name}_graph.* に記録（単一プロセスの場合のみ）
+    prune_near_duplicates = False  # Trueで本文がほぼ同じページ（並び替え・表示切替など）のリンクをたどらない
+    detect_traps = False  # Trueでカレンダー・絞り込み検索・セッションID付きURLなど際限なく増えるURLをたどらない（URLは出力する）
+    trap_template_budget = 10000  # 同じテンプレート（数字を置き換えたURL）のURLを追加する上限（複数プロセスの場合はワーカーごと）
+    frontier_memory_urls = None  # 訪問待ちURLをメモリに置く上限（例: 1_000_000）。超えた分は data_url/{file_name}_frontier/ に書き出す（ドメイン・ワーカーごと）
+    archive_file = None  # 取得したレスポンスを記録するSQLiteファイル（例: "data_url/kosen_archive.db"）
+    replay = False  # Trueでネットワークに接続せず、archive_fileに記録したレスポンスから収集（抽出ルールの調整・速度計測用）
+    dns_cache_ttl = None  # 名前解決の結果をプロセス内で保持する秒数（例: 300）。Noneで無効
+    num_workers = 1  # 2以上でURLをハッシュで振り分けて複数プロセスで収集（state_file・sitemap・メトリクスには非対応）
+    use_async = False  # Trueでasyncioによる同時リクエスト版を使用
+    concurrency = 20  # 同時リクエスト数（use_async=Trueの場合のみ）
+    adaptive_concurrency = True  # Trueで同時リクエスト数をconcurrencyを上限に応答時間・エラーに応じて増減
+    metrics_port = None  # メトリクスを公開するポート（例: 9100。/metricsがPrometheus形式、/metrics.jsonがJSON）
+    metrics_jsonl = None  # メトリクスを定期的に追記するJSONLファイル（例: "data_url/kosen_metrics.jsonl"）
+    metrics_interval = 60  # JSONLへの書き出し間隔（秒）
+    
+    scorer = None
+    if priority_crawl:
+        link_scores = None
+        if link_scores_from:
+            graph = LinkGraph(link_scores_from)
+            link_scores = graph.link_scores()
+            graph.close()
+        scorer = URLScorer(link_scores=link_scores)
+    link_graph = LinkGraphRecorder(f"data_url/{file_name}_graph") if record_link_graph and num_workers <= 1 else None
+    near_duplicate = NearDuplicateDetector() if prune_near_duplicates else None
+    trap_detector = TrapDetector(max_template_urls=trap_template_budget) if detect_traps else None
+    metrics = None
+    if num_workers <= 1 and (metrics_port is not None or metrics_jsonl):
+        metrics = CrawlMetrics()
+        if metrics_port is not None:
+            print(f"メトリクスを公開しています: http://127.0.0.1:{metrics.serve(metrics_port)}/metrics")
+        if metrics_jsonl:
+            metrics.start_dump(metrics_jsonl, metrics_interval)
     
     # スクレイパーの作成と実行
-    scraper = URLScraper(
-        base_url=base_url,
-        file_name=file_name,
-        delay_time=delay_time,
-        batch_size=batch_size,
-        max_pages=max_pages,
-        progress_interval=progress_interval,
-        stall_time=stall_time
-    )
-    scraper.run()
+    if num_workers > 1:
+        from partitioned_url_scraper import PartitionedURLScraper
+        scraper = PartitionedURLScraper(
+            base_url=base_url,
+            file_name=file_name,
+            num_workers=num_workers,
+            delay_time=delay_time,
+            batch_size=batch_size,
+            max_pages=max_pages,
+            progress_interval=progress_interval,
+            stall_time=stall_time,
+            visited_backend=visited_backend,
+            parser_backend=parser_backend,
+            scorer=scorer,
+            near_duplicate=near_duplicate,
+            trap_detector=trap_detector,
+            seed_urls=seed_urls,
+            allowed_domains=allowed_domains,
+            frontier_memory_urls=frontier_memory_urls,
+            archive=archive_file,
+            replay=replay,
+            dns_cache_ttl=dns_cache_ttl
+        )
+    elif use_async:
+        from async_url_scraper import AsyncURLScraper  # aiohttpが必要なため使用時のみ読み込む
+        scraper = AsyncURLScraper(
+            base_url=base_url,
+            file_name=file_name,
+            delay_time=delay_time,
+            batch_size=batch_size,
+            max_pages=max_pages,
+            progress_interval=progress_interval,
+            stall_time=stall_time,
+            state_file=state_file,
+            visited_backend=visited_backend,
+            discovery_mode=discovery_mode,
+            parser_backend=parser_backend,
+            scorer=scorer,
+            metrics=metrics,
+            near_duplicate=near_duplicate,
+            trap_detector=trap_detector,
+            seed_urls=seed_urls,
+            allowed_domains=allowed_domains,
+            link_graph=link_graph,
+            frontier_memory_urls=frontier_memory_urls,
+            archive=archive_file,
+            replay=replay,
+            dns_cache_ttl=dns_cache_ttl,
+            concurrency=concurrency,
+            adaptive_concurrency=AdaptiveConcurrency(max_concurrency=concurrency) if adaptive_concurrency else None
+        )
+    else:
+        scraper = URLScraper(
+            base_url=base_url,
+            file_name=file_name,
+            delay_time=delay_time,
+            batch_size=batch_size,
+            max_pages=max_pages,
+            progress_interval=progress_interval,
+            stall_time=stall_time,
+            state_file=state_file,
+            visited_backend=visited_backend,
+            discovery_mode=discovery_mode,
+            parser_backend=parser_backend,
+            scorer=scorer,
+            metrics=metrics,
+            near_duplicate=near_duplicate,
+            trap_detector=trap_detector,
+            seed_urls=seed_urls,
+            allowed_domains=allowed_domains,
+            link_graph=link_graph,
+            frontier_memory_urls=frontier_memory_urls,
+            archive=archive_file,
+            replay=replay,
+            dns_cache_ttl=dns_cache_ttl
+        )
+    try:
+        scraper.run()
+    finally:
+        if metrics is not None:
+            metrics.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,148 @@
+import re
+from collections import Counter
+
+from html_backends import extract_texts, resolve_backend
+
+# 64ビットの値を8ビットずつ、1ビットあたりLANE_BITSビットの区画に広げるための表
+LANE_BITS = 32
+LANE_MASK = (1 << LANE_BITS) - 1
+SPREAD_TABLE = [
+    sum(((byte >> bit) & 1) << (bit * LANE_BITS) for bit in range(8))
+    for byte in range(256)
+]
+WHITESPACE = re.compile(r'\s+')
+
+
+def spread64(value):
+    """64ビットの各ビットを、LANE_BITSビットずつの区画に1つずつ並べた整数にする"""
+    result = 0
+    for k in range(8):
+        result |= SPREAD_TABLE[(value >> (8 * k)) & 0xFF] << (8 * k * LANE_BITS)
+    return result
+
+
+def shingles(text, size=4):
+    """
+    空白を詰めたテキストの文字size-gramの集合を返す（日本語のように単語の区切りがない文にも使える）
+
+    出現回数は数えない。回数で重み付けすると、一覧ページで繰り返される定型文が
+    SimHashを支配し、載っている商品が違うページまで近似重複と判定してしまうため。
+    """
+    text = WHITESPACE.sub(' ', text).strip()
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def simhash64(features):
+    """
+    特徴量の集合から64ビットのSimHashを計算する
+
+    各特徴量のハッシュをビットごとの区画に広げて足し合わせ、区画ごとの合計が
+    特徴量の数の半分を超えたビットを1にする（ビットごとのループを1回の整数加算にまとめる）。
+    ハッシュにはPythonのhash()を使うため、値は同じプロセスの中でのみ比較できる。
+    """
+    total = 0
+    for feature in features:
+        total += spread64(hash(feature) & 0xFFFFFFFFFFFFFFFF)
+    fingerprint = 0
+    for bit in range(64):
+        if ((total >> (bit * LANE_BITS)) & LANE_MASK) * 2 > len(features):
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+class NearDuplicateDetector:
+    """
+    ページの表示テキストのSimHashで、既に取得したページとほぼ同じページを見つける
+
+    64ビットをmax_distance + 1個の帯に分けて索引を作る。ハミング距離がmax_distance以下の
+    2つの値は少なくとも1つの帯が完全に一致するため、一致した帯の候補だけを比べれば済む。
+    テキストが少ないページ（JavaScriptで描画するページなど）は互いに似てしまうため判定しない。
+    """
+
+    def __init__(self, max_distance=3, shingle_size=4, min_features=16, backend='auto', max_examples=20):
+        """
+        Args:
+            max_distance: 近似重複とみなすSimHashのハミング距離の上限
+            shingle_size: 特徴量にする文字n-gramの長さ
+            min_features: 判定するのに必要な特徴量（n-gram）の種類数
+            backend: テキスト抽出に使うHTMLパーサー
+            max_examples: 元ページごとに記録しておく近似重複ページのURL数
+        """
+        self.max_distance = max_distance
+        self.shingle_size = shingle_size
+        self.min_features = min_features
+        self.backend = resolve_backend(backend, 'texts')
+        self.max_examples = max_examples
+        self.bands = max_distance + 1
+        self.band_bits = 64 // self.bands
+        self.bands_index = [{} for _ in range(self.bands)]
+        self.originals = {}
+        # 元ページごとの近似重複ページ数・省略したリンク数・近似重複ページのURLの例
+        self.pruned = {}
+        self.stats = Counter()
+
+    def fingerprint(self, html):
+        """ページのSimHash（テキストが少なく判定できない場合はNone）"""
+        features = shingles(' '.join(extract_texts(html, self.backend)), self.shingle_size)
+        if len(features) < self.min_features:
+            return None
+        return simhash64(features)
+
+    def band_keys(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        for band in range(self.bands):
+            shift = band * self.band_bits
+            # 最後の帯は割り切れずに残ったビットも含める
+            width_mask = mask if band < self.bands - 1 else (1 << (64 - shift)) - 1
+            yield band, (fingerprint >> shift) & width_mask
+
+    def find(self, fingerprint):
+        """fingerprintとハミング距離max_distance以内の登録済みの値を返す（ない場合はNone）"""
+        if fingerprint in self.originals:
+            return fingerprint
+        for band, key in self.band_keys(fingerprint):
+            for candidate in self.bands_index[band].get(key, ()):
+                if hamming(candidate, fingerprint) <= self.max_distance:
+                    return candidate
+        return None
+
+    def add(self, fingerprint, url):
+        self.originals[fingerprint] = url
+        for band, key in self.band_keys(fingerprint):
+            self.bands_index[band].setdefault(key, []).append(fingerprint)
+
+    def check(self, url, html):
+        """
+        ページが既に取得したページの近似重複なら元ページのURLを返す。
+        そうでなければページを登録してNoneを返す
+        """
+        fingerprint = self.fingerprint(html)
+        if fingerprint is None:
+            self.stats['too_short'] += 1
+            return None
+        match = self.find(fingerprint)
+        if match is None:
+            self.add(fingerprint, url)
+            self.stats['unique'] += 1
+            return None
+        self.stats['near_duplicate'] += 1
+        return self.originals[match]
+
+    def record_pruned(self, original_url, url, pruned_links):
+        """近似重複のため展開しなかったページと、そのページにあった未発見のリンク数を記録する"""
+        entry = self.pruned.setdefault(original_url, {'pages': 0, 'links': 0, 'examples': []})
+        entry['pages'] += 1
+        entry['links'] += pruned_links
+        if len(entry['examples']) < self.max_examples:
+            entry['examples'].append(url)
+        self.stats['pruned_links'] += pruned_links
+
+    def top_pruned(self, limit=10):
+        """近似重複ページの多い元ページから順に(URL, 記録)を返す"""
+        return sorted(self.pruned.items(), key=lambda item: -item[1]['pages'])[:limit]
@@ -0,0 +1,301 @@
+import multiprocessing
+import queue
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from search_all_url_cheack import URLScraper
+from url_canonical import URLCanonicalizer
+from url_sink import write_merged
+from visited_set import fingerprint64
+
+
+# ワーカーごとに共有配列へ書き込む統計情報
+WORKER_STATS = ('processed_pages', 'total_urls', 'error_count', 'http_error_count', 'duplicate_count', 'skipped_pages')
+
+
+def owner_of(url_key, num_workers):
+    """正規化したURLのキーから、そのURLを担当するワーカー番号を求める"""
+    return fingerprint64(url_key) % num_workers
+
+
+class PartitionWorker(URLScraper):
+    """
+    PartitionedURLScraperの1ワーカー（別プロセスで動く）
+
+    担当するURL（キーのハッシュで決まる）の訪問待ちキュー・訪問済み集合だけを持ち、
+    担当外のリンクは担当ワーカーのキューへ送る。
+    """
+
+    def __init__(self, index, num_workers, inboxes, shared, max_total_pages, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.index = index
+        self.num_workers = num_workers
+        self.inboxes = inboxes
+        self.inbox = inboxes[index]
+        self.shared = shared
+        self.max_total_pages = max_total_pages
+        self.outgoing = [[] for _ in range(num_workers)]
+        # 担当ワーカーへ送ったURLのキー（同じリンクを見つけるたびに送り直さない）
+        self.sent_urls = self.make_url_set()
+        self.sink_path = self.data_dir / f"{self.file_name}.part{index}.jsonl{'.zst' if self.output_compress else ''}"
+        self.frontier_spill_dir = self.frontier_spill_dir.with_name(f"{self.frontier_spill_dir.name}.part{index}")
+
+    def start_urls(self):
+        # 開始URLは担当ワーカーだけが訪問する
+        return [url for url in super().start_urls()
+                if owner_of(self.canonicalizer.key(url), self.num_workers) == self.index]
+
+    def add_url(self, absolute_url, follow=None, depth=0):
+        """担当するURLは自分のキューへ、担当外のURLは担当ワーカーへの送信待ちに追加する"""
+        key = self.canonicalizer.key(absolute_url)
+        owner = owner_of(key, self.num_workers)
+        if owner == self.index:
+            return super().add_url(absolute_url, follow, depth)
+        if key in self.sent_urls:
+            self.stats['duplicate_count'] += 1
+            return False
+        self.sent_urls.add(key)
+        self.outgoing[owner].append((absolute_url, depth))
+        return True
+
+    def flush_outgoing(self):
+        """送信待ちのURLを担当ワーカーごとに1メッセージにまとめて送る"""
+        for owner, urls in enumerate(self.outgoing):
+            if not urls:
+                continue
+            with self.shared['lock']:
+                self.shared['in_flight'].value += 1
+            self.inboxes[owner].put(urls)
+            self.outgoing[owner] = []
+
+    def receive(self, timeout):
+        """他のワーカーから届いたURLを取り込む。1件でも受け取ればTrueを返す"""
+        received = False
+        while True:
+            try:
+                urls = self.inbox.get(timeout=timeout) if timeout and not received else self.inbox.get_nowait()
+            except queue.Empty:
+                return received
+            # 処理中の扱いにしてから未処理メッセージ数を減らし、終了判定の取りこぼしを防ぐ
+            self.set_idle(False)
+            for url, depth in urls:
+                super().add_url(url, depth=depth)
+            with self.shared['lock']:
+                self.shared['in_flight'].value -= 1
+            received = True
+
+    def set_idle(self, idle):
+        with self.shared['lock']:
+            self.shared['idle'][self.index] = 1 if idle else 0
+
+    def take_page(self):
+        """全ワーカー合計のページ数上限の枠を1つ取る（上限に達した場合はFalse）"""
+        with self.shared['lock']:
+            if self.max_total_pages and self.shared['pages_started'].value >= self.max_total_pages:
+                return False
+            self.shared['pages_started'].value += 1
+            return True
+
+    def publish_stats(self):
+        offset = self.index * len(WORKER_STATS)
+        for i, name in enumerate(WORKER_STATS):
+            self.shared['stats'][offset + i] = self.stats[name]
+
+    def run_partition(self):
+        stop = self.shared['stop']
+        self.stats['start_time'] = time.time()
+        self.init_state()
+
+        while not stop.is_set():
+            if not self.urls_to_visit:
+                self.flush_outgoing()
+                if not self.receive(timeout=0):
+                    self.set_idle(True)
+                    self.receive(timeout=0.05)
+                continue
+
+            self.receive(timeout=0)
+            current_url = self.pop_next_url()
+            if current_url is None:
+                continue
+            if not self.take_page():
+                # 上限に達したら新しいページは取得せず、終了の合図を待つ
+                self.urls_to_visit = self.make_frontier()
+                continue
+            self.fetch_and_handle(current_url)
+            self.flush_outgoing()
+            self.publish_stats()
+
+        self.publish_stats()
+        self.finish_collection()
+        # 終了時に読まれずに残ったメッセージがあってもプロセスを終了できるようにする
+        for inbox in self.inboxes:
+            inbox.cancel_join_thread()
+
+
+def run_worker(index, num_workers, inboxes, shared, max_total_pages, args, kwargs):
+    worker = PartitionWorker(index, num_workers, inboxes, shared, max_total_pages, *args, **kwargs)
+    worker.run_partition()
+
+
+class PartitionedURLScraper:
+    """
+    URLをハッシュでnum_workers個のプロセスに振り分けて収集するスクレイパー
+
+    各URLは正規化したキーのハッシュで担当ワーカーが決まり、訪問済み集合も担当ワーカーだけが持つ。
+    見つけたリンクはページごとにまとめて担当ワーカーのキューへ送る。HTMLの解析がプロセスごとに
+    並列に行われるため、GILに縛られずコア数に応じて処理速度が伸びる。
+    出力は各ワーカーの{file_name}.part{i}.jsonlを最後に{file_name}_merged.jsonへまとめる。
+
+    全ワーカー合計でのリクエスト間隔がdelay_timeになるよう、各ワーカーの間隔はdelay_time×num_workersとする。
+    state_fileによる再開とsitemapからの発見、metricsによるメトリクスの公開、link_graphによるリンクの記録には対応しない。
+    """
+
+    def __init__(self, base_url, file_name, num_workers=None, delay_time=0.5, max_pages=None,
+                 progress_interval=60, stall_time=300, canonicalizer=None, **scraper_kwargs):
+        """
+        Args:
+            num_workers: ワーカープロセス数（Noneの場合はCPUコア数）
+            scraper_kwargs: 各ワーカーのURLScraperに渡す引数（プロセス間で受け渡せる値のみ）
+            その他の引数はURLScraperと同じ
+        """
+        for name in ('state_file', 'discovery_mode', 'scheduler', 'fetch_guard', 'metrics', 'link_graph'):
+            if scraper_kwargs.get(name) not in (None, 'links'):
+                raise ValueError(f"PartitionedURLScraperでは{name}を指定できません")
+        self.canonicalizer = canonicalizer or URLCanonicalizer()
+        self.base_url = base_url
+        self.file_name = file_name
+        self.num_workers = num_workers or multiprocessing.cpu_count()
+        self.delay_time = delay_time
+        self.max_pages = max_pages
+        self.progress_interval = progress_interval
+        self.stall_time = stall_time
+        self.scraper_kwargs = scraper_kwargs
+        self.data_dir = Path('data_url')
+        self.data_dir.mkdir(exist_ok=True)
+        self.stats = {name: 0 for name in WORKER_STATS}
+
+    def create_shared(self, context):
+        return {
+            'lock': context.Lock(),
+            'stop': context.Event(),
+            'in_flight': context.Value('q', 0, lock=False),
+            'pages_started': context.Value('q', 0, lock=False),
+            'idle': context.Array('b', self.num_workers, lock=False),
+            'stats': context.Array('q', self.num_workers * len(WORKER_STATS), lock=False),
+        }
+
+    def is_finished(self, shared):
+        """全ワーカーが待機中で、未処理のメッセージもなければ収集完了"""
+        with shared['lock']:
+            return shared['in_flight'].value == 0 and all(shared['idle'])
+
+    def collect_stats(self, shared):
+        values = list(shared['stats'])
+        width = len(WORKER_STATS)
+        for i, name in enumerate(WORKER_STATS):
+            self.stats[name] = sum(values[w * width + i] for w in range(self.num_workers))
+        return [values[w * width:(w + 1) * width] for w in range(self.num_workers)]
+
+    def print_progress(self, shared, start_time):
+        per_worker = self.collect_stats(shared)
+        elapsed_time = time.time() - start_time
+        pages_per_sec = self.stats['processed_pages'] / elapsed_time if elapsed_time > 0 else 0
+
+        print("\n" + "="*50)
+        print(f"進捗状況 ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')})")
+        print(f"収集したURL数: {self.stats['total_urls']:,}")
+        print(f"検出した重複URL数: {self.stats['duplicate_count']:,}")
+        print(f"処理したページ数: {self.stats['processed_pages']:,} ({pages_per_sec:.1f}ページ/秒)")
+        print(f"スキップしたページ数: {self.stats['skipped_pages']:,}")
+        print(f"エラー数: {self.stats['error_count']}")
+        print(f"エラー応答数（4xx/5xx）: {self.stats['http_error_count']:,}")
+        print(f"ワーカーごとの処理ページ数: {', '.join(f'{values[0]:,}' for values in per_worker)}")
+        print(f"未処理のメッセージ数: {shared['in_flight'].value:,}")
+        print("="*50 + "\n")
+        sys.stdout.flush()
+
+    def collect_urls(self):
+        context = multiprocessing.get_context()
+        shared = self.create_shared(context)
+        inboxes = [context.Queue() for _ in range(self.num_workers)]
+        kwargs = dict(self.scraper_kwargs,
+                      delay_time=self.delay_time * self.num_workers,
+                      canonicalizer=self.canonicalizer,
+                      stall_time=None,
+                      write_merged=False,
+                      progress_interval=float('inf'))
+
+        start_time = time.time()
+        print(f"収集を開始します: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+        domains = self.scraper_kwargs.get('allowed_domains') or \
+            sorted({self.canonicalizer.domain(url) for url in [self.base_url, *(self.scraper_kwargs.get('seed_urls') or ())]})
+        print(f"対象ドメイン: {', '.join(domains)}")
+        print(f"ワーカー数: {self.num_workers}")
+        print(f"ワーカーごとのリクエスト間隔: {kwargs['delay_time']}秒")
+
+        workers = [
+            context.Process(target=run_worker,
+                            args=(i, self.num_workers, inboxes, shared, self.max_pages,
+                                  (self.base_url, self.file_name), kwargs))
+            for i in range(self.num_workers)
+        ]
+        for worker in workers:
+            worker.start()
+
+        last_progress = last_increase = time.time()
+        last_total = 0
+        try:
+            while True:
+                time.sleep(0.2)
+                if self.is_finished(shared):
+                    break
+                if any(worker.exitcode not in (None, 0) for worker in workers):
+                    print("\nワーカーが異常終了したため、収集を終了します。")
+                    break
+
+                self.collect_stats(shared)
+                now = time.time()
+                if self.max_pages and self.stats['processed_pages'] + self.stats['error_count'] >= self.max_pages:
+                    print("\n最大ページ数に到達しました。収集を終了します。")
+                    break
+                if self.stats['total_urls'] > last_total:
+                    last_total = self.stats['total_urls']
+                    last_increase = now
+                elif self.stall_time and now - last_increase >= self.stall_time:
+                    print(f"\nURL数が{int(now - last_increase)}秒間増加していないため、収集を終了します。")
+                    break
+                if now - last_progress >= self.progress_interval:
+                    self.print_progress(shared, start_time)
+                    last_progress = now
+        except KeyboardInterrupt:
+            print("\n中断しました。収集済みのURLを保存します。")
+        finally:
+            shared['stop'].set()
+            for worker in workers:
+                worker.join()
+
+        self.print_progress(shared, start_time)
+        return self.merge_json_files()
+
+    def part_paths(self):
+        suffix = '.zst' if self.scraper_kwargs.get('output_compress') else ''
+        return [self.data_dir / f"{self.file_name}.part{i}.jsonl{suffix}" for i in range(self.num_workers)]
+
+    def merge_json_files(self):
+        """各ワーカーの出力ファイルをまとめ、重複を除去したJSON配列のマージファイルを作成する"""
+        merged_file_path = self.data_dir / f"{self.file_name}_merged.json"
+        unique_count, final_duplicates = write_merged(self.part_paths(), merged_file_path)
+        if final_duplicates > 0:
+            print(f"\n最終チェックで{final_duplicates}個の重複を検出し、除去しました。")
+
+        print(f"マージされたファイルに保存しました: {merged_file_path}")
+        print(f"最終的なユニークURL数: {unique_count:,}")
+
+        return unique_count
+
+    def run(self):
+        """URL収集を開始するためのメソッド"""
+        self.collect_urls()
@@ -0,0 +1,396 @@
+import io
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter, namedtuple
+from pathlib import Path
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers, requote_uri
+
+# 本文は展開して保存するため、転送方法に関するヘッダは記録しない
+DROPPED_HEADERS = {'content-encoding', 'transfer-encoding', 'connection', 'keep-alive'}
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 10
+
+ArchivedResponse = namedtuple('ArchivedResponse', ['url', 'status', 'headers', 'body'])
+
+
+def charset_of(content_type):
+    """Content-Typeヘッダのcharsetを返す（指定がない場合はNone）"""
+    for param in (content_type or '').split(';')[1:]:
+        name, _, value = param.strip().partition('=')
+        if name.strip().lower() == 'charset':
+            return value.strip('"\' ') or None
+    return None
+
+
+class ResponseArchive:
+    """
+    取得したレスポンス（ステータス・ヘッダ・本文）を(URL, メソッド)ごとにSQLiteへ保存するアーカイブ
+
+    本文は展開した状態でzlib圧縮して保存する。途中で取得を打ち切った本文は読んだところまでを保存し、
+    同じURLを再度記録した場合は新しいレスポンスで上書きする（本文のない304は記録しない）。
+    記録はメモリにためておき、commit_every件ごとに1トランザクションでまとめて書き込む
+    （書き込みのロックを短く保ち、同じファイルを開いた他のプロセスを待たせない）。
+    複数のスレッドから共有でき、複数のプロセスからは同じファイルをそれぞれ開いて使う。
+    """
+
+    def __init__(self, path, commit_every=100):
+        """
+        Args:
+            path: SQLiteファイルのパス
+            commit_every: 何件記録するごとにディスクへ書き込むか
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.commit_every = max(1, commit_every)
+        self.pending = []
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False, timeout=60)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT NOT NULL,
+                method TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                body BLOB NOT NULL,
+                fetched_at REAL NOT NULL,
+                PRIMARY KEY (url, method)
+            )
+        ''')
+        self.conn.commit()
+        self.stats = Counter()
+
+    @staticmethod
+    def key(url):
+        # requestsとaiohttpで同じURLが同じキーになるよう、エスケープの表記を揃える
+        return requote_uri(url)
+
+    def record(self, url, method, status, headers, body):
+        """
+        レスポンスを記録する
+
+        Args:
+            url: リクエストしたURL
+            method: 'GET'または'HEAD'
+            status: ステータスコード
+            headers: (名前, 値)の組の列
+            body: 展開済みの本文（bytes）
+        """
+        if status == 304:
+            return
+        headers = [[name, value] for name, value in headers if name.lower() not in DROPPED_HEADERS]
+        row = (self.key(url), method.upper(), status, json.dumps(headers, ensure_ascii=False),
+               zlib.compress(bytes(body)), time.time())
+        with self.lock:
+            self.pending.append(row)
+            self.stats['recorded'] += 1
+            if len(self.pending) >= self.commit_every:
+                self.flush()
+
+    def flush(self):
+        """ためておいた記録を書き込む（self.lockを取得した状態で呼ぶ）"""
+        if self.pending:
+            with self.conn:
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO responses (url, method, status, headers, body, fetched_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', self.pending
+                )
+            self.pending = []
+
+    def lookup(self, url, method='GET'):
+        """記録したレスポンスを返す（ない場合はNone）。HEADの記録がない場合はGETのステータスとヘッダを返す"""
+        method = method.upper()
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT status, headers, body FROM responses WHERE url = ? AND method IN (?, ?) '
+                'ORDER BY method = ? DESC LIMIT 1',
+                (self.key(url), method, 'GET', method)
+            ).fetchone()
+            self.stats['misses' if row is None else 'hits'] += 1
+        if row is None:
+            return None
+        status, headers, body = row
+        body = b'' if method == 'HEAD' else zlib.decompress(body)
+        return ArchivedResponse(url, status, [tuple(pair) for pair in json.loads(headers)], body)
+
+    def lookup_following(self, url, method='GET'):
+        """リダイレクトを記録どおりにたどり、最後のレスポンスを返す（途中の記録がない場合はNone）"""
+        for _ in range(MAX_REDIRECTS + 1):
+            archived = self.lookup(url, method)
+            if archived is None or archived.status not in REDIRECT_STATUSES:
+                return archived
+            location = dict((name.lower(), value) for name, value in archived.headers).get('location')
+            if not location:
+                return archived
+            url = urljoin(url, location)
+            if archived.status == 303:
+                method = 'GET'
+        return archived
+
+    def __len__(self):
+        with self.lock:
+            self.flush()
+            return self.conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def summary(self):
+        """記録した件数・見つかった件数・見つからなかった件数を返す"""
+        with self.lock:
+            return {name: self.stats[name] for name in ('recorded', 'hits', 'misses')}
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.conn.close()
+
+
+class RecordingBody:
+    """
+    urllib3のレスポンスを包み、読み出した本文をためておいて、読み終えたか閉じた時点でアーカイブに記録する
+
+    requestsは本文をraw.stream()で読むため、FetchGuardの逐次読み込み・打ち切りはそのまま働く。
+    """
+
+    def __init__(self, raw, archive, url, method, status, headers):
+        self.raw = raw
+        self.archive = archive
+        self.url = url
+        self.method = method
+        self.status = status
+        self.headers = headers
+        self.chunks = []
+        self.recorded = False
+
+    def stream(self, amt=2 ** 16, decode_content=None):
+        for chunk in self.raw.stream(amt, decode_content=decode_content):
+            self.chunks.append(chunk)
+            yield chunk
+        self.finish()
+
+    def finish(self):
+        if not self.recorded:
+            self.recorded = True
+            self.archive.record(self.url, self.method, self.status, self.headers, b''.join(self.chunks))
+
+    def close(self):
+        self.finish()
+        self.raw.close()
+
+    def release_conn(self):
+        self.finish()
+        self.raw.release_conn()
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+
+class RecordingAdapter(BaseAdapter):
+    """ほかのアダプター（HTTPAdapterなど）を包み、受け取ったレスポンスをアーカイブに記録するアダプター"""
+
+    def __init__(self, adapter, archive):
+        super().__init__()
+        self.adapter = adapter
+        self.archive = archive
+
+    def send(self, request, **kwargs):
+        response = self.adapter.send(request, **kwargs)
+        response.raw = RecordingBody(response.raw, self.archive, request.url, request.method,
+                                     response.status_code, list(response.headers.items()))
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+def record_session(session, archive):
+    """requests.Sessionに登録済みのアダプターを包み、以降のレスポンスをアーカイブに記録するようにする"""
+    for prefix, adapter in list(session.adapters.items()):
+        if not isinstance(adapter, RecordingAdapter):
+            session.mount(prefix, RecordingAdapter(adapter, archive))
+    return session
+
+
+class ReplayAdapter(BaseAdapter):
+    """ネットワークに接続せず、アーカイブに記録したレスポンスを返すアダプター（記録がないURLは404を返す）"""
+
+    def __init__(self, archive):
+        super().__init__()
+        self.archive = archive
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        archived = self.archive.lookup(request.url, request.method)
+        response = requests.Response()
+        response.request = request
+        response.url = request.url
+        if archived is None:
+            response.status_code = 404
+            response.reason = 'Not In Archive'
+            headers, body = [], b''
+        else:
+            response.status_code = archived.status
+            headers, body = archived.headers, archived.body
+        response.headers = CaseInsensitiveDict(headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = io.BytesIO(body)
+        response._content = body
+        response._content_consumed = True
+        return response
+
+    def close(self):
+        pass
+
+
+class ReplaySession(requests.Session):
+    """ネットワークに接続せず、アーカイブに記録したレスポンスを返すrequests.Session"""
+
+    def __init__(self, archive):
+        super().__init__()
+        self.archive = archive
+        adapter = ReplayAdapter(archive)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+
+class ReplayStream:
+    """aiohttpのStreamReaderの代わりに、記録した本文を返す"""
+
+    def __init__(self, body):
+        self.body = body
+
+    async def iter_chunked(self, size):
+        for start in range(0, len(self.body), size):
+            yield self.body[start:start + size]
+
+    async def read(self):
+        return self.body
+
+
+class ReplayClientResponse:
+    """ReplayClientSessionが返すレスポンス（AsyncURLScraperが使う属性のみ）"""
+
+    def __init__(self, url, archived):
+        self.url = url
+        if archived is None:
+            self.status, headers, body = 404, [], b''
+        else:
+            self.status, headers, body = archived.status, archived.headers, archived.body
+        self.headers = CaseInsensitiveDict(headers)
+        self.charset = charset_of(self.headers.get('Content-Type'))
+        self.content = ReplayStream(body)
+
+    def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class ReplayClientSession:
+    """
+    aiohttp.ClientSessionの代わりに、アーカイブに記録したレスポンスを返すセッション（get・headのみ）
+
+    待ち合わせが発生しないため、同時に投入したリクエストは投入順に完了する。
+    """
+
+    def __init__(self, archive):
+        self.archive = archive
+
+    def get(self, url, allow_redirects=True, **kwargs):
+        return self.request('GET', url, allow_redirects)
+
+    def head(self, url, allow_redirects=False, **kwargs):
+        return self.request('HEAD', url, allow_redirects)
+
+    def request(self, method, url, allow_redirects=True):
+        if allow_redirects:
+            archived = self.archive.lookup_following(url, method)
+        else:
+            archived = self.archive.lookup(url, method)
+        return ReplayClientResponse(url, archived)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+class RecordingStream:
+    """aiohttpのStreamReaderを包み、iter_chunkedで読んだ本文をためておく"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.body = bytearray()
+
+    async def iter_chunked(self, size):
+        async for chunk in self.stream.iter_chunked(size):
+            self.body.extend(chunk)
+            yield chunk
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+class RecordingClientResponse:
+    """aiohttpのレスポンスを包み、本文をRecordingStreamから読ませる"""
+
+    def __init__(self, response):
+        self.response = response
+        self.content = RecordingStream(response.content)
+
+    def __getattr__(self, name):
+        return getattr(self.response, name)
+
+
+class RecordingRequest:
+    """aiohttpのリクエストのコンテキストマネージャーを包み、抜けるときにレスポンスを記録する"""
+
+    def __init__(self, request, archive, url, method):
+        self.request = request
+        self.archive = archive
+        self.url = url
+        self.method = method
+        self.response = None
+
+    async def __aenter__(self):
+        self.response = RecordingClientResponse(await self.request.__aenter__())
+        return self.response
+
+    async def __aexit__(self, *exc_info):
+        response = self.response
+        # 途中で打ち切った場合も、読んだところまでの本文を記録する（リダイレクト後の最後のレスポンスをURLに対応づける）
+        self.archive.record(self.url, self.method, response.status, list(response.headers.items()),
+                            bytes(response.content.body))
+        return await self.request.__aexit__(*exc_info)
+
+
+class RecordingClientSession:
+    """aiohttp.ClientSessionを包み、受け取ったレスポンスをアーカイブに記録するセッション"""
+
+    def __init__(self, session, archive):
+        self.session = session
+        self.archive = archive
+
+    def get(self, url, **kwargs):
+        return RecordingRequest(self.session.get(url, **kwargs), self.archive, url, 'GET')
+
+    def head(self, url, **kwargs):
+        return RecordingRequest(self.session.head(url, **kwargs), self.archive, url, 'HEAD')
+
+    async def __aenter__(self):
+        await self.session.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return await self.session.__aexit__(*exc_info)
@@ -1,24 +1,29 @@
 import requests
-from bs4 import BeautifulSoup
 import json
 from urllib.parse import urljoin, urlparse
 import time
 from pathlib import Path
 from datetime import datetime
 import sys
+from url_frontier import URLFrontier
+from url_canonical import URLCanonicalizer
+from html_backends import extract_links, resolve_backend
 
 class URLScraper:
     def __init__(self, base_url, file_name, delay_time=0.5, batch_size=5000, max_pages=None, 
-                 progress_interval=60, stall_time=300):
-        self.base_url = base_url
+                 progress_interval=60, stall_time=300, canonicalizer=None,
+                 parser_backend='auto'):
+        self.canonicalizer = canonicalizer or URLCanonicalizer()
+        self.base_url = self.canonicalizer(base_url)
         self.file_name = file_name
         self.delay_time = delay_time
         self.batch_size = batch_size
         self.max_pages = max_pages
         self.progress_interval = progress_interval
         self.stall_time = stall_time
-        self.base_domain = urlparse(base_url).netloc
+        self.base_domain = self.canonicalizer.domain(base_url)
         self.batch_count = 0
+        self.parser_backend = resolve_backend(parser_backend, 'links')
         
         self.stats = {
             'start_time': None,
@@ -27,7 +32,8 @@ class URLScraper:
             'last_url_count': 0,
             'total_urls': 0,
             'processed_pages': 0,
-            'error_count': 0
+            'error_count': 0,
+            'http_error_count': 0
         }
         
         self.data_dir = Path('data_url')
@@ -71,6 +77,7 @@ class URLScraper:
             print(f"収集したURL数: {self.stats['total_urls']:,}")
             print(f"処理したページ数: {self.stats['processed_pages']:,}")
             print(f"エラー数: {self.stats['error_count']}")
+            print(f"エラー応答数（4xx/5xx）: {self.stats['http_error_count']:,}")
             print(f"経過時間: {elapsed_str}")
             print(f"収集速度: {urls_per_hour:.1f} URLs/時")
             print(f"最後のURL増加から: {time_since_last_increase}")
@@ -85,7 +92,7 @@ class URLScraper:
 
     def collect_urls(self):
         collected_urls = []
-        urls_to_visit = [self.base_url]
+        urls_to_visit = URLFrontier([self.base_url])
         visited_urls = set()
         
         self.stats['start_time'] = time.time()
@@ -109,26 +116,28 @@ class URLScraper:
             if self.check_stall_condition():
                 break
             
-            current_url = urls_to_visit.pop(0)
-            if current_url in visited_urls:
+            current_url = urls_to_visit.pop()
+            current_key = self.canonicalizer.key(current_url)
+            if current_key in visited_urls:
                 continue
             
             try:
                 time.sleep(self.delay_time)
                 
                 response = requests.get(current_url)
-                visited_urls.add(current_url)
+                visited_urls.add(current_key)
                 self.stats['processed_pages'] += 1
+                if response.status_code >= 400:
+                    self.stats['http_error_count'] += 1
                 
                 if response.status_code == 200:
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    for link in soup.find_all('a', href=True):
-                        href = link['href']
-                        absolute_url = urljoin(current_url, href)
+                    for href in extract_links(response.text, self.parser_backend):
+                        absolute_url = self.canonicalizer(urljoin(current_url, href))
+                        url_key = self.canonicalizer.key(absolute_url)
                         
                         if urlparse(absolute_url).netloc == self.base_domain:
-                            if absolute_url not in visited_urls and absolute_url not in urls_to_visit:
-                                urls_to_visit.append(absolute_url)
+                            if url_key not in visited_urls and absolute_url not in urls_to_visit:
+                                urls_to_visit.push(absolute_url)
                                 collected_urls.append(absolute_url)
                                 self.stats['total_urls'] += 1
                                 
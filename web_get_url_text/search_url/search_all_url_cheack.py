@@ -1,27 +1,108 @@
-import requests
-from bs4 import BeautifulSoup
-import json
 from urllib.parse import urljoin, urlparse
+from fnmatch import fnmatch
+from collections import Counter
+import shutil
 import time
 from pathlib import Path
 from datetime import datetime
 import sys
+from url_frontier import URLFrontier, PriorityURLFrontier, MultiDomainFrontier, SpillingURLFrontier
+from url_canonical import URLCanonicalizer
+from frontier_store import FrontierStore
+from host_scheduler import HostScheduler
+from visited_set import make_url_set
+from url_sink import URLSink, write_merged
+from sitemap_seeder import SitemapSeeder
+from html_backends import extract_links, resolve_backend
+from fetch_guard import FetchGuard, ContentSkipped
+from http_pool import PooledSession
+from link_graph import build_csr
+from replay_transport import ResponseArchive, ReplaySession, record_session
+from dns_cache import install_dns_cache
+
+DISCOVERY_MODES = ('links', 'sitemap', 'sitemap+links')
+
+# state_fileに保存して再開時に引き継ぐ統計情報
+PERSISTED_STATS = ('total_urls', 'processed_pages', 'error_count', 'http_error_count', 'duplicate_count',
+                   'skipped_pages', 'target_urls', 'near_duplicate_pages', 'pruned_links', 'trap_urls')
+
 
 class URLScraper:
     def __init__(self, base_url, file_name, delay_time=0.5, batch_size=5000, max_pages=None, 
-                 progress_interval=60, stall_time=300):
-        self.base_url = base_url
+                 progress_interval=60, stall_time=300, canonicalizer=None,
+                 state_file=None, checkpoint_interval=1, scheduler=None,
+                 visited_backend='exact', visited_capacity=1_000_000, visited_error_rate=0.001,
+                 output_compress=False, fsync_every=1, write_merged=True,
+                 discovery_mode='links', sitemap_urls=None, sitemap_lastmod_since=None,
+                 parser_backend='auto', fetch_guard=None,
+                 session=None, pool_maxsize=10, max_retries=5, request_timeout=30, scorer=None,
+                 metrics=None, near_duplicate=None, trap_detector=None, seed_urls=None, allowed_domains=None,
+                 link_graph=None, frontier_memory_urls=None, frontier_spill_dir=None, archive=None, replay=False,
+                 dns_cache_ttl=None):
+        self.canonicalizer = canonicalizer or URLCanonicalizer()
+        self.base_url = self.canonicalizer(base_url)
         self.file_name = file_name
         self.delay_time = delay_time
         self.batch_size = batch_size
         self.max_pages = max_pages
         self.progress_interval = progress_interval
         self.stall_time = stall_time
-        self.base_domain = urlparse(base_url).netloc
+        self.base_domain = self.canonicalizer.domain(base_url)
+        # 開始URL（base_urlとseed_urls）と、リンクをたどるドメインのパターン（Noneの場合は開始URLのドメインのみ）
+        self.seed_urls = list(dict.fromkeys([self.base_url, *(self.canonicalizer(url) for url in seed_urls or ())]))
+        self.seed_domains = {self.canonicalizer.domain(url) for url in self.seed_urls}
+        self.allowed_domains = [pattern.lower() for pattern in allowed_domains] if allowed_domains else None
+        # 複数のドメインを収集する場合は、ドメインごとのキューを送信可能になった順に回す
+        self.multi_domain = len(self.seed_domains) > 1 or self.allowed_domains is not None
         self.batch_count = 0
+        # リンク抽出に使うHTMLパーサー（'auto'の場合は利用できる最速のもの）
+        self.parser_backend = resolve_backend(parser_backend, 'links')
+        
+        # 取得したレスポンスを記録するアーカイブ（SQLiteファイルのパス）。replay=Trueの場合はネットワークに
+        # 接続せず、アーカイブに記録したレスポンスで収集する（リクエスト間隔・robots.txt・Retry-Afterは無視する）
+        if replay and not archive:
+            raise ValueError("replay=Trueの場合はarchiveを指定してください")
+        self.archive = ResponseArchive(archive) if archive else None
+        self.replay = replay
+        
+        # プロセス全体のDNSキャッシュ（結果を保持する秒数。Noneの場合は使わない）。開始URLのホストは先に解決しておく
+        self.dns_cache = None
+        if dns_cache_ttl and not replay:
+            self.dns_cache = install_dns_cache(ttl=dns_cache_ttl)
+            self.dns_cache.prefetch(urlparse(url).hostname for url in self.seed_urls)
+        
+        # HTML以外・巨大な本文をダウンロードせずに打ち切るフィルタ
+        self.fetch_guard = fetch_guard or FetchGuard()
+        
+        # keep-aliveで接続を使い回すHTTPクライアント（リトライ戦略はテキスト収集側と同じ）
+        if session is None:
+            session = ReplaySession(self.archive) if replay else \
+                PooledSession(pool_maxsize=pool_maxsize, max_retries=max_retries)
+        if self.archive is not None and not replay:
+            record_session(session, self.archive)
+        self.session = session
+        self.connection_metrics = getattr(self.session, 'metrics', None)
+        self.request_timeout = request_timeout
+        # ホストごとのリクエスト間隔を管理するスケジューラ（複数のクローラーで共有可能）。robots.txtはページと同じUser-Agentで取得する
+        if scheduler is None and replay:
+            scheduler = HostScheduler(default_delay=0, respect_robots=False, respect_retry_after=False)
+        self.scheduler = scheduler or HostScheduler(default_delay=delay_time,
+                                                    user_agent=self.session.headers.get('User-Agent', '*'))
+        # 同時リクエスト数を応答に応じて調整するコントローラ（同時リクエストを行うAsyncURLScraperで設定する）
+        self.adaptive_concurrency = None
+        
+        # 中断後の再開用に状態を保存するSQLiteファイル（Noneの場合は保存しない）
+        self.state_file = state_file
+        self.checkpoint_interval = checkpoint_interval
+        self.store = None
+        
+        # 訪問済み・発見済みURL集合の実装（'exact', 'fingerprint', 'bloom'）
+        self.visited_backend = visited_backend
+        self.visited_capacity = visited_capacity
+        self.visited_error_rate = visited_error_rate
         
         # 全バッチで見つかったURLを追跡するセット
-        self.all_discovered_urls = set()
+        self.all_discovered_urls = self.make_url_set()
         
         self.stats = {
             'start_time': None,
@@ -31,11 +112,59 @@ class URLScraper:
             'total_urls': 0,
             'processed_pages': 0,
             'error_count': 0,
-            'duplicate_count': 0
+            # 処理したページのうち4xx/5xxの応答（リトライ後の最終的な応答）
+            'http_error_count': 0,
+            'duplicate_count': 0,
+            'skipped_pages': 0,
+            'target_urls': 0,
+            'near_duplicate_pages': 0,
+            'pruned_links': 0,
+            'trap_urls': 0
         }
         
         self.data_dir = Path('data_url')
         self.data_dir.mkdir(exist_ok=True)
+        
+        # 訪問待ちキューをメモリに置くURL数の上限（Noneの場合は無制限）。超えた分はfrontier_spill_dirに書き出す
+        self.frontier_memory_urls = frontier_memory_urls
+        self.frontier_spill_dir = Path(frontier_spill_dir) if frontier_spill_dir else \
+            self.data_dir / f"{self.file_name}_frontier"
+        self.frontier_stats = Counter()
+        
+        # 収集したURLは1行1URLのJSONLファイルに追記していく（output_compress=Trueでzstd圧縮）
+        self.output_compress = output_compress
+        self.fsync_every = fsync_every
+        self.write_merged = write_merged
+        self.sink_path = self.data_dir / f"{self.file_name}.jsonl{'.zst' if output_compress else ''}"
+        self.sink = None
+        
+        # URLの発見方法（'links': リンクをたどる, 'sitemap': sitemapのみ, 'sitemap+links': sitemapにない区画だけリンクをたどる）
+        if discovery_mode not in DISCOVERY_MODES:
+            raise ValueError(f"不明なdiscovery_modeです: {discovery_mode} (選択肢: {', '.join(DISCOVERY_MODES)})")
+        self.discovery_mode = discovery_mode
+        self.sitemap_urls = sitemap_urls
+        self.sitemap_lastmod_since = sitemap_lastmod_since
+        # sitemapに記載されていたパスの区画（先頭のディレクトリ）
+        self.sitemap_sections = set()
+        
+        # URLの取得順を決めるスコア（URLScorerなど）。Noneの場合は幅優先で取得する
+        self.scorer = scorer
+        # 取得中のページの深さ（開始URLからのリンク数）
+        self.current_depth = 0
+        
+        # 既に取得したページとほぼ同じページのリンクをたどらないための判定（NearDuplicateDetector）
+        self.near_duplicate = near_duplicate
+        # カレンダーやセッションID付きURLなど際限なく増えるURLを訪問待ちキューに追加しないための判定（TrapDetector）
+        self.trap_detector = trap_detector
+        # 取得したページからのリンクを記録するLinkGraphRecorder（Noneの場合は記録しない）
+        self.link_graph = link_graph
+        if link_graph is not None and link_graph.canonicalizer is None:
+            link_graph.canonicalizer = self.canonicalizer
+        
+        # 外部から読み出すメトリクス（CrawlMetrics）。Noneの場合は記録しない
+        self.metrics = metrics
+        if metrics is not None:
+            self.register_metrics()
 
     def format_time_elapsed(self, seconds):
         """経過時間を時間:分:秒の形式にフォーマットする"""
@@ -83,6 +212,31 @@ class URLScraper:
             print(f"検出した重複URL数: {self.stats['duplicate_count']:,}")
             print(f"処理したページ数: {self.stats['processed_pages']:,}")
             print(f"エラー数: {self.stats['error_count']}")
+            print(f"エラー応答数（4xx/5xx）: {self.stats['http_error_count']:,}")
+            skipped_mb = self.fetch_guard.summary().get('skipped_bytes', 0) / (1024 * 1024)
+            print(f"スキップしたページ数: {self.stats['skipped_pages']:,} (取得を省略した本文: {skipped_mb:,.1f}MB)")
+            if self.scorer is not None:
+                print(f"詳細ページのURL数: {self.stats['target_urls']:,}")
+            if self.near_duplicate is not None:
+                print(f"近似重複で展開を省略したページ数: {self.stats['near_duplicate_pages']:,} "
+                      f"(省略した未発見のリンク: {self.stats['pruned_links']:,})")
+            if self.trap_detector is not None:
+                print(f"トラップと判定してたどらなかったURL数: {self.stats['trap_urls']:,} "
+                      f"(停止したテンプレート: {len(self.trap_detector.blocked):,})")
+            url_set_memory = (self.visited_urls.memory_bytes() + self.all_discovered_urls.memory_bytes()) / (1024 * 1024)
+            if self.connection_metrics is not None:
+                print(f"接続: {self.connection_metrics.format()}")
+            if self.dns_cache is not None:
+                print(f"名前解決: {self.dns_cache.format()}")
+            if self.adaptive_concurrency is not None:
+                print(f"同時リクエスト数: {self.adaptive_concurrency.format()}")
+            if isinstance(self.urls_to_visit, MultiDomainFrontier):
+                print(f"ドメインごとの訪問待ちURL数: {self.urls_to_visit.format()}")
+            if self.frontier_memory_urls:
+                stats = self.frontier_stats
+                print(f"訪問待ちURLのディスク退避: {stats['disk_urls']:,}件 (ファイル {stats['segments']:,}個, "
+                      f"書き出し {stats['spilled']:,}件, 読み戻し {stats['refilled']:,}件)")
+            print(f"URL集合のメモリ使用量: {url_set_memory:,.1f}MB ({self.visited_backend})")
             print(f"経過時間: {elapsed_str}")
             print(f"収集速度: {urls_per_hour:.1f} URLs/時")
             print(f"最後のURL増加から: {time_since_last_increase}")
@@ -95,17 +249,203 @@ class URLScraper:
             self.stats['last_progress_time'] = current_time
             sys.stdout.flush()
 
-    def collect_urls(self):
-        collected_urls = []
-        urls_to_visit = [self.base_url]
-        visited_urls = set()
-        
-        self.stats['start_time'] = time.time()
-        self.stats['last_progress_time'] = time.time()
-        self.stats['last_url_increase_time'] = time.time()
-        
+    def register_metrics(self):
+        """統計情報とキュー長を、読み出し時に計算するメトリクスとして登録する"""
+        metrics = self.metrics
+        metrics.register_callback('crawl_urls_total', lambda: self.stats['total_urls'], 'counter', '発見したURL数')
+        metrics.register_callback('crawl_duplicate_urls_total', lambda: self.stats['duplicate_count'], 'counter',
+                                  '重複として除外したURL数')
+        metrics.register_callback('crawl_processed_pages_total', lambda: self.stats['processed_pages'], 'counter',
+                                  '処理したページ数')
+        metrics.register_callback('crawl_queue_depth', lambda: len(self.urls_to_visit), 'gauge', '訪問待ちURL数')
+        if self.scorer is not None:
+            metrics.register_callback('crawl_target_urls_total', lambda: self.stats['target_urls'], 'counter',
+                                      '発見した詳細ページのURL数')
+        if self.frontier_memory_urls:
+            metrics.register_callback('crawl_frontier_disk_urls', lambda: self.frontier_stats['disk_urls'], 'gauge',
+                                      'ディスクに退避している訪問待ちURL数')
+            metrics.register_callback('crawl_frontier_spilled_total', lambda: self.frontier_stats['spilled'],
+                                      'counter', 'ディスクに書き出した訪問待ちURL数')
+            metrics.register_callback('crawl_frontier_refilled_total', lambda: self.frontier_stats['refilled'],
+                                      'counter', 'ディスクから読み戻した訪問待ちURL数')
+        if self.dns_cache is not None:
+            metrics.register_callback('crawl_dns_lookups_total', lambda: self.dns_cache.stats['lookups'], 'counter',
+                                      'DNSキャッシュへの名前解決の要求数')
+            metrics.register_callback('crawl_dns_cache_hits_total', lambda: self.dns_cache.stats['hits'], 'counter',
+                                      'DNSキャッシュに命中した名前解決の要求数')
+        if self.trap_detector is not None:
+            metrics.register_callback('crawl_trap_urls_total', lambda: self.stats['trap_urls'], 'counter',
+                                      'トラップと判定してたどらなかったURL数')
+        metrics.describe('crawl_pages_total', 'ステータスコードごとの取得ページ数')
+        metrics.describe('crawl_bytes_total', '取得した本文のバイト数')
+        metrics.describe('crawl_fetch_seconds', 'ホストごとの取得時間（秒）')
+        metrics.describe('crawl_errors_total', '種類ごとのエラー数')
+        metrics.describe('crawl_skipped_total', '理由ごとの取得を打ち切ったページ数')
+
+    def record_fetch(self, url, seconds, status, size):
+        """1ページの取得時間・ステータスコード・本文のサイズをメトリクスに記録する"""
+        self.metrics.observe('crawl_fetch_seconds', seconds, host=urlparse(url).netloc)
+        self.metrics.inc('crawl_pages_total', status=str(status))
+        self.metrics.inc('crawl_bytes_total', size)
+
+    def make_url_set(self):
+        return make_url_set(self.visited_backend, self.visited_capacity, self.visited_error_rate)
+
+    def make_queue(self):
+        """1ドメイン分の訪問待ちキューを作る（scorerがあればスコア順、なければ幅優先）"""
+        if self.frontier_memory_urls:
+            return SpillingURLFrontier(self.frontier_spill_dir, self.scorer, self.frontier_memory_urls,
+                                       stats=self.frontier_stats)
+        return PriorityURLFrontier(self.scorer) if self.scorer is not None else URLFrontier()
+
+    def clear_spill_dir(self):
+        """前回の実行や作り直す前のキューが書き出したセグメントファイルを削除する"""
+        if self.frontier_spill_dir.exists():
+            shutil.rmtree(self.frontier_spill_dir)
+        self.frontier_stats['disk_urls'] = 0
+        self.frontier_stats['segments'] = 0
+
+    def make_frontier(self, entries=()):
+        """(URL, 深さ)の組から訪問待ちキューを作る（複数ドメインの場合はドメインごとのキューに分ける）"""
+        if self.frontier_memory_urls:
+            self.clear_spill_dir()
+        if self.multi_domain:
+            frontier = MultiDomainFrontier(self.scheduler, self.make_queue, self.adaptive_concurrency)
+        else:
+            frontier = self.make_queue()
+        for url, depth in entries:
+            frontier.push(url, depth)
+        return frontier
+
+    def start_urls(self):
+        """最初に訪問するURL（sitemapのみの場合はページを取得しない）"""
+        return [] if self.discovery_mode == 'sitemap' else list(self.seed_urls)
+
+    def is_allowed_domain(self, url):
+        """
+        URLがリンクをたどる対象のドメインかどうか
+
+        allowed_domainsのパターンはドメインとそのサブドメインに一致する（'dlsite.com'は'www.dlsite.com'にも一致）。
+        '*'を含むパターンはワイルドカードとして扱う。
+        """
+        netloc = urlparse(url).netloc
+        if self.allowed_domains is None:
+            return netloc in self.seed_domains
+        for pattern in self.allowed_domains:
+            if netloc == pattern or netloc.endswith('.' + pattern) or ('*' in pattern and fnmatch(netloc, pattern)):
+                return True
+        return False
+
+    def init_state(self):
+        """収集状態を初期化する。state_fileがあれば前回の続きから再開する"""
+        self.collected_urls = []
+        start_urls = self.start_urls()
+        self.urls_to_visit = self.make_frontier((url, 0) for url in start_urls)
+        self.visited_urls = self.make_url_set()
+
+        if self.state_file is not None:
+            self.store = FrontierStore(self.state_file, checkpoint_interval=self.checkpoint_interval)
+        resuming = self.store is not None and self.store.has_state()
+        # 再開時は前回の出力に追記し、新規実行時は作り直す
+        self.sink = URLSink(self.sink_path, compress=self.output_compress,
+                            fsync_every=self.fsync_every, append=resuming)
+        if self.link_graph is not None:
+            self.link_graph.open(append=resuming)
+
+        if not resuming:
+            if self.store is not None:
+                for url in start_urls:
+                    self.store.enqueue(url)
+            if self.discovery_mode != 'links':
+                self.seed_from_sitemaps()
+            return
+
+        self.urls_to_visit = self.make_frontier(self.store.load_queue())
+        self.visited_urls.update(self.store.load_visited())
+        self.all_discovered_urls.update(self.store.load_discovered())
+        self.collected_urls = self.store.load_unsaved()
+        saved_stats = self.store.load_stats()
+        self.batch_count = saved_stats.pop('batch_count', 0)
+        for name in PERSISTED_STATS:
+            self.stats[name] = saved_stats.get(name, self.stats[name])
+        self.stats['last_url_count'] = self.stats['total_urls']
+        self.sitemap_sections = set(saved_stats.get('sitemap_sections', []))
+
+        print(f"前回の状態から再開します: {self.state_file}")
+        print(f"訪問済みページ数: {len(self.visited_urls):,} / 訪問待ちURL数: {len(self.urls_to_visit):,}")
+
+    def checkpoint(self, force=False):
+        """state_fileを使う場合、現在の統計情報とともに状態を保存する"""
+        if self.store is None:
+            return
+        saved_stats = {name: self.stats[name] for name in PERSISTED_STATS}
+        saved_stats['batch_count'] = self.batch_count
+        if self.sitemap_sections:
+            saved_stats['sitemap_sections'] = sorted(self.sitemap_sections)
+        self.store.checkpoint(saved_stats, force=force)
+
+    @staticmethod
+    def section_of(url):
+        """URLのパスの先頭ディレクトリを区画として返す（'/products/123' -> '/products/'）"""
+        path = urlparse(url).path
+        head, sep, _ = path.lstrip('/').partition('/')
+        return f"/{head}/" if sep else '/'
+
+    def should_follow(self, url):
+        """URLのページを取得してリンクをたどるかどうか"""
+        if self.discovery_mode == 'links':
+            return True
+        if self.discovery_mode == 'sitemap':
+            return False
+        return self.section_of(url) not in self.sitemap_sections
+
+    def seed_from_sitemaps(self):
+        """sitemapに記載されたURLを出力に追加する（sitemapのURLはページを取得しない）"""
+        seeder = SitemapSeeder(scheduler=self.scheduler, lastmod_since=self.sitemap_lastmod_since,
+                               timeout=self.request_timeout, session=self.session)
+        print("sitemapからURLを読み込みます...")
+        # sitemap_urlsを指定しない場合は、開始URLのドメインごとにrobots.txtからsitemapを探す
+        if self.sitemap_urls:
+            sources = [(self.base_url, self.sitemap_urls)]
+        else:
+            seeds_by_domain = {}
+            for seed in self.seed_urls:
+                seeds_by_domain.setdefault(self.canonicalizer.domain(seed), seed)
+            sources = [(seed, None) for seed in seeds_by_domain.values()]
+        for base_url, sitemap_urls in sources:
+            for url, _ in seeder.iter_urls(base_url, sitemap_urls):
+                absolute_url = self.canonicalizer(url)
+                if not self.is_allowed_domain(absolute_url):
+                    continue
+                self.sitemap_sections.add(self.section_of(absolute_url))
+                self.add_url(absolute_url, follow=False)
+                if len(self.collected_urls) >= self.batch_size:
+                    self.flush_batch()
+                    self.checkpoint()
+        self.flush_batch()
+        self.checkpoint(force=True)
+
+        print(f"sitemapから{self.stats['total_urls']:,}個のURLを追加しました。"
+              f"(sitemap {seeder.stats['sitemaps']:,}件, lastmodで除外 {seeder.stats['skipped_lastmod']:,}件, "
+              f"エラー {seeder.stats['errors']:,}件)")
+        if self.discovery_mode == 'sitemap+links':
+            print(f"sitemapに含まれる区画: {len(self.sitemap_sections):,}個（これ以外の区画のみリンクをたどります）")
+
+    def print_start_banner(self):
         print(f"収集を開始します: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        print(f"対象ドメイン: {self.base_domain}")
+        print(f"対象ドメイン: {', '.join(self.allowed_domains or sorted(self.seed_domains))}")
+        if len(self.seed_urls) > 1:
+            print(f"開始URL数: {len(self.seed_urls):,}")
+        print(f"URLの発見方法: {self.discovery_mode}")
+        print(f"HTMLパーサー: {self.parser_backend}")
+        print(f"取得順: {'スコア順' if self.scorer is not None else '幅優先'}")
+        if self.archive is not None:
+            print(f"レスポンスの{'再生元' if self.replay else '記録先'}: {self.archive.path}")
+        if self.dns_cache is not None:
+            print(f"DNSキャッシュ: 有効 (保持時間 {self.dns_cache.ttl}秒"
+                  f"{', レコードのTTLを使用' if self.dns_cache.use_record_ttl else ''})")
+        if self.frontier_memory_urls:
+            print(f"訪問待ちURLをメモリに置く上限: {self.frontier_memory_urls:,} (超えた分の書き出し先: {self.frontier_spill_dir})")
         if self.max_pages:
             print(f"最大ページ数: {self.max_pages:,}")
         else:
@@ -113,91 +453,261 @@ class URLScraper:
         print(f"バッチサイズ: {self.batch_size:,}")
         print(f"リクエスト間隔: {self.delay_time}秒")
         print(f"停滞判定時間: {self.format_time_elapsed(self.stall_time) if self.stall_time else '無限'}")
+
+    def pop_next_url(self):
+        """訪問待ちキューから次のURLを取り出す。訪問済みの場合はNoneを返す"""
+        current_url, self.current_depth = self.urls_to_visit.pop_with_depth()
+        if self.canonicalizer.key(current_url) in self.visited_urls:
+            if self.store is not None:
+                self.store.dequeue(current_url)
+            return None
+        return current_url
+
+    def mark_visited(self, current_url):
+        """ページを訪問済みとして記録する"""
+        current_key = self.canonicalizer.key(current_url)
+        self.visited_urls.add(current_key)
+        if self.store is not None:
+            self.store.add_visited(current_key)
+            self.store.dequeue(current_url)
+
+    def mark_skipped(self, current_url):
+        """HTML以外・巨大な本文のため取得を打ち切ったページを訪問済みとして記録する"""
+        self.mark_visited(current_url)
+        self.stats['processed_pages'] += 1
+        self.stats['skipped_pages'] += 1
+
+    def add_url(self, absolute_url, follow=None, depth=0):
+        """
+        新しく見つかったURLを重複チェックしてキューと出力バッチに追加する
+
+        follow=Falseの場合は出力にのみ追加し、ページは取得しない
+        （Noneの場合はdiscovery_modeに従う）。depthはURLの深さ（開始URLからのリンク数）。
+        """
+        url_key = self.canonicalizer.key(absolute_url)
+        if url_key in self.visited_urls or \
+           absolute_url in self.urls_to_visit or \
+           url_key in self.all_discovered_urls:
+            self.stats['duplicate_count'] += 1
+            return False
+
+        if follow is None:
+            follow = self.should_follow(absolute_url)
+        # トラップのURLは出力には加えるが、訪問待ちキューには追加しない（ページを取得せず、その先のリンクもたどらない）
+        if follow and self.trap_detector is not None and self.trap_detector.check(absolute_url):
+            self.stats['trap_urls'] += 1
+            follow = False
+        if follow:
+            self.urls_to_visit.push(absolute_url, depth)
+        self.collected_urls.append(absolute_url)
+        self.all_discovered_urls.add(url_key)
+        self.stats['total_urls'] += 1
+        if self.scorer is not None and self.scorer.is_target(absolute_url):
+            self.stats['target_urls'] += 1
+        if self.store is not None:
+            if follow:
+                self.store.enqueue(absolute_url, depth)
+            self.store.add_discovered(url_key, absolute_url)
+        return True
+
+    def handle_page(self, current_url, html, depth=0):
+        """取得したページからリンクを抽出して処理する（depthは取得したページの深さ）"""
+        if self.near_duplicate is not None:
+            original_url = self.near_duplicate.check(current_url, html)
+            if original_url is not None:
+                self.prune_page(current_url, html, original_url)
+                return
+
+        new_urls = new_targets = 0
+        links = [] if self.link_graph is not None else None
+        for href in extract_links(html, self.parser_backend):
+            absolute_url = self.canonicalizer(urljoin(current_url, href))
+
+            if self.is_allowed_domain(absolute_url):
+                if self.add_url(absolute_url, depth=depth + 1):
+                    new_urls += 1
+                    if self.scorer is not None and self.scorer.is_target(absolute_url):
+                        new_targets += 1
+                if links is not None:
+                    links.append(absolute_url)
+
+                if len(self.collected_urls) >= self.batch_size:
+                    self.flush_batch()
+
+        if links is not None:
+            # 収集したURL（訪問済み・発見済み）へのリンクだけを加える
+            keys = ((url, self.canonicalizer.key(url)) for url in links)
+            self.link_graph.record(current_url, [
+                url for url, key in keys if key in self.all_discovered_urls or key in self.visited_urls
+            ])
+
+        if self.scorer is not None:
+            self.scorer.observe(current_url, new_urls, new_targets)
+
+    def prune_page(self, current_url, html, original_url):
+        """近似重複のページはリンクをたどらず、たどらなかった未発見のリンク数だけを記録する"""
+        pruned = set()
+        for href in extract_links(html, self.parser_backend):
+            absolute_url = self.canonicalizer(urljoin(current_url, href))
+            if not self.is_allowed_domain(absolute_url):
+                continue
+            url_key = self.canonicalizer.key(absolute_url)
+            if url_key not in self.all_discovered_urls and url_key not in self.visited_urls:
+                pruned.add(url_key)
+        self.stats['near_duplicate_pages'] += 1
+        self.stats['pruned_links'] += len(pruned)
+        self.near_duplicate.record_pruned(original_url, current_url, len(pruned))
+        if self.scorer is not None:
+            self.scorer.observe(current_url, 0, 0)
+
+    def print_near_duplicate_summary(self, limit=5):
+        """近似重複ページの多かった元ページを表示する"""
+        top = self.near_duplicate.top_pruned(limit)
+        if not top:
+            return
+        print(f"\n近似重複ページの多いページ（上位{len(top)}件）:")
+        for original_url, entry in top:
+            print(f"  {original_url}: 近似重複 {entry['pages']:,}ページ, 省略したリンク {entry['links']:,}件 "
+                  f"(例: {entry['examples'][0]})")
+
+    def print_trap_summary(self, limit=5):
+        """トラップと判定してたどらなかったURLの多いテンプレートを表示する"""
+        top = self.trap_detector.top_blocked(limit)
+        if not top:
+            return
+        print(f"\nトラップと判定したテンプレート（上位{len(top)}件）:")
+        for template, entry in top:
+            print(f"  {template}: 追加しなかったURL {entry['urls']:,}件 "
+                  f"(例: {entry['examples'][0]})")
+
+    def flush_batch(self):
+        """たまったURLをバッチファイルに保存する"""
+        if not self.collected_urls:
+            return
+        self.save_batch(self.collected_urls)
+        self.batch_count += 1
+        print(f"\nバッチ{self.batch_count}を保存しました。({len(self.collected_urls):,}個のURL)")
+        if self.store is not None:
+            self.store.mark_saved(self.canonicalizer.key(url) for url in self.collected_urls)
+        self.collected_urls = []
+
+    def finish_link_graph(self):
+        """リンクグラフのファイルを閉じ、CSR形式のファイルを作る"""
+        self.link_graph.close()
+        num_nodes, num_edges = build_csr(self.link_graph.prefix)
+        print(f"\nリンクグラフを保存しました: {self.link_graph.csr_path} (ノード数 {num_nodes:,}, エッジ数 {num_edges:,})")
+
+    def finish_archive(self):
+        """アーカイブへの記録を書き込んで閉じる"""
+        summary = self.archive.summary()
+        self.archive.close()
+        if self.replay:
+            print(f"\nアーカイブから再生したレスポンス: {summary['hits']:,}件 (記録がなかったURL: {summary['misses']:,}件)")
+        else:
+            print(f"\nアーカイブに記録したレスポンス: {summary['recorded']:,}件 ({self.archive.path})")
+
+    def finish_collection(self):
+        """残りのURLを保存し、状態を書き出してからマージする"""
+        if self.near_duplicate is not None:
+            self.print_near_duplicate_summary()
+        if self.trap_detector is not None:
+            self.print_trap_summary()
+        self.flush_batch()
+        self.checkpoint(force=True)
+        if self.link_graph is not None:
+            self.finish_link_graph()
+        # 残った訪問待ちURLは（state_fileを使う場合は）状態ファイルに保存されているため、セグメントファイルは削除する
+        if self.frontier_memory_urls:
+            self.clear_spill_dir()
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+        if self.archive is not None:
+            self.finish_archive()
+
+        self.sink.close()
+
+        if self.write_merged:
+            self.merge_json_files()
+
+    def collect_urls(self):
+        self.stats['start_time'] = time.time()
+        self.stats['last_progress_time'] = time.time()
+        self.stats['last_url_increase_time'] = time.time()
+        
+        self.init_state()
+        self.print_start_banner()
         
-        while urls_to_visit:
+        while self.urls_to_visit:
             if self.max_pages and self.stats['processed_pages'] >= self.max_pages:
                 print("\n最大ページ数に到達しました。収集を終了します。")
                 break
             if self.check_stall_condition():
                 break
             
-            current_url = urls_to_visit.pop(0)
-            if current_url in visited_urls:
+            current_url = self.pop_next_url()
+            if current_url is None:
                 continue
             
-            try:
-                time.sleep(self.delay_time)
-                
-                response = requests.get(current_url)
-                visited_urls.add(current_url)
-                self.stats['processed_pages'] += 1
-                
-                if response.status_code == 200:
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    for link in soup.find_all('a', href=True):
-                        href = link['href']
-                        absolute_url = urljoin(current_url, href)
-                        
-                        if urlparse(absolute_url).netloc == self.base_domain:
-                            if absolute_url not in visited_urls and \
-                               absolute_url not in urls_to_visit and \
-                               absolute_url not in self.all_discovered_urls:
-                                
-                                urls_to_visit.append(absolute_url)
-                                collected_urls.append(absolute_url)
-                                self.all_discovered_urls.add(absolute_url)
-                                self.stats['total_urls'] += 1
-                            else:
-                                self.stats['duplicate_count'] += 1
-                                
-                            if len(collected_urls) >= self.batch_size:
-                                self.save_to_json(collected_urls)
-                                self.batch_count += 1
-                                print(f"\nバッチ{self.batch_count}を保存しました。({len(collected_urls):,}個のURL)")
-                                collected_urls = []
-                
-                self.print_progress()
-
-                if self.stats['total_urls'] == self.stats['processed_pages']:
-                    print("\n収集したURL数と処理したページ数が同じため、収集を終了します。")
-                    break
-                                  
-            except Exception as e:
-                self.stats['error_count'] += 1
-                print(f"\nError processing {current_url}: {e}")
+            if not self.fetch_and_handle(current_url):
+                continue
             
-        if collected_urls:
-            self.save_to_json(collected_urls)
-            self.batch_count += 1
-            print(f"\nバッチ{self.batch_count}を保存しました。({len(collected_urls):,}個のURL)")
-        
-        self.merge_json_files()
-
-    def save_to_json(self, urls):
-        file_path = self.data_dir / f"{self.file_name}_{self.batch_count + 1}.json"
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(urls, f, ensure_ascii=False, indent=4)
-        print(f"ファイルに保存しました: {file_path}")
+            self.print_progress()
+
+            # 開始URLは発見したURL数に含まれないため、件数ではなく訪問待ちのURLが残っているかで判定する
+            if not self.urls_to_visit:
+                print("\n訪問待ちのURLがなくなったため、収集を終了します。")
+                break
+            
+        self.finish_collection()
+
+    def fetch_and_handle(self, current_url):
+        """1ページを取得してリンクを処理する。取得できた場合はTrueを返す"""
+        try:
+            self.scheduler.acquire(current_url)
+            
+            start = time.perf_counter()
+            response = self.fetch_guard.fetch(self.session, current_url, timeout=self.request_timeout)
+            if self.metrics is not None:
+                self.record_fetch(current_url, time.perf_counter() - start, response.status_code, len(response.content))
+            self.scheduler.observe(current_url, response.status_code, response.headers)
+            self.mark_visited(current_url)
+            self.stats['processed_pages'] += 1
+            if response.status_code >= 400:
+                self.stats['http_error_count'] += 1
+            
+            if response.status_code == 200:
+                self.handle_page(current_url, response.text, self.current_depth)
+            return True
+        except ContentSkipped as e:
+            self.mark_skipped(current_url)
+            if self.metrics is not None:
+                self.metrics.inc('crawl_skipped_total', reason=e.reason)
+        except Exception as e:
+            self.stats['error_count'] += 1
+            if self.metrics is not None:
+                self.metrics.inc('crawl_errors_total', type=type(e).__name__)
+            print(f"\nError processing {current_url}: {e}")
+        finally:
+            self.checkpoint()
+        return False
+
+    def save_batch(self, urls):
+        """URLのバッチを出力ファイルに追記する"""
+        self.sink.write(urls)
+        print(f"ファイルに追記しました: {self.sink_path}")
     
     def merge_json_files(self):
-        total_urls = []
-        for json_file in self.data_dir.glob(f"{self.file_name}_*.json"):
-            with open(json_file, 'r', encoding='utf-8') as f:
-                urls = json.load(f)
-                total_urls.extend(urls)
-        
-        unique_urls = list(set(total_urls))
-        final_duplicates = len(total_urls) - len(unique_urls)
+        """出力ファイルを先頭から読みながら重複を除去し、JSON配列のマージファイルを作成する"""
+        merged_file_path = self.data_dir / f"{self.file_name}_merged.json"
+        unique_count, final_duplicates = write_merged([self.sink_path], merged_file_path)
         if final_duplicates > 0:
             print(f"\n最終チェックで{final_duplicates}個の重複を検出し、除去しました。")
         
-        merged_file_path = self.data_dir / f"{self.file_name}_merged.json"
-        with open(merged_file_path, 'w', encoding='utf-8') as f:
-            json.dump(unique_urls, f, ensure_ascii=False, indent=4)
         print(f"マージされたファイルに保存しました: {merged_file_path}")
-        print(f"最終的なユニークURL数: {len(unique_urls):,}")
+        print(f"最終的なユニークURL数: {unique_count:,}")
         
-        return len(unique_urls)
+        return unique_count
 
     def run(self):
         """URL収集を開始するためのメソッド"""
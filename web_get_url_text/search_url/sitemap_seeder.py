@@ -0,0 +1,208 @@
+import zlib
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from urllib.parse import urljoin, urlsplit
+
+import requests
+
+# sitemapの要素の名前空間（名前空間を付けないsitemapもあるため、空の場合も同じに扱う）
+SITEMAP_NAMESPACES = ('', 'http://www.sitemaps.org/schemas/sitemap/0.9')
+
+
+def local_name(tag):
+    """名前空間を除いたタグ名を返す（'{http://...}loc' -> 'loc'）"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def namespace_of(tag):
+    """タグの名前空間を返す（'{http://...}loc' -> 'http://...'、名前空間がなければ''）"""
+    return tag[1:].split('}', 1)[0] if tag.startswith('{') else ''
+
+
+def parse_lastmod(value):
+    """sitemapのlastmod（W3C Datetime）をUTCのdatetimeに変換する（解釈できない場合はNone）"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        try:
+            parsed = datetime.strptime(value[:10], '%Y-%m-%d')
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+class SitemapSeeder:
+    """
+    robots.txtのSitemap行とsitemap.xml（インデックス・gzip圧縮を含む）からURLを列挙する
+
+    XMLはレスポンスを読みながらXMLPullParserで逐次解析し、処理済みの要素はすぐに破棄するため、
+    数百万件のURLを含むsitemapでもメモリ使用量は一定に保たれる。
+    """
+
+    def __init__(self, scheduler=None, user_agent='*', timeout=30, lastmod_since=None, session=None):
+        """
+        Args:
+            scheduler: リクエスト間隔を制御するHostScheduler（Noneの場合は待機しない）
+            user_agent: robots.txt・sitemap取得時のUser-Agent
+            timeout: 1リクエストあたりのタイムアウト（秒）
+            lastmod_since: この日時より古いlastmodのsitemap・URLを読み飛ばす（datetimeまたはISO形式の文字列）
+            session: 使用するrequests.Session
+        """
+        self.scheduler = scheduler
+        self.user_agent = user_agent
+        self.timeout = timeout
+        if isinstance(lastmod_since, str):
+            lastmod_since = parse_lastmod(lastmod_since)
+        elif lastmod_since is not None and lastmod_since.tzinfo is None:
+            lastmod_since = lastmod_since.replace(tzinfo=timezone.utc)
+        self.lastmod_since = lastmod_since
+        self.session = session or requests.Session()
+        self.stats = {
+            'sitemaps': 0,
+            'urls': 0,
+            'skipped_lastmod': 0,
+            'errors': 0
+        }
+
+    def get(self, url, stream=False):
+        if self.scheduler is not None:
+            self.scheduler.acquire(url)
+        headers = {} if self.user_agent == '*' else {'User-Agent': self.user_agent}
+        response = self.session.get(url, headers=headers, timeout=self.timeout, stream=stream)
+        if self.scheduler is not None:
+            self.scheduler.observe(url, response.status_code, response.headers)
+        return response
+
+    def find_sitemaps(self, base_url):
+        """robots.txtのSitemap行からsitemapのURLを取得する。記載がなければ/sitemap.xmlを返す"""
+        parts = urlsplit(base_url)
+        root = f"{parts.scheme}://{parts.netloc}/"
+        sitemaps = []
+        try:
+            response = self.get(urljoin(root, 'robots.txt'))
+            if response.status_code == 200:
+                for line in response.text.splitlines():
+                    name, _, value = line.partition(':')
+                    if name.strip().lower() == 'sitemap' and value.strip():
+                        sitemaps.append(urljoin(root, value.strip()))
+        except requests.RequestException as e:
+            print(f"robots.txtの取得に失敗しました: {e}")
+        return sitemaps or [urljoin(root, 'sitemap.xml')]
+
+    def is_outdated(self, lastmod):
+        if self.lastmod_since is None:
+            return False
+        parsed = parse_lastmod(lastmod)
+        return parsed is not None and parsed < self.lastmod_since
+
+    @staticmethod
+    def iter_chunks(response, chunk_size=64 * 1024):
+        """レスポンス本文を少しずつ返す（.gzのsitemapは展開しながら返す）"""
+        decompressor = None
+        first = True
+        for chunk in response.iter_content(chunk_size):
+            if first:
+                first = False
+                if chunk[:2] == b'\x1f\x8b':
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            if decompressor is not None:
+                chunk = decompressor.decompress(chunk)
+            if chunk:
+                yield chunk
+        if decompressor is not None:
+            tail = decompressor.flush()
+            if tail:
+                yield tail
+
+    def iter_elements(self, response):
+        """レスポンスを読みながら閉じた要素を順に返す"""
+        parser = ET.XMLPullParser(events=('start', 'end'))
+        root = None
+        for chunk in self.iter_chunks(response):
+            parser.feed(chunk)
+            for event, elem in parser.read_events():
+                if event == 'start':
+                    if root is None:
+                        root = elem
+                    continue
+                yield elem
+            # 処理済みの<url>要素がルートに残り続けないよう、チャンクごとに切り離す
+            if root is not None:
+                del root[:]
+        parser.close()
+        for event, elem in parser.read_events():
+            if event == 'end':
+                yield elem
+
+    def iter_sitemap(self, sitemap_url, seen):
+        """1つのsitemapを逐次解析し、インデックスの場合は子sitemapを再帰的に読む"""
+        if sitemap_url in seen:
+            return
+        seen.add(sitemap_url)
+
+        try:
+            response = self.get(sitemap_url, stream=True)
+        except requests.RequestException as e:
+            self.stats['errors'] += 1
+            print(f"sitemapの取得に失敗しました: {sitemap_url} ({e})")
+            return
+        if response.status_code != 200:
+            self.stats['errors'] += 1
+            print(f"sitemapを取得できませんでした: {sitemap_url} (status {response.status_code})")
+            response.close()
+            return
+
+        self.stats['sitemaps'] += 1
+        child_sitemaps = []
+        loc = lastmod = None
+        try:
+            with response:
+                for elem in self.iter_elements(response):
+                    # 画像・動画sitemapの拡張（<image:loc>など）はページのURLではないため読み飛ばす
+                    if namespace_of(elem.tag) not in SITEMAP_NAMESPACES:
+                        continue
+                    name = local_name(elem.tag)
+                    if name == 'loc':
+                        loc = (elem.text or '').strip()
+                    elif name == 'lastmod':
+                        lastmod = elem.text
+                    elif name in ('url', 'sitemap'):
+                        if not loc:
+                            pass
+                        elif self.is_outdated(lastmod):
+                            self.stats['skipped_lastmod'] += 1
+                        elif name == 'sitemap':
+                            # 子sitemapは現在のレスポンスを読み終えてから取得する
+                            child_sitemaps.append(urljoin(sitemap_url, loc))
+                        else:
+                            self.stats['urls'] += 1
+                            yield urljoin(sitemap_url, loc), lastmod
+                        loc = lastmod = None
+                        elem.clear()
+        except (ET.ParseError, zlib.error, requests.RequestException) as e:
+            self.stats['errors'] += 1
+            print(f"sitemapの解析に失敗しました: {sitemap_url} ({e})")
+
+        for child_url in child_sitemaps:
+            yield from self.iter_sitemap(child_url, seen)
+
+    def iter_urls(self, base_url=None, sitemap_urls=None):
+        """
+        sitemapに記載されたURLを(url, lastmod)の形で順に返す
+
+        Args:
+            base_url: robots.txtを探すサイトのURL（sitemap_urlsを指定しない場合）
+            sitemap_urls: 読み込むsitemapのURLのリスト
+        """
+        if not sitemap_urls:
+            sitemap_urls = self.find_sitemaps(base_url)
+        seen = set()
+        for sitemap_url in sitemap_urls:
+            yield from self.iter_sitemap(sitemap_url, seen)
@@ -0,0 +1,220 @@
+import re
+from collections import Counter
+from urllib.parse import urlsplit, parse_qsl
+
+from url_scorer import DEFAULT_TARGET_PATTERNS
+
+DIGITS = re.compile(r'\d+')
+# セッションIDやハッシュのような長いトークン（数字を含む16文字以上の英数字）
+TOKEN = re.compile(r'^[0-9A-Za-z_-]{16,}$')
+
+REASON_LABELS = {
+    'template_budget': '同じテンプレートのURL数が上限を超過',
+    'param_combinations': 'クエリパラメータの組み合わせが増え続けている',
+    'session_id': 'セッションIDと思われるパラメータ',
+    'repeated_segments': 'パスに同じ階層が繰り返し現れる',
+    'path_depth': 'パスの階層が深すぎる',
+}
+
+
+def segment_template(segment):
+    """パスの1階層を、数字やトークンを置き換えたテンプレートにする（'RJ01234.html' -> 'RJ{n}.html'）"""
+    segment, sep, _ = segment.partition(';')
+    if TOKEN.match(segment) and any(c.isdigit() for c in segment):
+        segment = '{token}'
+    else:
+        segment = DIGITS.sub('{n}', segment)
+    # ;jsessionid=... のようなパス中のパラメータは値を捨てる
+    return segment + (';{params}' if sep else '')
+
+
+class TrapDetector:
+    """
+    カレンダー・絞り込み検索・セッションID付きURLなど、際限なく増えるURL空間（クローラートラップ）を検出する
+
+    URLのホストとパスの数字・トークンを置き換え、クエリはパラメータ名だけを残したものを
+    テンプレートとして、次のいずれかに当てはまったURLを訪問待ちキューに追加しない（URLScraperはURLの出力のみ行う）。
+    - 同じテンプレートの新しいURLがmax_template_urlsを超えた（無限に続くカレンダーなど）
+    - 同じパスのテンプレートで、パラメータ名の組み合わせがmax_param_setsを超えたか、
+      2つ以上のパラメータの値が変わりながらクエリの種類がmax_query_variantsを超えた（絞り込み検索など）
+    - 値がほぼ毎回異なり、session_min_templates種類以上のテンプレートに付いているパラメータ（セッションID）
+    - パスに同じ階層がmax_segment_repeatsを超えて現れる、または階層がmax_path_depthを超える（相対リンクの誤りなど）
+      DLsiteの /=/per_page/30/page/2/ のようにパスにパラメータを並べるサイトは階層が深くなるため、
+      max_path_depthは既定では判定しない
+    テンプレートごとの件数だけを数えるため、使うメモリはURL数ではなくテンプレート数に比例する。
+    allow_patternsに一致するURL（収集したい詳細ページ）はテンプレートの件数の上限を適用しない。
+    """
+
+    def __init__(self, max_template_urls=10000, max_query_variants=500, max_param_sets=16,
+                 max_segment_repeats=2, max_path_depth=None, session_min_urls=100, session_min_templates=3,
+                 allow_patterns=DEFAULT_TARGET_PATTERNS, max_examples=3):
+        """
+        Args:
+            max_template_urls: 1つのテンプレートに追加するURL数の上限
+            max_query_variants: 複数のパラメータの値が変わるパスで、追加するクエリの種類の上限
+            max_param_sets: 1つのパスで許すパラメータ名の組み合わせの数
+            max_segment_repeats: パスに同じ階層（数字のみの階層を除く）が現れてよい回数
+            max_path_depth: パスの階層数の上限（Noneの場合は判定しない）
+            session_min_urls: セッションIDかどうかを判定するのに必要な、パラメータの出現回数
+            session_min_templates: セッションIDとみなすのに必要な、パラメータが付いていたテンプレートの種類数
+            allow_patterns: テンプレートの件数の上限を適用しないURLの正規表現のリスト
+            max_examples: トラップと判定したテンプレートごとに記録しておくURLの数
+        """
+        self.max_template_urls = max_template_urls
+        self.max_query_variants = max_query_variants
+        self.max_param_sets = max_param_sets
+        self.max_segment_repeats = max_segment_repeats
+        self.max_path_depth = max_path_depth
+        self.session_min_urls = session_min_urls
+        self.session_min_templates = session_min_templates
+        self.allow_patterns = [re.compile(pattern) for pattern in allow_patterns or ()]
+        self.max_examples = max_examples
+
+        # テンプレートごとの追加したURL数
+        self.template_counts = Counter()
+        # パスのテンプレートごとの [パラメータ名の組み合わせ, クエリの種類数, パラメータ名ごとの最初の値, 値が変わったパラメータ名]
+        self.query_stats = {}
+        # (ホスト, パラメータ名)ごとの [出現回数, 値のハッシュの集合, 付いていたテンプレートの集合]（判定が済んだらNone）
+        self.param_stats = {}
+        self.session_params = set()
+        # トラップと判定したテンプレート -> 理由（パスのテンプレートはクエリ付きのURLだけを止める）
+        self.trapped_templates = {}
+        self.trapped_paths = {}
+        # テンプレートごとの追加しなかったURL数とURLの例
+        self.blocked = {}
+        self.stats = Counter()
+
+    def templates_of(self, url):
+        """(ホスト+パスのテンプレート, パラメータ名付きのテンプレート, パラメータの一覧)を返す"""
+        parts = urlsplit(url)
+        segments = parts.path.split('/')
+        path_template = parts.netloc.lower() + '/'.join(segment_template(segment) for segment in segments)
+        params = parse_qsl(parts.query, keep_blank_values=True)
+        if not params:
+            return path_template, path_template, params
+        names = sorted({name for name, _ in params})
+        return path_template, f"{path_template}?{'&'.join(names)}", params
+
+    def is_allowed(self, url):
+        return any(pattern.search(url) for pattern in self.allow_patterns)
+
+    def check(self, url):
+        """
+        URLがトラップに当てはまる場合は理由を返す。当てはまらなければ件数を記録してNoneを返す
+        （Noneを返したURLは訪問待ちキューに追加されたものとして数える）
+        """
+        path_template, template, params = self.templates_of(url)
+
+        reason = self.check_path(url)
+        if reason is not None:
+            # 繰り返し・深すぎるパスはURLごとにテンプレートが変わるため、先頭の階層でまとめて記録する
+            prefix = '/'.join(path_template.split('/')[:3]) + '/...'
+            if prefix not in self.blocked:
+                self.log_trap(prefix, reason)
+            self.record_blocked(prefix, url, reason)
+            return reason
+        if params:
+            host = urlsplit(url).netloc.lower()
+            if any((host, name) in self.session_params for name, _ in params):
+                reason = 'session_id'
+        if reason is None:
+            reason = self.trapped_templates.get(template)
+        if reason is not None:
+            self.record_blocked(template, url, reason)
+            return reason
+        if params and path_template in self.trapped_paths:
+            reason = self.trapped_paths[path_template]
+            self.record_blocked(path_template, url, reason)
+            return reason
+
+        if not self.is_allowed(url):
+            count = self.template_counts[template] + 1
+            if count > self.max_template_urls:
+                return self.trap(self.trapped_templates, template, url, 'template_budget')
+            self.template_counts[template] = count
+
+        if params:
+            if self.count_query(path_template, params):
+                return self.trap(self.trapped_paths, path_template, url, 'param_combinations')
+            session = self.count_params(url, template, params)
+            if session is not None:
+                self.session_params.add(session)
+                self.log_trap(f"{session[0]} ?{session[1]}=", 'session_id')
+                self.record_blocked(template, url, 'session_id')
+                return 'session_id'
+        return None
+
+    def check_path(self, url):
+        """パスの階層の繰り返し・深さを調べる"""
+        segments = [segment for segment in urlsplit(url).path.split('/') if segment]
+        if self.max_path_depth is not None and len(segments) > self.max_path_depth:
+            return 'path_depth'
+        counts = Counter(segment for segment in segments if not segment.isdigit())
+        if counts and max(counts.values()) > self.max_segment_repeats:
+            return 'repeated_segments'
+        return None
+
+    def count_query(self, path_template, params):
+        """パスのテンプレートごとのクエリの種類を数え、組み合わせが増えすぎていればTrueを返す"""
+        entry = self.query_stats.get(path_template)
+        if entry is None:
+            entry = self.query_stats[path_template] = [set(), 0, {}, set()]
+        param_sets, _, first_values, varying = entry
+        param_sets.add(frozenset(name for name, _ in params))
+        entry[1] += 1
+        for name, value in params:
+            first = first_values.setdefault(name, value)
+            if first != value:
+                varying.add(name)
+        return len(param_sets) > self.max_param_sets or \
+            (entry[1] > self.max_query_variants and len(varying) >= 2)
+
+    def count_params(self, url, template, params):
+        """
+        パラメータの値がほぼ毎回異なり、複数のテンプレートに付いていればセッションIDとして(ホスト, 名前)を返す
+
+        商品IDのような値も毎回異なるが、付いているページの種類が限られる点で区別する。
+        session_min_urls × 10回まで判定がつかなかったパラメータは、それ以上数えない。
+        """
+        host = urlsplit(url).netloc.lower()
+        for name, value in params:
+            key = (host, name)
+            if key in self.param_stats and self.param_stats[key] is None:
+                continue
+            entry = self.param_stats.setdefault(key, [0, set(), set()])
+            entry[0] += 1
+            entry[1].add(hash(value))
+            if len(entry[2]) < self.session_min_templates:
+                entry[2].add(template)
+            if entry[0] < self.session_min_urls:
+                continue
+            if len(entry[1]) >= entry[0] * 0.9 and len(entry[2]) >= self.session_min_templates:
+                self.param_stats[key] = None
+                return key
+            if entry[0] >= self.session_min_urls * 10:
+                self.param_stats[key] = None
+        return None
+
+    def trap(self, trapped, template, url, reason):
+        trapped[template] = reason
+        self.log_trap(template, reason)
+        self.record_blocked(template, url, reason)
+        return reason
+
+    def log_trap(self, template, reason):
+        print(f"\nクローラートラップと判定しました。以降のURLはたどりません: {template} ({REASON_LABELS[reason]})")
+        if reason == 'session_id':
+            print("  このパラメータはURLCanonicalizerのignore_paramsに追加すると、URLから取り除いて収集できます。")
+
+    def record_blocked(self, template, url, reason):
+        entry = self.blocked.get(template)
+        if entry is None:
+            entry = self.blocked[template] = {'reason': reason, 'urls': 0, 'examples': []}
+        entry['urls'] += 1
+        if len(entry['examples']) < self.max_examples:
+            entry['examples'].append(url)
+        self.stats[reason] += 1
+
+    def top_blocked(self, limit=10):
+        """追加しなかったURLの多いテンプレートから順に(テンプレート, 記録)を返す"""
+        return sorted(self.blocked.items(), key=lambda item: -item[1]['urls'])[:limit]
@@ -0,0 +1,100 @@
+from urllib.parse import urlsplit, urlunsplit, unquote_plus
+from typing import Dict, Iterable, Optional
+
+
+# 全サイト共通で除去するトラッキング用パラメータ
+DEFAULT_IGNORE_PARAMS = {
+    'utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content',
+    'gclid', 'fbclid',
+}
+
+# サイトごとに除去するパラメータ（キーはホスト名の末尾）
+DEFAULT_SITE_IGNORE_PARAMS = {
+    'dmm.co.jp': {'i3_ref', 'i3_ord', 'i3_pst', 'dmmref'},
+    'dmm.com': {'i3_ref', 'i3_ord', 'i3_pst', 'dmmref'},
+    'dlsite.com': {'unique_op'},
+}
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class URLCanonicalizer:
+    """
+    表記ゆれのあるURLを1つの正規形にまとめる
+
+    canonicalize() はそのまま取得に使える正規形を返す。
+    - スキームとホスト名を小文字化し、デフォルトポートを除去
+    - フラグメント(#...)を除去
+    - クエリパラメータをソートし、トラッキング用パラメータを除去（パラメータの表記はそのまま）
+
+    key() は重複・訪問済み判定用のキーを返す。正規形に加えてパス末尾の
+    スラッシュの有無を同一視する（取得先のURL自体は書き換えない）。
+    """
+
+    def __init__(self,
+                 ignore_params: Optional[Iterable[str]] = None,
+                 site_ignore_params: Optional[Dict[str, Iterable[str]]] = None,
+                 strip_trailing_slash: bool = True):
+        self.ignore_params = set(DEFAULT_IGNORE_PARAMS if ignore_params is None else ignore_params)
+        site_params = DEFAULT_SITE_IGNORE_PARAMS if site_ignore_params is None else site_ignore_params
+        self.site_ignore_params = {host.lower(): set(params) for host, params in site_params.items()}
+        self.strip_trailing_slash = strip_trailing_slash
+
+    def params_to_ignore(self, host: str) -> set:
+        """ホストに適用する除去対象パラメータを返す"""
+        params = set(self.ignore_params)
+        for site, site_params in self.site_ignore_params.items():
+            if host == site or host.endswith('.' + site):
+                params |= site_params
+        return params
+
+    def canonicalize(self, url: str) -> str:
+        """URLを正規形に変換する"""
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        host = (parts.hostname or '').lower()
+        if ':' in host:
+            # hostnameはIPv6アドレスの[]を外して返すため付け直す
+            host = f"[{host}]"
+
+        try:
+            port = parts.port
+        except ValueError:
+            # 不正なポート表記はそのまま残す
+            return urlunsplit((scheme, parts.netloc.lower(), parts.path, parts.query, ''))
+
+        netloc = host
+        if port and port != DEFAULT_PORTS.get(scheme):
+            netloc = f"{host}:{port}"
+        if parts.username:
+            userinfo = parts.username + (f":{parts.password}" if parts.password else '')
+            netloc = f"{userinfo}@{netloc}"
+
+        path = parts.path or '/'
+
+        query = ''
+        if parts.query:
+            # 元の表記（?flag や %20 など）を変えないよう、k=v の断片のまま名前で並べ替える（同じ名前の値は元の順序を保つ）
+            ignore = self.params_to_ignore(host)
+            pieces = [piece for piece in parts.query.split('&')
+                      if piece and unquote_plus(piece.partition('=')[0]) not in ignore]
+            query = '&'.join(sorted(pieces, key=lambda piece: piece.partition('=')[0]))
+
+        return urlunsplit((scheme, netloc, path, query, ''))
+
+    def key(self, url: str) -> str:
+        """重複判定用のキーを返す"""
+        canonical = self.canonicalize(url)
+        if not self.strip_trailing_slash:
+            return canonical
+        parts = urlsplit(canonical)
+        if len(parts.path) > 1 and parts.path.endswith('/'):
+            return urlunsplit((parts.scheme, parts.netloc, parts.path.rstrip('/') or '/', parts.query, ''))
+        return canonical
+
+    def domain(self, url: str) -> str:
+        """正規化後のホスト部分（netloc）を返す"""
+        return urlsplit(self.canonicalize(url)).netloc
+
+    def __call__(self, url: str) -> str:
+        return self.canonicalize(url)
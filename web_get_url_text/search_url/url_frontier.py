@@ -0,0 +1,441 @@
+import heapq
+import itertools
+import json
+import os
+import tempfile
+from collections import deque
+from pathlib import Path
+
+from visited_set import FingerprintURLSet
+
+# ディスクに書き出したURLの集合の初期サイズ（書き出しを始めるまでのメモリを抑える）
+SPILLED_SET_SIZE = 1024
+
+
+class URLFrontier:
+    """
+    訪問待ちURLのキュー
+
+    dequeとメンバーシップ用のsetを組み合わせ、追加順（幅優先）を保ったまま
+    push / pop / len / in をすべてO(1)で処理する。
+    """
+
+    def __init__(self, urls=None):
+        self.queue = deque()
+        # 各URLの深さ（開始URLからのリンク数）。queueと同じ順に並べる
+        self.depths = deque()
+        self.members = set()
+        for url in urls or []:
+            self.push(url)
+
+    def push(self, url, depth=0):
+        """URLを末尾に追加する。既にキューにある場合は追加せずFalseを返す"""
+        if url in self.members:
+            return False
+        self.queue.append(url)
+        self.depths.append(depth)
+        self.members.add(url)
+        return True
+
+    def pop(self):
+        """先頭のURLを取り出す"""
+        return self.pop_with_depth()[0]
+
+    def peek(self):
+        """次に取り出すURLを返す（取り出さない）"""
+        return self.queue[0]
+
+    def pop_with_depth(self):
+        """先頭のURLをその深さとともに取り出す"""
+        url = self.queue.popleft()
+        depth = self.depths.popleft()
+        self.members.discard(url)
+        return url, depth
+
+    def __contains__(self, url):
+        return url in self.members
+
+    def __len__(self):
+        return len(self.queue)
+
+    def __bool__(self):
+        return bool(self.queue)
+
+
+class PriorityURLFrontier:
+    """
+    スコアの小さい順にURLを取り出す訪問待ちキュー
+
+    スコアはpush時にscorer.score(url, depth)で計算する。scorerが学習した
+    プレフィックスごとの収穫量を反映するため、一定回数popするごとに
+    キュー全体のスコアを計算し直す（1回あたりの再計算はキュー長の1/10回のpopに分散される）。
+    """
+
+    def __init__(self, scorer, urls=None, rescore_interval=1000):
+        """
+        Args:
+            scorer: score(url, depth)を持つオブジェクト（URLScorerなど）
+            urls: 最初に追加するURL
+            rescore_interval: スコアを計算し直すまでの最小pop回数
+        """
+        self.scorer = scorer
+        self.heap = []
+        self.members = set()
+        self.counter = itertools.count()
+        self.rescore_interval = rescore_interval
+        self.pops_since_rescore = 0
+        for url in urls or []:
+            self.push(url)
+
+    def push(self, url, depth=0):
+        """URLを追加する。既にキューにある場合は追加せずFalseを返す"""
+        if url in self.members:
+            return False
+        # 同じスコアの場合は追加順（幅優先）に取り出す
+        heapq.heappush(self.heap, (self.scorer.score(url, depth), next(self.counter), url, depth))
+        self.members.add(url)
+        return True
+
+    def pop(self):
+        """最もスコアの小さいURLを取り出す"""
+        return self.pop_with_depth()[0]
+
+    def peek(self):
+        """次に取り出すURLを返す（取り出さない）"""
+        return self.heap[0][2]
+
+    def pop_with_depth(self):
+        """最もスコアの小さいURLをその深さとともに取り出す"""
+        self.pops_since_rescore += 1
+        if self.pops_since_rescore >= max(self.rescore_interval, len(self.heap) // 10):
+            self.rescore()
+        _, _, url, depth = heapq.heappop(self.heap)
+        self.members.discard(url)
+        return url, depth
+
+    def peek_score(self):
+        """次に取り出すURLのスコアを返す"""
+        return self.heap[0][0]
+
+    def spill(self, count):
+        """スコアの大きい（最後に取り出す）URLをcount件取り除き、(スコア, URL, 深さ)をスコア順に返す"""
+        self.heap.sort()
+        removed = self.heap[len(self.heap) - count:]
+        # 昇順に並んだリストはそのままヒープとして使える
+        del self.heap[len(self.heap) - count:]
+        for _, _, url, _ in removed:
+            self.members.discard(url)
+        return [(score, url, depth) for score, _, url, depth in removed]
+
+    def rescore(self):
+        """現在のscorerの状態でキュー全体のスコアを計算し直す"""
+        self.heap = [(self.scorer.score(url, depth), seq, url, depth) for _, seq, url, depth in self.heap]
+        heapq.heapify(self.heap)
+        self.pops_since_rescore = 0
+
+    def __contains__(self, url):
+        return url in self.members
+
+    def __len__(self):
+        return len(self.heap)
+
+    def __bool__(self):
+        return bool(self.heap)
+
+
+class SpillingURLFrontier:
+    """
+    メモリに置くURL数をmemory_urlsまでに抑え、あふれたURLをディスクのセグメントファイルに書き出す訪問待ちキュー
+
+    scorerがない場合は幅優先: メモリの先頭部分がいっぱいになると、以降のURLは書き出し用の
+    バッファにためてsegment_urls件ごとに1ファイルとして書き出し、先頭部分が空になったら
+    古いファイルから順に読み戻す（追加順は変わらない）。
+    scorerがある場合はスコア順: メモリのキューがmemory_urlsを超えるとスコアの大きい
+    segment_urls件をスコア順に並べて1ファイルに書き出し、ファイルの先頭のURLのスコアが
+    メモリのキューの先頭より小さくなった時点でそのファイルから少しずつ読み戻す。
+    ファイルに書き出したURLのスコアは書き出した時点のもので、読み戻したときに計算し直す。
+    ディスク上のURLの重複判定はURLの64ビットハッシュの集合（1件約12バイト）で行う。
+    """
+
+    def __init__(self, spill_dir, scorer=None, memory_urls=1_000_000, segment_urls=None, stats=None):
+        """
+        Args:
+            spill_dir: セグメントファイルを書き出すディレクトリ
+            scorer: score(url, depth)を持つオブジェクト（Noneの場合は幅優先）
+            memory_urls: メモリに置くURL数の上限
+            segment_urls: 1ファイルに書き出すURL数（Noneの場合はmemory_urlsの1/4）
+            stats: 書き出し・読み戻しの件数を集計するCounter（複数のキューで共有できる）
+        """
+        self.spill_dir = Path(spill_dir)
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        self.scorer = scorer
+        self.segment_urls = max(1, segment_urls or memory_urls // 4)
+        self.stats = stats if stats is not None else {}
+        for name in ('spilled', 'refilled', 'disk_urls', 'segments'):
+            self.stats.setdefault(name, 0)
+        if scorer is None:
+            self.head = URLFrontier()
+            # 書き出し用のバッファの分だけ先頭部分を小さくする
+            self.head_limit = max(1, memory_urls - self.segment_urls)
+            self.tail = []
+            self.segments = deque()
+        else:
+            self.head = PriorityURLFrontier(scorer)
+            self.head_limit = max(self.segment_urls, memory_urls)
+            # (先頭のURLのスコア, 連番, [パス, 次に読む位置])のヒープ
+            self.runs = []
+            self.run_counter = itertools.count()
+        self.spilled_members = FingerprintURLSet(SPILLED_SET_SIZE)
+        self.disk_size = 0
+        self.size = 0
+
+    def push(self, url, depth=0):
+        """URLを追加する。既にキューにある場合は追加せずFalseを返す"""
+        if url in self.head or (self.disk_size and url in self.spilled_members):
+            return False
+        self.size += 1
+        if self.scorer is not None:
+            self.head.push(url, depth)
+            if len(self.head) > self.head_limit:
+                self.write_run(self.head.spill(self.segment_urls))
+            return True
+        # 幅優先の順を保つため、ディスクにURLが残っている間は新しいURLも後ろに回す
+        if not self.disk_size and len(self.head) < self.head_limit:
+            self.head.push(url, depth)
+            return True
+        self.tail.append((url, depth))
+        self.add_spilled(url)
+        if len(self.tail) >= self.segment_urls:
+            self.segments.append(self.write_segment(json.dumps([depth, url]) for url, depth in self.tail))
+            self.tail = []
+        return True
+
+    def add_spilled(self, url):
+        self.spilled_members.add(url)
+        self.disk_size += 1
+        self.stats['spilled'] += 1
+        self.stats['disk_urls'] += 1
+
+    def write_segment(self, lines):
+        """1行1URLのセグメントファイルを書き出してパスを返す"""
+        fd, path = tempfile.mkstemp(prefix='segment_', suffix='.jsonl', dir=self.spill_dir)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(''.join(line + '\n' for line in lines))
+        self.stats['segments'] += 1
+        return path
+
+    def remove_segment(self, path):
+        os.unlink(path)
+        self.stats['segments'] -= 1
+
+    def write_run(self, entries):
+        """スコア順に並んだ(スコア, URL, 深さ)をファイルに書き出す"""
+        for _, url, _ in entries:
+            self.add_spilled(url)
+        path = self.write_segment(json.dumps([score, depth, url]) for score, url, depth in entries)
+        heapq.heappush(self.runs, (entries[0][0], next(self.run_counter), [path, 0]))
+
+    def refill(self):
+        """ディスクに書き出したURLのうち、次に取り出すべきものをメモリに読み戻す"""
+        if self.scorer is None:
+            self.refill_segment()
+        else:
+            self.refill_run()
+        if not self.disk_size and len(self.spilled_members.table) > SPILLED_SET_SIZE:
+            # ディスク上のURLがなくなったら、大きくなった集合の表を小さく作り直す
+            self.spilled_members = FingerprintURLSet(SPILLED_SET_SIZE)
+
+    def refill_segment(self):
+        """先頭部分が空になったら、最も古いセグメントファイル（なければ書き出し用のバッファ）を読み戻す"""
+        if self.head:
+            return
+        if self.segments:
+            path = self.segments.popleft()
+            with open(path, encoding='utf-8') as f:
+                entries = [json.loads(line) for line in f]
+            self.remove_segment(path)
+        else:
+            entries = [(depth, url) for url, depth in self.tail]
+            self.tail = []
+        for depth, url in entries:
+            self.spilled_members.discard(url)
+            self.head.push(url, depth)
+        self.count_refilled(len(entries))
+
+    def refill_run(self):
+        """先頭のURLのスコアが最も小さいファイルが、メモリのキューの先頭より小さければ少しずつ読み戻す"""
+        while self.runs and (not self.head or self.runs[0][0] < self.head.peek_score()):
+            _, seq, run = heapq.heappop(self.runs)
+            path, offset = run
+            # 一度に読み戻す量を抑え、読み戻した直後に書き出し直すのを避ける
+            count = max(1, self.segment_urls // 8)
+            entries = []
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                for _ in range(count):
+                    line = f.readline()
+                    if not line:
+                        break
+                    entries.append(json.loads(line))
+                run[1] = f.tell()
+                next_line = f.readline()
+            for _, depth, url in entries:
+                self.spilled_members.discard(url)
+                self.head.push(url, depth)
+            self.count_refilled(len(entries))
+            if next_line:
+                heapq.heappush(self.runs, (json.loads(next_line)[0], seq, run))
+            else:
+                self.remove_segment(path)
+
+    def count_refilled(self, count):
+        self.disk_size -= count
+        self.stats['refilled'] += count
+        self.stats['disk_urls'] -= count
+
+    def peek(self):
+        """次に取り出すURLを返す（取り出さない）"""
+        self.refill()
+        return self.head.peek()
+
+    def pop(self):
+        """次のURLを取り出す"""
+        return self.pop_with_depth()[0]
+
+    def pop_with_depth(self):
+        """次のURLをその深さとともに取り出す"""
+        self.refill()
+        url, depth = self.head.pop_with_depth()
+        self.size -= 1
+        return url, depth
+
+    def close(self):
+        """ディスクに残ったセグメントファイルを削除する"""
+        paths = list(self.segments) if self.scorer is None else [run[0] for _, _, run in self.runs]
+        for path in paths:
+            self.remove_segment(path)
+        self.stats['disk_urls'] -= self.disk_size
+        if self.scorer is None:
+            self.segments.clear()
+            self.tail = []
+        else:
+            self.runs = []
+        self.size -= self.disk_size
+        self.disk_size = 0
+        self.spilled_members = FingerprintURLSet(SPILLED_SET_SIZE)
+
+    def __contains__(self, url):
+        return url in self.head or (self.disk_size > 0 and url in self.spilled_members)
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+
+class MultiDomainFrontier:
+    """
+    ドメイン（ホスト）ごとに訪問待ちキューを分け、リクエストを送れるドメインから順に取り出すキュー
+
+    pop時にscheduler（HostScheduler）の待ち時間が最も短いドメインを選び、待ち時間のない
+    ドメインが複数あれば順番に回す。あるサイトのリクエスト間隔を待つ間に他のサイトのURLを
+    取得できるため、全体の取得速度は各サイトの上限の合計になる。
+    concurrency（AdaptiveConcurrency）を渡すと、同時リクエスト数が上限に達しているドメインは後回しにする。
+    """
+
+    def __init__(self, scheduler, make_queue=URLFrontier, concurrency=None):
+        """
+        Args:
+            scheduler: ドメインごとの待ち時間を返すHostScheduler
+            make_queue: ドメインごとのキューを作る関数（URLFrontier、PriorityURLFrontierなど）
+            concurrency: ドメインごとの同時リクエスト数を管理するAdaptiveConcurrency
+        """
+        self.scheduler = scheduler
+        self.make_queue = make_queue
+        self.concurrency = concurrency
+        self.queues = {}
+        # 待ち時間のないドメインを順番に回すための並び（取り出したドメインは末尾に回す）
+        self.order = deque()
+        self.size = 0
+
+    def push(self, url, depth=0):
+        """URLをドメインのキューに追加する。既にキューにある場合は追加せずFalseを返す"""
+        domain = self.scheduler.host_of(url)
+        queue = self.queues.get(domain)
+        if queue is None:
+            queue = self.queues[domain] = self.make_queue()
+            self.order.append(domain)
+        if not queue.push(url, depth):
+            return False
+        self.size += 1
+        return True
+
+    def select(self):
+        """次に取り出すドメインを選ぶ"""
+        best = None
+        best_key = None
+        for domain in self.order:
+            queue = self.queues[domain]
+            # 同時リクエスト数に空きのないドメインは、他に候補がない場合だけ選ぶ
+            busy = self.concurrency is not None and not self.concurrency.has_capacity(queue.peek())
+            wait = max(0.0, self.scheduler.host_wait_time(domain))
+            key = (busy, wait)
+            if key == (False, 0.0):
+                return domain
+            if best_key is None or key < best_key:
+                best, best_key = domain, key
+        if best is None:
+            raise IndexError('pop from an empty frontier')
+        return best
+
+    def has_capacity(self):
+        """同時リクエスト数に空きのあるドメインにURLが残っているかどうか"""
+        if self.concurrency is None:
+            return bool(self.size)
+        return any(self.concurrency.has_capacity(self.queues[domain].peek()) for domain in self.order)
+
+    def peek(self):
+        """次に取り出すURLを返す（取り出さない）"""
+        return self.queues[self.select()].peek()
+
+    def pop(self):
+        """次に取り出すドメインのURLを取り出す"""
+        return self.pop_with_depth()[0]
+
+    def pop_with_depth(self):
+        """次に取り出すドメインのURLをその深さとともに取り出す"""
+        domain = self.select()
+        queue = self.queues[domain]
+        url, depth = queue.pop_with_depth()
+        self.size -= 1
+        self.order.remove(domain)
+        if queue:
+            self.order.append(domain)
+        else:
+            del self.queues[domain]
+        return url, depth
+
+    def sizes(self):
+        """ドメインごとの訪問待ちURL数を返す"""
+        return {domain: len(queue) for domain, queue in self.queues.items()}
+
+    def format(self, max_domains=5):
+        """進捗表示用の1行の表記を返す（訪問待ちURLの多いドメインから順に）"""
+        sizes = sorted(self.sizes().items(), key=lambda item: (-item[1], item[0]))
+        if not sizes:
+            return '-'
+        text = ', '.join(f"{domain} {size:,}" for domain, size in sizes[:max_domains])
+        if len(sizes) > max_domains:
+            text += f" (+{len(sizes) - max_domains} domains)"
+        return text
+
+    def __contains__(self, url):
+        queue = self.queues.get(self.scheduler.host_of(url))
+        return queue is not None and url in queue
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
@@ -0,0 +1,116 @@
+import math
+import re
+from collections import defaultdict
+from urllib.parse import urlparse
+
+# 収集したい詳細ページのURLパターン（DLsiteの作品ページ、FANZAの商品ページ）
+DEFAULT_TARGET_PATTERNS = (
+    r'/work/=/product_id/',
+    r'/detail/=/cid=',
+)
+
+# パターンごとのスコアの加算値（負の値ほど優先して取得する）
+DEFAULT_PRIORITY_PATTERNS = (
+    (r'/work/=/product_id/', -2.0),
+    (r'/detail/=/cid=', -2.0),
+    # タグ・ランキング・検索結果などのナビゲーションページは後回しにする
+    (r'/(ranking|tag|tags|genre|search|sort)(/|=|\?|$)', 3.0),
+)
+
+
+class URLScorer:
+    """
+    PriorityURLFrontierで使うURLのスコア（小さいほど先に取得する）を計算する
+
+    スコアは次の3つの和になる。
+    - 深さ: depth_weight × 開始URLからのリンク数
+    - URLパターン: priority_patternsのうち一致したものの加算値
+    - 収穫量: パスの先頭prefix_depth階層が同じページ群から、1ページあたりに見つかった
+      新しい詳細ページ（target_patternsに一致するURL）の数。取得済みのページから学習し、
+      yield_weight × log(1 + 収穫量)を差し引く
+
+    取得数の少ないプレフィックスの収穫量は、prior_pagesページ分だけ全体の平均に寄せて推定する。
+    target_patternsが空の場合は、新しく見つかったURLの数を収穫量とする。
+    link_scores（前回の収集で記録したリンクグラフのPageRankなど）を渡すと、
+    link_weight × log(1 + 相対スコア)も差し引き、よくリンクされているページを先に取得する。
+    """
+
+    def __init__(self, priority_patterns=DEFAULT_PRIORITY_PATTERNS, target_patterns=DEFAULT_TARGET_PATTERNS,
+                 depth_weight=1.0, yield_weight=5.0, prefix_depth=2, prior_pages=2, link_scores=None, link_weight=2.0):
+        """
+        Args:
+            priority_patterns: (正規表現, 加算値)のリスト
+            target_patterns: 収集したい詳細ページのURLの正規表現のリスト
+            depth_weight: 深さ1あたりの加算値
+            yield_weight: 収穫量の重み
+            prefix_depth: 収穫量を集計するパスの階層数
+            prior_pages: 収穫量の推定を全体の平均に寄せる強さ（ページ数）
+            link_scores: URLごとの相対スコア（全ページの平均が1。LinkGraph.link_scores()の戻り値）
+            link_weight: link_scoresの重み
+        """
+        self.priority_patterns = [(re.compile(pattern), weight) for pattern, weight in priority_patterns or ()]
+        self.target_patterns = [re.compile(pattern) for pattern in target_patterns or ()]
+        self.depth_weight = depth_weight
+        self.yield_weight = yield_weight
+        self.prefix_depth = prefix_depth
+        self.prior_pages = prior_pages
+        # プレフィックスごとの [取得ページ数, 見つかった新しいURL数（target_patternsがあれば詳細ページ数）]
+        self.prefix_stats = defaultdict(lambda: [0, 0])
+        self.total_pages = 0
+        self.total_found = 0
+        self.link_scores = link_scores or {}
+        self.link_weight = link_weight
+
+    def prefix_of(self, url):
+        """URLのパスの先頭prefix_depth階層を返す（'/work/=/product_id/RJ01.html' -> '/work/=/'）"""
+        segments = [segment for segment in urlparse(url).path.split('/') if segment]
+        return '/' + ''.join(f"{segment}/" for segment in segments[:self.prefix_depth])
+
+    def is_target(self, url):
+        """収集したい詳細ページのURLかどうか"""
+        return any(pattern.search(url) for pattern in self.target_patterns)
+
+    def observe(self, url, new_urls, new_targets):
+        """
+        取得したページから見つかった新しいURLの数を記録する
+
+        Args:
+            url: 取得したページのURL
+            new_urls: 新しく見つかったURLの数
+            new_targets: そのうち詳細ページのURLの数
+        """
+        found = new_targets if self.target_patterns else new_urls
+        stats = self.prefix_stats[self.prefix_of(url)]
+        stats[0] += 1
+        stats[1] += found
+        self.total_pages += 1
+        self.total_found += found
+
+    def learned_yield(self, prefix):
+        """プレフィックスの1ページあたりの収穫量の推定値"""
+        mean = self.total_found / self.total_pages if self.total_pages else 0.0
+        pages, found = self.prefix_stats.get(prefix, (0, 0))
+        return (found + self.prior_pages * mean) / (pages + self.prior_pages)
+
+    def score(self, url, depth=0):
+        """URLのスコアを返す（小さいほど優先）"""
+        score = self.depth_weight * depth
+        for pattern, weight in self.priority_patterns:
+            if pattern.search(url):
+                score += weight
+        score -= self.yield_weight * math.log1p(self.learned_yield(self.prefix_of(url)))
+        if self.link_scores:
+            score -= self.link_weight * math.log1p(self.link_scores.get(url, 0.0))
+        return score
+
+    def __getstate__(self):
+        # defaultdictのlambdaはpickleできないため、通常の辞書にして別プロセスへ渡す
+        state = self.__dict__.copy()
+        state['prefix_stats'] = dict(self.prefix_stats)
+        return state
+
+    def __setstate__(self, state):
+        prefix_stats = defaultdict(lambda: [0, 0])
+        prefix_stats.update(state['prefix_stats'])
+        state['prefix_stats'] = prefix_stats
+        self.__dict__.update(state)
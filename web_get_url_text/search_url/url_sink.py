@@ -0,0 +1,103 @@
+import io
+import json
+import os
+from pathlib import Path
+
+from visited_set import FingerprintURLSet
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class URLSink:
+    """
+    収集したURLを1行1URLのJSONL形式で追記していく出力先
+
+    バッチごとに追記するだけなので、件数が増えても既存の内容を読み直さない。
+    compress=Trueの場合はバッチごとにzstdのフレームとして追記する（zstandardが必要）。
+    """
+
+    def __init__(self, path, compress=False, fsync_every=1, append=True):
+        """
+        Args:
+            path: 出力ファイルのパス
+            compress: zstdで圧縮するかどうか
+            fsync_every: 何バッチごとにfsyncするか（0の場合はfsyncしない）
+            append: Falseの場合は既存の内容を消して書き始める
+        """
+        if compress and zstandard is None:
+            raise ImportError("compress=Trueにはzstandardパッケージが必要です: pip install zstandard")
+        self.path = Path(path)
+        self.compress = compress
+        self.fsync_every = fsync_every
+        self.batches_since_sync = 0
+        self.file = open(self.path, 'ab' if append else 'wb')
+        self.compressor = zstandard.ZstdCompressor() if compress else None
+
+    def write(self, urls):
+        """URLのリストを1バッチとして追記する"""
+        data = ''.join(json.dumps(url, ensure_ascii=False) + '\n' for url in urls).encode('utf-8')
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self.file.write(data)
+        self.file.flush()
+
+        self.batches_since_sync += 1
+        if self.fsync_every and self.batches_since_sync >= self.fsync_every:
+            os.fsync(self.file.fileno())
+            self.batches_since_sync = 0
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.file.flush()
+        if self.fsync_every:
+            os.fsync(self.file.fileno())
+        self.file.close()
+
+
+def iter_sink(path):
+    """URLSinkの出力ファイルからURLを1件ずつ読み出す"""
+    path = Path(path)
+    if not path.exists():
+        return
+    with open(path, 'rb') as f:
+        if path.suffix == '.zst':
+            if zstandard is None:
+                raise ImportError(f"{path} の読み込みにはzstandardパッケージが必要です: pip install zstandard")
+            stream = zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True)
+        else:
+            stream = f
+        for line in io.TextIOWrapper(stream, encoding='utf-8'):
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+def write_merged(sink_paths, merged_path, capacity=1 << 20):
+    """
+    出力ファイルを順に読みながら重複を除去し、JSON配列として書き出す
+
+    全URLをメモリに載せず、重複判定には64ビットハッシュの集合だけを使う。
+
+    Returns:
+        tuple: (ユニークURL数, 除去した重複数)
+    """
+    seen = FingerprintURLSet(capacity)
+    unique_count = 0
+    duplicate_count = 0
+    with open(merged_path, 'w', encoding='utf-8') as out:
+        out.write('[')
+        for sink_path in sink_paths:
+            for url in iter_sink(sink_path):
+                if url in seen:
+                    duplicate_count += 1
+                    continue
+                seen.add(url)
+                out.write(',\n    ' if unique_count else '\n    ')
+                out.write(json.dumps(url, ensure_ascii=False))
+                unique_count += 1
+        out.write('\n]\n' if unique_count else ']\n')
+    return unique_count, duplicate_count
@@ -0,0 +1,206 @@
+import hashlib
+import math
+import sys
+from array import array
+
+
+def fingerprint64(item):
+    """文字列から64ビットのフィンガープリントを計算する（0は空きスロット用に使わない）"""
+    digest = hashlib.blake2b(item.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+class ExactURLSet:
+    """URL文字列をそのまま保持する通常のset（誤判定なし）"""
+
+    def __init__(self):
+        self.items = set()
+        self.string_bytes = 0
+
+    def add(self, item):
+        if item not in self.items:
+            self.items.add(item)
+            self.string_bytes += sys.getsizeof(item)
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+    def memory_bytes(self):
+        return sys.getsizeof(self.items) + self.string_bytes
+
+
+class FingerprintURLSet:
+    """
+    URLの64ビットハッシュだけをオープンアドレス法のarrayに保持するset
+
+    1件あたり約12バイトで済む。異なるURLのハッシュが衝突する確率は
+    1千万件で約3e-6と無視できる程度。
+    """
+
+    max_load = 0.7
+
+    def __init__(self, capacity=1 << 16):
+        size = 1
+        while size * self.max_load < capacity:
+            size <<= 1
+        self.table = array('Q', bytes(8 * size))
+        self.mask = size - 1
+        self.count = 0
+
+    def find_slot(self, fp):
+        table, mask = self.table, self.mask
+        i = fp & mask
+        while True:
+            value = table[i]
+            if value == 0 or value == fp:
+                return i
+            i = (i + 1) & mask
+
+    def add_fingerprint(self, fp):
+        i = self.find_slot(fp)
+        if self.table[i] == 0:
+            self.table[i] = fp
+            self.count += 1
+            if self.count > len(self.table) * self.max_load:
+                self.grow()
+
+    def grow(self):
+        old_table = self.table
+        self.table = array('Q', bytes(16 * len(old_table)))
+        self.mask = len(self.table) - 1
+        for fp in old_table:
+            if fp:
+                self.table[self.find_slot(fp)] = fp
+
+    def add(self, item):
+        self.add_fingerprint(fingerprint64(item))
+
+    def discard(self, item):
+        """要素を取り除く（同じ探索列の後続の要素を入れ直し、探索が途切れないようにする）"""
+        table, mask = self.table, self.mask
+        i = self.find_slot(fingerprint64(item))
+        if table[i] == 0:
+            return
+        table[i] = 0
+        self.count -= 1
+        while True:
+            i = (i + 1) & mask
+            fp = table[i]
+            if fp == 0:
+                return
+            table[i] = 0
+            table[self.find_slot(fp)] = fp
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item):
+        return self.table[self.find_slot(fingerprint64(item))] != 0
+
+    def __len__(self):
+        return self.count
+
+    def memory_bytes(self):
+        return self.table.itemsize * len(self.table)
+
+
+class BloomFilter:
+    """固定容量のブルームフィルタ"""
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def positions(self, item):
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        for pos in self.positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self.positions(item))
+
+    def memory_bytes(self):
+        return len(self.bits)
+
+
+class ScalableBloomFilter:
+    """
+    件数に応じて自動で拡張するブルームフィルタ
+
+    誤判定（未訪問URLを訪問済みと判定してしまう）の確率は全体でerror_rate以下に保たれる。
+    誤判定されたURLは収集対象から漏れるため、件数が多くメモリが厳しい場合にのみ使う。
+    """
+
+    def __init__(self, capacity=1_000_000, error_rate=0.001, growth=2, tightening=0.5):
+        self.initial_capacity = capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        # 各段の誤判定率の合計がerror_rateに収まるよう、初段は(1 - tightening)倍にする
+        self.filters = [BloomFilter(capacity, error_rate * (1 - tightening))]
+
+    def add(self, item):
+        if item in self:
+            return
+        current = self.filters[-1]
+        if current.count >= current.capacity:
+            current = BloomFilter(current.capacity * self.growth,
+                                  self.error_rate * (1 - self.tightening) * self.tightening ** len(self.filters))
+            self.filters.append(current)
+        current.add(item)
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item):
+        return any(item in f for f in reversed(self.filters))
+
+    def __len__(self):
+        return sum(f.count for f in self.filters)
+
+    def memory_bytes(self):
+        return sum(f.memory_bytes() for f in self.filters)
+
+
+VISITED_SET_BACKENDS = {
+    'exact': ExactURLSet,
+    'fingerprint': FingerprintURLSet,
+    'bloom': ScalableBloomFilter,
+}
+
+
+def make_url_set(backend='exact', capacity=1_000_000, error_rate=0.001):
+    """
+    訪問済み・発見済みURL集合を作成する
+
+    Args:
+        backend: 'exact'（通常のset）, 'fingerprint'（64ビットハッシュ）, 'bloom'（スケーラブルブルームフィルタ）
+        capacity: 想定件数（fingerprint/bloomの初期サイズ）
+        error_rate: bloomの誤判定率
+    """
+    if backend == 'exact':
+        return ExactURLSet()
+    if backend == 'fingerprint':
+        return FingerprintURLSet(capacity)
+    if backend == 'bloom':
+        return ScalableBloomFilter(capacity, error_rate)
+    raise ValueError(f"不明なURL集合のバックエンドです: {backend} (選択肢: {', '.join(VISITED_SET_BACKENDS)})")